@@ -0,0 +1,139 @@
+# app/analytics.py
+import logging
+
+from app.db_backends import DatabaseError, get_storage
+
+logger = logging.getLogger(__name__)
+
+# Running totals per (month, category, vendor), kept in step with the invoices table
+SUMMARY_SCHEMA = {
+    'mysql': """
+        CREATE TABLE IF NOT EXISTS invoice_summary (
+            month CHAR(7) NOT NULL,
+            category VARCHAR(50) NOT NULL,
+            vendor VARCHAR(255) NOT NULL,
+            invoice_count INT NOT NULL DEFAULT 0,
+            total_amount DECIMAL(16, 2) NOT NULL DEFAULT 0,
+            total_tax DECIMAL(16, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, category, vendor)
+        )
+    """,
+    'sqlite': """
+        CREATE TABLE IF NOT EXISTS invoice_summary (
+            month CHAR(7) NOT NULL,
+            category VARCHAR(50) NOT NULL,
+            vendor VARCHAR(255) NOT NULL,
+            invoice_count INTEGER NOT NULL DEFAULT 0,
+            total_amount DECIMAL(16, 2) NOT NULL DEFAULT 0,
+            total_tax DECIMAL(16, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, category, vendor)
+        )
+    """,
+}
+
+# Folds a contiguous id range of new invoices into the summary. Invoices without a
+# date are counted under month '' so category and vendor totals still include them.
+_SUMMARY_SELECT = """
+    SELECT COALESCE(SUBSTR(invoice_date, 1, 7), ''), COALESCE(category, ''), vendor,
+           COUNT(*), COALESCE(SUM(amount), 0), COALESCE(SUM(tax), 0)
+    FROM invoices WHERE id BETWEEN %s AND %s
+    GROUP BY 1, 2, 3
+"""
+SUMMARY_UPSERT = {
+    'mysql': """
+        INSERT INTO invoice_summary (month, category, vendor, invoice_count, total_amount, total_tax)
+    """ + _SUMMARY_SELECT + """
+        ON DUPLICATE KEY UPDATE
+            invoice_count = invoice_count + VALUES(invoice_count),
+            total_amount = total_amount + VALUES(total_amount),
+            total_tax = total_tax + VALUES(total_tax)
+    """,
+    'sqlite': """
+        INSERT INTO invoice_summary (month, category, vendor, invoice_count, total_amount, total_tax)
+    """ + _SUMMARY_SELECT + """
+        ON CONFLICT (month, category, vendor) DO UPDATE SET
+            invoice_count = invoice_count + excluded.invoice_count,
+            total_amount = total_amount + excluded.total_amount,
+            total_tax = total_tax + excluded.total_tax
+    """,
+}
+
+
+def init_summary(db, backend):
+    """Create the summary table and build it from history the first time"""
+    db.execute(SUMMARY_SCHEMA[backend])
+    if db.query_one("SELECT 1 AS present FROM invoice_summary LIMIT 1"):
+        return
+    bounds = db.query_one("SELECT MIN(id) AS first, MAX(id) AS last FROM invoices")
+    if bounds and bounds['first'] is not None:
+        update_summary(db, backend, bounds['first'], bounds['last'])
+        logger.info("Invoice summary rebuilt from existing invoices")
+
+
+def update_summary(db, backend, first_id, last_id):
+    """Add invoices first_id..last_id to the running totals (call inside the insert transaction)"""
+    db.execute(SUMMARY_UPSERT[backend], (first_id, last_id))
+
+
+def _month_clauses(date_from=None, date_to=None):
+    """WHERE clauses for a date range; the summary is kept per month, so ranges are too:
+    date_from and date_to select their whole months"""
+    clauses, params = ["month <> ''"], []
+    if date_from:
+        clauses.append("month >= %s")
+        params.append(date_from.strftime("%Y-%m"))
+    if date_to:
+        clauses.append("month <= %s")
+        params.append(date_to.strftime("%Y-%m"))
+    return clauses, params
+
+
+def _totals(query, params):
+    try:
+        with get_storage().session() as db:
+            rows = db.query(query, tuple(params))
+    except DatabaseError as e:
+        logger.error("Error fetching analytics", extra={'error': str(e)})
+        return []
+    for row in rows:
+        if row.get('category') == '':
+            row['category'] = None
+        row['invoice_count'] = int(row['invoice_count'])
+        row['total_amount'] = float(row['total_amount'])
+        row['total_tax'] = float(row['total_tax'])
+    return rows
+
+
+def get_monthly_totals(date_from=None, date_to=None):
+    clauses, params = _month_clauses(date_from, date_to)
+    query = f"""
+        SELECT month, SUM(invoice_count) AS invoice_count, SUM(total_amount) AS total_amount,
+               SUM(total_tax) AS total_tax
+        FROM invoice_summary WHERE {' AND '.join(clauses)}
+        GROUP BY month ORDER BY month
+    """
+    return _totals(query, params)
+
+
+def get_category_totals(date_from=None, date_to=None):
+    clauses, params = _month_clauses(date_from, date_to) if (date_from or date_to) else ([], [])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    query = f"""
+        SELECT category, SUM(invoice_count) AS invoice_count, SUM(total_amount) AS total_amount,
+               SUM(total_tax) AS total_tax
+        FROM invoice_summary {where}
+        GROUP BY category ORDER BY total_amount DESC
+    """
+    return _totals(query, params)
+
+
+def get_vendor_totals(limit=20, date_from=None, date_to=None):
+    clauses, params = _month_clauses(date_from, date_to) if (date_from or date_to) else ([], [])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    query = f"""
+        SELECT vendor, SUM(invoice_count) AS invoice_count, SUM(total_amount) AS total_amount,
+               SUM(total_tax) AS total_tax
+        FROM invoice_summary {where}
+        GROUP BY vendor ORDER BY total_amount DESC LIMIT %s
+    """
+    return _totals(query, params + [limit])
@@ -0,0 +1,261 @@
+# app/blobs.py
+"""Storage for the bulky parts of an invoice, kept out of the invoices table.
+
+OCR text is compressed into invoice_blobs, one row per invoice, and read only when a
+client asks for it. Uploaded originals are kept once per content hash under BLOB_DIR
+(data/blobs/ab/cd/abcd...), however many times they were uploaded; invoice_blobs links
+each invoice to its original.
+"""
+import logging
+import os
+import re
+import shutil
+import zlib
+
+from app.db_backends import get_storage
+from config import BLOB_COMPRESSION, BLOB_DIR, UPLOAD_DIR
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is used without it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+BLOB_SCHEMA = {
+    'mysql': """
+        CREATE TABLE IF NOT EXISTS invoice_blobs (
+            invoice_id INT PRIMARY KEY,
+            text_codec VARCHAR(8),
+            text_data LONGBLOB,
+            text_size INT,
+            content_hash CHAR(64),
+            KEY idx_invoice_blobs_content_hash (content_hash)
+        )
+    """,
+    'sqlite': """
+        CREATE TABLE IF NOT EXISTS invoice_blobs (
+            invoice_id INTEGER PRIMARY KEY,
+            text_codec VARCHAR(8),
+            text_data BLOB,
+            text_size INTEGER,
+            content_hash CHAR(64)
+        )
+    """,
+}
+_SQLITE_INDEX = "CREATE INDEX IF NOT EXISTS idx_invoice_blobs_content_hash ON invoice_blobs (content_hash)"
+
+INSERT_BLOBS = "INSERT INTO invoice_blobs (invoice_id, text_codec, text_data, text_size, content_hash)"
+
+_IN_CLAUSE_LIMIT = 500
+# Originals are stored under their SHA-256
+_HASH_NAME = re.compile(r'[0-9a-f]{64}')
+
+
+def init_blobs(db, backend):
+    db.execute(BLOB_SCHEMA[backend])
+    if backend == 'sqlite':
+        db.execute(_SQLITE_INDEX)
+
+
+def _codec():
+    if BLOB_COMPRESSION == 'zstd' or (BLOB_COMPRESSION == 'auto' and zstandard is not None):
+        if zstandard is None:
+            raise RuntimeError("BLOB_COMPRESSION=zstd needs the zstandard package: pip install zstandard")
+        return 'zstd'
+    return 'zlib'
+
+
+def compress_text(text):
+    """(codec, bytes) for OCR text; the codec is stored with it so either can be read back"""
+    data = text.encode('utf-8')
+    if _codec() == 'zstd':
+        return 'zstd', zstandard.ZstdCompressor(level=9).compress(data)
+    return 'zlib', zlib.compress(data, 9)
+
+
+def decompress_text(codec, data):
+    if data is None:
+        return None
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Text was stored with zstd; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    if codec == 'zlib':
+        return zlib.decompress(data).decode('utf-8')
+    raise ValueError(f"Unknown text codec: {codec}")
+
+
+def store_blobs(db, rows):
+    """Insert (invoice_id, raw_text, content_hash) rows (call inside the insert transaction)"""
+    values = []
+    for invoice_id, raw_text, content_hash in rows:
+        codec, data = compress_text(raw_text) if raw_text else (None, None)
+        values.append((invoice_id, codec, data, len(raw_text) if raw_text else None, content_hash))
+    if values:
+        db.insert_many(INSERT_BLOBS, values)
+
+
+def _blob_rows(db, invoice_ids, columns):
+    rows = {}
+    invoice_ids = list(invoice_ids)
+    for start in range(0, len(invoice_ids), _IN_CLAUSE_LIMIT):
+        chunk = invoice_ids[start:start + _IN_CLAUSE_LIMIT]
+        query = (f"SELECT invoice_id, {columns} FROM invoice_blobs "
+                 f"WHERE invoice_id IN ({', '.join(['%s'] * len(chunk))})")
+        for row in db.query(query, tuple(chunk)):
+            rows[row['invoice_id']] = row
+    return rows
+
+
+def load_texts(db, rows):
+    """Fill in raw_text for invoice rows (dicts with 'id') in one query per 500 rows.
+
+    Rows written before the text moved out still carry it inline and are left as they are.
+    """
+    missing = [row['id'] for row in rows if row.get('raw_text') is None]
+    if not missing:
+        return rows
+    blobs = _blob_rows(db, missing, "text_codec, text_data")
+    for row in rows:
+        blob = blobs.get(row['id'])
+        if row.get('raw_text') is None and blob is not None:
+            row['raw_text'] = decompress_text(blob['text_codec'], blob['text_data'])
+    return rows
+
+
+def original_path(content_hash):
+    return os.path.join(BLOB_DIR, content_hash[:2], content_hash[2:4], content_hash)
+
+
+def find_original(invoice_id):
+    """(path, content_hash) of the file an invoice was read from, or None if it isn't kept"""
+    with get_storage().session() as db:
+        row = db.query_one("SELECT content_hash FROM invoice_blobs WHERE invoice_id = %s", (invoice_id,))
+    if not row or not row['content_hash']:
+        return None
+    path = original_path(row['content_hash'])
+    return (path, row['content_hash']) if os.path.exists(path) else None
+
+
+def store_original(file_path, content_hash):
+    """Move an upload into the content-addressed store and return its new path.
+
+    If the same content is already stored, the upload is simply removed.
+    """
+    path = original_path(content_hash)
+    if os.path.exists(path):
+        os.remove(file_path)
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.replace(file_path, path)
+    except OSError:
+        # BLOB_DIR on another filesystem: copy next to the target, then swap it in
+        shutil.copyfile(file_path, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        os.remove(file_path)
+    return path
+
+
+def migrate(batch_size=500, upload_dir=UPLOAD_DIR):
+    """Move inline raw_text and the files in upload_dir of existing invoices into blob storage.
+
+    Works through the table in id order, committing every batch_size invoices, so it can
+    run while the API is serving and be restarted after an interruption. Returns counts.
+    """
+    from app.cache import file_hash
+
+    storage = get_storage()
+    counts = {'texts': 0, 'text_bytes': 0, 'stored_bytes': 0, 'originals': 0, 'missing_files': 0}
+    last_id = 0
+    while True:
+        with storage.session() as db:
+            rows = db.query(
+                "SELECT invoices.id, invoices.raw_text, invoices.file_name, invoice_blobs.invoice_id AS migrated "
+                "FROM invoices LEFT JOIN invoice_blobs ON invoice_blobs.invoice_id = invoices.id "
+                "WHERE invoices.id > %s AND (invoices.raw_text IS NOT NULL OR invoice_blobs.invoice_id IS NULL) "
+                "ORDER BY invoices.id LIMIT %s",
+                (last_id, batch_size),
+            )
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            fresh, files = [], []
+            for row in rows:
+                if row['migrated'] is not None:
+                    continue
+                content_hash = None
+                file_path = os.path.join(upload_dir, row['file_name'] or "")
+                if row['file_name'] and os.path.isfile(file_path):
+                    content_hash = file_hash(file_path)
+                    files.append((file_path, content_hash))
+                elif row['file_name']:
+                    counts['missing_files'] += 1
+                fresh.append((row['id'], row['raw_text'], content_hash))
+            store_blobs(db, fresh)
+
+            # Rows that already had a blob row only need their inline copy cleared
+            moved = [row for row in rows if row['raw_text'] is not None]
+            for row in moved:
+                counts['texts'] += 1
+                counts['text_bytes'] += len(row['raw_text'].encode('utf-8'))
+            if moved:
+                ids = [row['id'] for row in moved]
+                db.execute(f"UPDATE invoices SET raw_text = NULL WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                           tuple(ids))
+        # Files move once their rows are committed, so a failed batch leaves them where they were
+        for file_path, content_hash in files:
+            store_original(file_path, content_hash)
+        counts['originals'] += len(files)
+        logger.info("Migrated invoices to blob storage", extra={'last_id': last_id, **counts})
+
+    with storage.session() as db:
+        stored = db.query_one("SELECT COALESCE(SUM(LENGTH(text_data)), 0) AS bytes FROM invoice_blobs")
+    counts['stored_bytes'] = int(stored['bytes'])
+    return counts
+
+
+def _stored_hashes():
+    """Content hashes of the originals under BLOB_DIR, by the names they are stored under"""
+    for directory, _, names in os.walk(BLOB_DIR):
+        for name in names:
+            if _HASH_NAME.fullmatch(name) and os.path.join(directory, name) == original_path(name):
+                yield name
+
+
+def compact():
+    """Drop blobs no invoice refers to any more, then give the freed space back to the filesystem.
+
+    Blob rows of deleted invoices and originals no blob row links are removed; everything
+    an invoice still refers to is left alone. Returns counts.
+    """
+    storage = get_storage()
+    counts = {'blob_rows': 0, 'originals': 0}
+    with storage.session() as db:
+        counts['blob_rows'] = db.execute(
+            "DELETE FROM invoice_blobs WHERE NOT EXISTS "
+            "(SELECT 1 FROM invoices WHERE invoices.id = invoice_blobs.invoice_id)"
+        )
+        referenced = {row['content_hash'] for row in db.query(
+            "SELECT DISTINCT content_hash FROM invoice_blobs WHERE content_hash IS NOT NULL")}
+    unlinked = [content_hash for content_hash in _stored_hashes() if content_hash not in referenced]
+    if unlinked:
+        # An upload commits its blob row before moving its file in, so a file that appeared
+        # since the query above is linked by now: ask again before removing anything
+        with storage.session() as db:
+            for content_hash in unlinked:
+                if db.query_one("SELECT 1 AS linked FROM invoice_blobs WHERE content_hash = %s",
+                                (content_hash,)) is None:
+                    os.remove(original_path(content_hash))
+                    counts['originals'] += 1
+
+    with storage.session() as db:
+        if storage.name == 'sqlite':
+            db.commit()
+            db.execute("VACUUM")
+        else:
+            db.query("OPTIMIZE TABLE invoices")
+            db.query("OPTIMIZE TABLE invoice_blobs")
+    return counts
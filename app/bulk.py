@@ -0,0 +1,223 @@
+# app/bulk.py
+import asyncio
+import json
+import logging
+import os
+import zipfile
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.blobs import store_original
+from app.cache import check_content, claim_content, release as release_claim, store as cache_store
+from app.database import save_invoices_batch
+from app.metrics import INVOICES, observe_pipeline, stage
+from app.uploads import UploadRejected, expected_family, store_upload
+from app.utils import is_allowed_file, stored_filename
+from app.scheduler import BULK
+from app.workers import EngineBusy, run_ocr
+from config import (
+    BULK_BATCH_SIZE,
+    BULK_FLUSH_INTERVAL,
+    MAX_ARCHIVE_EXPANDED_SIZE,
+    MAX_ARCHIVE_FILES,
+    MAX_FILE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# How long a bulk upload waits before retrying when the engine queue is full; work deferred
+# by the scheduler waits as long as it suggests
+_BUSY_RETRY_SECONDS = 0.5
+
+
+def _discard_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+
+def _abandon(outcome):
+    """Drop an upload that won't be saved, letting other uploads of its content proceed"""
+    release_claim(outcome['key'])
+    _discard_file(outcome['file_path'])
+
+
+def expand_archive(zip_path, upload_dir):
+    """Extract supported receipts from a zip upload.
+
+    Archives listing more than MAX_ARCHIVE_FILES entries are refused with UploadRejected.
+    Members are extracted until MAX_ARCHIVE_EXPANDED_SIZE bytes have been written, counting
+    what is actually decompressed rather than the sizes the archive declares; members past
+    that, unsupported or oversized ones and ones that can't be read (encrypted, compressed
+    with an unsupported method, corrupt) are skipped.
+
+    Returns ([(original_name, filename, file_path, content_hash), ...], [skipped member names]).
+    """
+    members, skipped = [], []
+    budget = MAX_ARCHIVE_EXPANDED_SIZE
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            entries = archive.infolist()
+            if len(entries) > MAX_ARCHIVE_FILES:
+                raise UploadRejected(413, f"Archive holds more than {MAX_ARCHIVE_FILES} files.")
+            for index, member in enumerate(entries):
+                if member.is_dir():
+                    continue
+                name = os.path.basename(member.filename)
+                if not is_allowed_file(name) or member.file_size > min(MAX_FILE_SIZE, budget):
+                    skipped.append(member.filename)
+                    continue
+
+                filename = stored_filename(name, tag=index)
+                file_path = os.path.join(upload_dir, filename)
+                try:
+                    with archive.open(member) as source:
+                        stored = store_upload(source, file_path, expected_family(name),
+                                              min(MAX_FILE_SIZE, budget), memory_limit=0)
+                except UploadRejected:
+                    skipped.append(member.filename)
+                    continue
+                except Exception as e:
+                    # RuntimeError (encrypted), NotImplementedError (compression method),
+                    # BadZipFile or zlib/lzma errors (corrupt data); store_upload removed the file
+                    logger.warning("Unreadable archive member skipped", extra={
+                        'member': member.filename, 'error': f"{type(e).__name__}: {e}"})
+                    skipped.append(member.filename)
+                    continue
+                budget -= stored['size']
+                members.append((name, filename, file_path, stored['content_hash']))
+    except BaseException:
+        for _, _, file_path, _ in members:
+            _discard_file(file_path)
+        raise
+    finally:
+        os.remove(zip_path)
+    return members, skipped
+
+
+def _public(invoice_data):
+    # Progress lines stay small; the OCR text is available from /invoices/{id}/text
+    return {key: value for key, value in invoice_data.items() if key != 'raw_text'}
+
+
+def _save_batch(outcomes):
+    """Write a batch of extracted invoices in one transaction, link them in the cache and
+    move their originals into blob storage"""
+    ids = save_invoices_batch([(outcome['data'], outcome['filename'], outcome['content_hash'])
+                               for outcome in outcomes])
+    for outcome, invoice_id in zip(outcomes, ids):
+        if invoice_id is None:
+            _abandon(outcome)
+            continue
+        cache_store(outcome['key'], outcome['content_hash'], outcome['data'], invoice_id)
+        # Uploads of the same content waiting on the claim now find this invoice
+        release_claim(outcome['key'])
+        store_original(outcome['file_path'], outcome['content_hash'])
+    return ids
+
+
+async def _extract(scheduler, batcher, slots, client, original_name, filename, file_path, content_hash):
+    with stage('cache_lookup'):
+        key, cached = await run_in_threadpool(check_content, content_hash)
+    outcome = {'file': original_name, 'filename': filename, 'file_path': file_path,
+               'key': key, 'content_hash': content_hash}
+    if not (cached and cached['invoice_id']):
+        # Only one upload of the same bytes, in this request or another, is extracted and
+        # saved at a time; the others wait and become duplicates of its invoice
+        try:
+            cached = await claim_content(key)
+        except BaseException:
+            _discard_file(file_path)
+            raise
+    if cached and cached['invoice_id']:
+        await run_in_threadpool(os.remove, file_path)
+        return dict(outcome, status="duplicate", id=cached['invoice_id'], data=cached['result'])
+
+    try:
+        if cached:
+            return dict(outcome, status="extracted", data=cached['result'])
+        async with slots:
+            estimate = await run_in_threadpool(scheduler.cost_model.estimate, run_ocr, file_path)
+            while True:
+                try:
+                    result = await scheduler.run(run_ocr, file_path, estimate=estimate, lane=BULK, client=client)
+                    break
+                except EngineBusy as e:
+                    await asyncio.sleep(getattr(e, 'retry_after', _BUSY_RETRY_SECONDS))
+
+        observe_pipeline(result['timings'])
+        # Outside the slot: NER for many files is gathered into one nlp.pipe batch
+        invoice_data, _ = await batcher.extract(result['text'], result['confidence'])
+    except BaseException:
+        # Failed, or cancelled because the client went away: nothing will be saved from it
+        _abandon(outcome)
+        raise
+    return dict(outcome, status="extracted", data=invoice_data)
+
+
+async def process_bulk(uploads, scheduler, batcher, skipped=(), client=None):
+    """Fan uploads out over the extraction engine, in the scheduler's bulk lane, and yield
+    NDJSON progress lines.
+
+    Extracted invoices are buffered and written with batched inserts, flushed when
+    BULK_BATCH_SIZE results are waiting or nothing new finished for BULK_FLUSH_INTERVAL.
+    """
+    total = len(uploads) + len(skipped)
+    counts = {'saved': 0, 'duplicate': 0, 'failed': 0, 'skipped': 0}
+    completed = 0
+
+    def line(event):
+        nonlocal completed
+        completed += 1
+        counts[event['status']] += 1
+        INVOICES.inc(source='bulk', outcome=event['status'])
+        event.update(completed=completed, total=total)
+        return json.dumps(event) + "\n"
+
+    for name in skipped:
+        yield line({'file': name, 'status': "skipped", 'error': "Unsupported or oversized file"})
+
+    # Keep the engine fed without monopolising its queue
+    slots = asyncio.Semaphore(scheduler.slots * 2)
+    pending = {asyncio.create_task(_extract(scheduler, batcher, slots, client, *upload)): upload[0]
+               for upload in uploads}
+    buffer = []
+    try:
+        while pending or buffer:
+            done = set()
+            if pending:
+                done, _ = await asyncio.wait(pending, timeout=BULK_FLUSH_INTERVAL,
+                                             return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    outcome = task.result()
+                except Exception as e:
+                    yield line({'file': name, 'status': "failed", 'error': f"Error processing file: {e}"})
+                    continue
+                if outcome['status'] == "duplicate":
+                    yield line({'file': name, 'status': "duplicate", 'id': outcome['id'],
+                                'data': _public(outcome['data'])})
+                else:
+                    buffer.append(outcome)
+
+            if buffer and (len(buffer) >= BULK_BATCH_SIZE or not done or not pending):
+                batch, buffer = buffer, []
+                with stage('saving_batch'):
+                    ids = await run_in_threadpool(_save_batch, batch)
+                for outcome, invoice_id in zip(batch, ids):
+                    if invoice_id is None:
+                        yield line({'file': outcome['file'], 'status': "failed",
+                                    'error': "Error saving invoice data"})
+                    else:
+                        yield line({'file': outcome['file'], 'status': "saved", 'id': invoice_id,
+                                    'data': _public(outcome['data'])})
+    finally:
+        # Client went away: stop feeding the engine and drop what won't be saved
+        for task in pending:
+            task.cancel()
+        for outcome in buffer:
+            _abandon(outcome)
+
+    yield json.dumps({'summary': dict(counts, total=total)}) + "\n"
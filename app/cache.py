@@ -0,0 +1,272 @@
+# app/cache.py
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import (
+    CACHE_DB_PATH,
+    CACHE_MAX_ENTRIES,
+    CACHE_MAX_BYTES,
+    CACHE_MAX_AGE,
+    CACHE_CLAIM_TIMEOUT,
+    OCR_LANG,
+    OCR_FAST_TEXT_HEIGHT,
+    OCR_MAX_PIXELS,
+    OCR_MODE,
+    OCR_PREPROCESS,
+    OCR_RECHECK_CONFIDENCE,
+    OCR_RECHECK_MAX_LINES,
+    OCR_TEXT_HEIGHT,
+    PDF_DPI,
+    PDF_TEXT_LAYER,
+)
+
+# Bump whenever preprocessing, OCR or extraction logic changes what a file produces
+PIPELINE_VERSION = 7
+
+_HASH_CHUNK = 1024 * 1024
+_EVICT_EVERY = 100
+# Seconds between checks on an upload whose content another upload is extracting
+_CLAIM_POLL_SECONDS = 0.25
+
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_stats_lock = threading.Lock()
+_stores_since_evict = 0
+
+
+def _connect():
+    conn = sqlite3.connect(CACHE_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def init_cache_db():
+    os.makedirs(os.path.dirname(CACHE_DB_PATH) or ".", exist_ok=True)
+    conn = _connect()
+    try:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS extraction_cache (
+            cache_key TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            result TEXT NOT NULL,
+            invoice_id INTEGER,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cache_last_access ON extraction_cache (last_access)"
+        )
+        # Content being extracted right now, so concurrent uploads of it save one invoice
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS extraction_claims (
+            cache_key TEXT PRIMARY KEY,
+            claimed_at REAL NOT NULL
+        )
+        """)
+    finally:
+        conn.close()
+
+
+def file_hash(file_path):
+    """SHA-256 of a file's bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(content_hash):
+    """Combine the content hash with every setting that changes the pipeline output"""
+    settings = (f"v{PIPELINE_VERSION}|dpi={PDF_DPI}|lang={OCR_LANG}|prep={OCR_PREPROCESS}"
+                f"|text={OCR_TEXT_HEIGHT}|max={OCR_MAX_PIXELS}|layer={PDF_TEXT_LAYER}")
+    if OCR_MODE == 'confidence':
+        # Left out for OCR_MODE=text, whose entries stay valid
+        settings += (f"|mode={OCR_MODE}|fast={OCR_FAST_TEXT_HEIGHT}"
+                     f"|recheck={OCR_RECHECK_CONFIDENCE}/{OCR_RECHECK_MAX_LINES}")
+    return hashlib.sha256(f"{content_hash}|{settings}".encode("utf-8")).hexdigest()
+
+
+def check_file(file_path):
+    """Hash an upload and look it up, returning (key, content_hash, cached entry or None)"""
+    content_hash = file_hash(file_path)
+    key, cached = check_content(content_hash)
+    return key, content_hash, cached
+
+
+def check_content(content_hash):
+    """Look up an upload hashed while it was received, returning (key, cached entry or None)"""
+    key = cache_key(content_hash)
+    return key, lookup(key)
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def lookup(key, record=True):
+    """Return the cached entry for a key (result + linked invoice id), or None.
+
+    record=False leaves the hit/miss counters alone, for repeated checks on one upload.
+    """
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT result, invoice_id, created_at FROM extraction_cache WHERE cache_key = ?",
+            (key,),
+        ).fetchone()
+        if row is None or time.time() - row['created_at'] > CACHE_MAX_AGE:
+            if record:
+                _count('misses')
+            return None
+        conn.execute(
+            "UPDATE extraction_cache SET last_access = ? WHERE cache_key = ?", (time.time(), key)
+        )
+    finally:
+        conn.close()
+    if record:
+        _count('hits')
+    return {'result': json.loads(row['result']), 'invoice_id': row['invoice_id']}
+
+
+def store(key, content_hash, result, invoice_id=None):
+    """Cache the extraction result for a file and link it to its invoice"""
+    global _stores_since_evict
+    payload = json.dumps(result)
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO extraction_cache "
+            "(cache_key, content_hash, result, invoice_id, size, created_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, content_hash, payload, invoice_id, len(payload), now, now),
+        )
+    finally:
+        conn.close()
+
+    with _stats_lock:
+        _stores_since_evict += 1
+        due = _stores_since_evict >= _EVICT_EVERY
+        if due:
+            _stores_since_evict = 0
+    if due:
+        evict()
+
+
+def claim(key):
+    """Take the right to extract and save the content behind key; False while another
+    upload holds it. A claim left by a process that died lapses after CACHE_CLAIM_TIMEOUT.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM extraction_claims WHERE cache_key = ? AND claimed_at < ?",
+                      (key, now - CACHE_CLAIM_TIMEOUT))
+        claimed = conn.execute(
+            "INSERT OR IGNORE INTO extraction_claims (cache_key, claimed_at) VALUES (?, ?)", (key, now)
+        ).rowcount == 1
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return claimed
+
+
+def release(key):
+    """Give a claim back once the invoice is saved (or the upload is abandoned)"""
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM extraction_claims WHERE cache_key = ?", (key,))
+    finally:
+        conn.close()
+
+
+async def claim_content(key):
+    """Wait, off the event loop, until this upload may extract the content behind key.
+
+    Called after a lookup found no invoice for it. Returns the cache entry (or None); the
+    claim is held unless the entry links an invoice, which an upload of the same bytes
+    saved meanwhile: then this upload is a duplicate of it.
+    """
+    from fastapi.concurrency import run_in_threadpool
+
+    while not await run_in_threadpool(claim, key):
+        await asyncio.sleep(_CLAIM_POLL_SECONDS)
+        cached = await run_in_threadpool(lookup, key, False)
+        if cached and cached['invoice_id']:
+            return cached
+    # The upload that held the claim may have saved its invoice just before letting go
+    cached = await run_in_threadpool(lookup, key, False)
+    if cached and cached['invoice_id']:
+        await run_in_threadpool(release, key)
+    return cached
+
+
+def evict():
+    """Drop expired entries, then least recently used ones beyond the size limits"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        removed = conn.execute(
+            "DELETE FROM extraction_cache WHERE created_at < ?", (time.time() - CACHE_MAX_AGE,)
+        ).rowcount
+
+        entries, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extraction_cache"
+        ).fetchone()
+        if entries > CACHE_MAX_ENTRIES or total > CACHE_MAX_BYTES:
+            doomed = []
+            for row in conn.execute(
+                "SELECT cache_key, size FROM extraction_cache ORDER BY last_access"
+            ):
+                if entries <= CACHE_MAX_ENTRIES and total <= CACHE_MAX_BYTES:
+                    break
+                doomed.append((row['cache_key'],))
+                entries -= 1
+                total -= row['size']
+            conn.executemany("DELETE FROM extraction_cache WHERE cache_key = ?", doomed)
+            removed += len(doomed)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    _count('evictions', removed)
+    return removed
+
+
+def cache_counters():
+    """Hits, misses and evictions since startup, without touching the database"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def cache_stats():
+    conn = _connect()
+    try:
+        entries, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extraction_cache"
+        ).fetchone()
+    finally:
+        conn.close()
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    stats['entries'] = entries
+    stats['bytes'] = total
+    return stats
@@ -0,0 +1,332 @@
+# app/cli.py
+"""Offline batch extraction for backfills of archived scans, and storage maintenance.
+
+Usage: python -m app.cli extract DIR [--jsonl FILE] [--parquet DIR] [--db]
+                                     [--workers N] [--batch-size N] [--checkpoint FILE] [--retry-failed]
+       python -m app.cli migrate-storage [--batch-size N] [--compact]
+
+Walks DIR for receipts, extracts them on a process pool (one worker per core by default)
+and writes the results in batches to JSON Lines, Parquet part files and/or the invoices
+database. Every finished file is recorded in a checkpoint, so running the same command
+again after an interruption only processes what is left.
+
+migrate-storage moves the OCR text and upload files of invoices saved before blob storage
+existed into it (see app/blobs.py); it is safe to interrupt and run again.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.logs import configure_logging
+from app.utils import is_allowed_file
+from app.workers import ExtractionEngine, run_pipeline
+from config import BACKFILL_CHECKPOINT_PATH, DB_BATCH_SIZE, EXTRACTION_WORKERS
+
+logger = logging.getLogger("app.cli")
+
+DONE, FAILED = "done", "failed"
+# Columns written to Parquet; amounts are normalised to numbers
+PARQUET_COLUMNS = (('file', 'string'), ('vendor', 'string'), ('date', 'string'), ('amount', 'float64'),
+                   ('tax', 'float64'), ('category', 'string'), ('invoice_number', 'string'),
+                   ('raw_text', 'string'), ('invoice_id', 'int64'))
+_PROGRESS_EVERY = 10.0  # seconds between progress lines
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class Checkpoint:
+    """Which files a backfill has finished, keyed by absolute path.
+
+    A file counts as finished only while its size and modification time are unchanged,
+    so files replaced since the last run are processed again.
+    """
+
+    def __init__(self, path=BACKFILL_CHECKPOINT_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = _connect(path)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS backfill_files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            status TEXT NOT NULL,
+            invoice_id INTEGER,
+            error TEXT,
+            finished_at REAL NOT NULL
+        )
+        """)
+
+    def finished(self, retry_failed=False):
+        """{path: (size, mtime)} of files that need no more work"""
+        statuses = (DONE,) if retry_failed else (DONE, FAILED)
+        rows = self.conn.execute(
+            f"SELECT path, size, mtime FROM backfill_files WHERE status IN ({', '.join('?' * len(statuses))})",
+            statuses,
+        )
+        return {row['path']: (row['size'], row['mtime']) for row in rows}
+
+    def record(self, entries):
+        """Mark files finished in one transaction: (path, size, mtime, status, invoice_id, error)"""
+        now = time.time()
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO backfill_files (path, size, mtime, status, invoice_id, error, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(*entry, now) for entry in entries],
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        self.conn.close()
+
+
+def discover(root, finished):
+    """(path, size, mtime) of every receipt under root not finished in an earlier run, in a stable order"""
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(names):
+            if not is_allowed_file(name):
+                continue
+            path = os.path.abspath(os.path.join(directory, name))
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if finished.get(path) != (stat.st_size, stat.st_mtime):
+                yield path, stat.st_size, stat.st_mtime
+
+
+def _number(value):
+    """Amounts as floats; NER can return them as printed ('$1,234.56')"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).replace('$', '').replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+class JSONLinesWriter:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Appending: a resumed run adds to what the interrupted one wrote
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record, default=str) + "\n")
+        self.file.flush()
+        # The checkpoint is updated right after this, so the lines must be on disk first
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """One part file per batch, so an interrupted run never leaves a half-written file behind"""
+
+    def __init__(self, directory):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.schema = pyarrow.schema([(name, kind) for name, kind in PARQUET_COLUMNS])
+        self.directory = directory
+        self.run = time.strftime("%Y%m%d-%H%M%S")
+        self.parts = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, records):
+        rows = [{name: (_number(record.get(name)) if kind == 'float64' else record.get(name))
+                 for name, kind in PARQUET_COLUMNS} for record in records]
+        self.parts += 1
+        final = os.path.join(self.directory, f"part-{self.run}-{self.parts:05d}.parquet")
+        self.pq.write_table(self.pa.Table.from_pylist(rows, schema=self.schema), final + ".tmp")
+        os.replace(final + ".tmp", final)
+
+    def close(self):
+        pass
+
+
+class DatabaseWriter:
+    def __init__(self):
+        from app.database import init_database
+
+        init_database()
+
+    def write(self, records):
+        from app.database import save_invoices_batch
+
+        ids = save_invoices_batch([(record, record['file']) for record in records])
+        for record, invoice_id in zip(records, ids):
+            record['invoice_id'] = invoice_id
+            if invoice_id is None:
+                record['error'] = "Error saving invoice data"
+
+
+def backfill(root, writers, checkpoint, engine, window, batch_size=DB_BATCH_SIZE, retry_failed=False):
+    """Extract every unfinished receipt under root; returns {'done', 'failed', 'skipped', 'seconds'}.
+
+    At most window files are in flight. Finished results are written to every
+    writer in batches and only then recorded in the checkpoint, so a crash can repeat the
+    last batch but never lose one.
+    """
+    finished = checkpoint.finished(retry_failed)
+    pending_files = discover(root, finished)
+    counts = {'done': 0, 'failed': 0, 'skipped': 0}
+    in_flight = {}
+    buffer = []
+    started = last_report = time.monotonic()
+
+    def flush():
+        # Taken out of the buffer first: if this is interrupted, the files are simply redone next run
+        batch = buffer[:]
+        buffer.clear()
+        ok = [record for record, _ in batch if 'error' not in record]
+        # The database writer runs first: it fills in the ids the file outputs carry, and what it
+        # couldn't save stays out of the files, so --retry-failed doesn't write those lines twice
+        for writer in sorted(writers, key=lambda w: not isinstance(w, DatabaseWriter)):
+            ok = [record for record in ok if 'error' not in record]
+            if ok:
+                writer.write(ok)
+        entries = []
+        for record, (path, size, mtime) in batch:
+            status = FAILED if 'error' in record else DONE
+            counts[status] += 1
+            entries.append((path, size, mtime, status, record.get('invoice_id'), record.get('error')))
+        checkpoint.record(entries)
+
+    try:
+        next_file = next(pending_files, None)
+        while next_file is not None or in_flight:
+            while next_file is not None and len(in_flight) < window:
+                in_flight[engine.submit(run_pipeline, next_file[0])] = next_file
+                next_file = next(pending_files, None)
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, size, mtime = entry = in_flight.pop(future)
+                record = {'file': os.path.relpath(path, root)}
+                try:
+                    record.update(future.result()['data'])
+                except Exception as e:
+                    record['error'] = str(e)
+                    logger.warning("Extraction failed", extra={'file': path, 'error': str(e)})
+                buffer.append((record, entry))
+            if len(buffer) >= batch_size:
+                flush()
+
+            if time.monotonic() - last_report >= _PROGRESS_EVERY:
+                last_report = time.monotonic()
+                finished_now = counts['done'] + counts['failed'] + len(buffer)
+                logger.info("Backfill progress", extra={
+                    **counts, 'in_flight': len(in_flight),
+                    'files_per_second': round(finished_now / (last_report - started), 2)})
+    finally:
+        # Interrupted or not, whatever has finished is kept
+        for future in in_flight:
+            future.cancel()
+        if buffer:
+            flush()
+    counts['skipped'] = len(finished)
+    counts['seconds'] = round(time.monotonic() - started, 1)
+    return counts
+
+
+def _extract_command(args):
+    if not (args.jsonl or args.parquet or args.db):
+        raise SystemExit("Choose at least one output: --jsonl, --parquet or --db")
+    if not os.path.isdir(args.directory):
+        raise SystemExit(f"Not a directory: {args.directory}")
+
+    writers = []
+    if args.db:
+        writers.append(DatabaseWriter())
+    if args.jsonl:
+        writers.append(JSONLinesWriter(args.jsonl))
+    if args.parquet:
+        writers.append(ParquetWriter(args.parquet))
+
+    # Enough files queued that no worker waits while results are written. The engine frees a
+    # slot in a done-callback that can run just after wait() returns, hence its larger bound.
+    window = args.workers * 4
+    engine = ExtractionEngine(kind='process', workers=args.workers, max_pending=window * 2)
+    checkpoint = Checkpoint(args.checkpoint)
+    # SIGTERM (a scheduler stopping the job) ends the run as cleanly as Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        counts = backfill(os.path.abspath(args.directory), writers, checkpoint, engine, window,
+                          args.batch_size, args.retry_failed)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted; run the same command again to continue")
+        raise SystemExit(130)
+    finally:
+        engine.shutdown(wait=False)
+        checkpoint.close()
+        for writer in writers:
+            if hasattr(writer, 'close'):
+                writer.close()
+    logger.info("Backfill finished", extra=counts)
+
+
+def _migrate_storage_command(args):
+    from app.blobs import compact, migrate
+    from app.database import init_database
+
+    init_database()
+    counts = migrate(args.batch_size)
+    logger.info("Storage migration finished", extra=counts)
+    if args.compact:
+        counts = compact()
+        logger.info("Database compacted", extra=counts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract = commands.add_parser("extract", help="extract every receipt under a directory")
+    extract.add_argument("directory")
+    extract.add_argument("--jsonl", help="append results to this JSON Lines file")
+    extract.add_argument("--parquet", help="write results as Parquet part files in this directory")
+    extract.add_argument("--db", action="store_true", help="save invoices to the configured database")
+    extract.add_argument("--workers", type=int, default=EXTRACTION_WORKERS)
+    extract.add_argument("--batch-size", type=int, default=DB_BATCH_SIZE, help="results per write")
+    extract.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT_PATH)
+    extract.add_argument("--retry-failed", action="store_true", help="try files that failed before again")
+    extract.set_defaults(handler=_extract_command)
+
+    migrate = commands.add_parser("migrate-storage", help="move inline OCR text and uploads into blob storage")
+    migrate.add_argument("--batch-size", type=int, default=500, help="invoices per transaction")
+    migrate.add_argument("--compact", action="store_true",
+                         help="drop unreferenced blobs, then VACUUM / OPTIMIZE TABLE to return the freed space")
+    migrate.set_defaults(handler=_migrate_storage_command)
+
+    args = parser.parse_args(argv)
+    configure_logging()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import streamlit as st
 import requests
 import pandas as pd
 import plotly.express as px
+import time
 from datetime import datetime
 
 # Page config
@@ -13,6 +14,36 @@ st.markdown("Upload invoices and receipts to extract structured data")
 
 # API endpoint
 API_BASE = "http://localhost:8000"
+JOB_POLL_SECONDS = 1
+JOB_POLL_ATTEMPTS = 120
+# Streamlit reruns the script on every widget change; reads are reused for this long
+CACHE_SECONDS = 30
+REQUEST_TIMEOUT = 10
+
+@st.cache_resource
+def api_session():
+    """One HTTP session shared by every rerun, so connections to the API are kept open"""
+    return requests.Session()
+
+@st.cache_resource
+def _last_responses():
+    """(ETag, data) of the last response per request, for conditional GETs"""
+    return {}
+
+@st.cache_data(ttl=CACHE_SECONDS, show_spinner=False)
+def fetch(path, params=None):
+    """GET an API read endpoint; once the cached copy expires the API only answers 304 if nothing changed"""
+    key = (path, tuple(sorted((params or {}).items())))
+    last = _last_responses().get(key)
+    headers = {'If-None-Match': last[0]} if last else {}
+    response = api_session().get(f"{API_BASE}{path}", params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304:
+        return last[1]
+    response.raise_for_status()
+    data = response.json()
+    if 'ETag' in response.headers:
+        _last_responses()[key] = (response.headers['ETag'], data)
+    return data
 
 # Sidebar for upload
 with st.sidebar:
@@ -26,16 +57,32 @@ with st.sidebar:
         # Upload to API
         if st.button("Process Invoice"):
             files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
-            response = requests.post(f"{API_BASE}/upload-invoice", files=files)
+            response = api_session().post(f"{API_BASE}/jobs/", files=files)
             
-            if response.status_code == 200:
-                result = response.json()
-                st.success("Invoice processed successfully!")
+            if response.status_code == 202:
+                job_url = f"{API_BASE}{response.json()['status_url']}"
                 
-                # Display extracted data
-                st.subheader("Extracted Data")
-                data = result['data']
-                st.json(data)
+                # Poll the job until the background workers have finished with it
+                job = None
+                with st.spinner("Processing invoice..."):
+                    for _ in range(JOB_POLL_ATTEMPTS):
+                        job = api_session().get(job_url, timeout=REQUEST_TIMEOUT).json()
+                        if job['status'] in ('done', 'failed'):
+                            break
+                        time.sleep(JOB_POLL_SECONDS)
+                
+                if job and job['status'] == 'done':
+                    st.success("Invoice processed successfully!")
+                    # Show the new invoice in the tabs below right away
+                    fetch.clear()
+                    
+                    # Display extracted data
+                    st.subheader("Extracted Data")
+                    st.json(job['result'])
+                elif job and job['status'] == 'failed':
+                    st.error(f"Error processing invoice: {job['error']}")
+                else:
+                    st.info("Invoice is still being processed. Check the Invoices tab shortly.")
             else:
                 st.error(f"Error processing invoice: {response.text}")
 
@@ -46,54 +93,67 @@ with tab1:
     st.header("Recent Invoices")
     
     try:
-        # Fetch invoices from API
-        response = requests.get(f"{API_BASE}/invoices?limit=10")
-        if response.status_code == 200:
-            invoices = response.json()
-            
-            if invoices:
-                df = pd.DataFrame(invoices)
-                st.dataframe(df[['id', 'vendor', 'amount', 'category', 'invoice_date', 'processed_at']])
-            else:
-                st.info("No invoices processed yet. Upload one to get started!")
+        # The newest of the invoices the Invoices tab lists, so both tabs share one request
+        invoices = fetch("/invoices/", {'limit': 100})[:10]
+        
+        if invoices:
+            df = pd.DataFrame(invoices)
+            st.dataframe(df[['id', 'vendor', 'amount', 'category', 'invoice_date', 'processed_at']])
         else:
-            st.error("Could not fetch invoices from server")
+            st.info("No invoices processed yet. Upload one to get started!")
+    except requests.HTTPError:
+        st.error("Could not fetch invoices from server")
     except:
         st.error("Could not connect to the API server. Make sure it's running on localhost:8000")
 
 with tab2:
     st.header("All Invoices")
     
+    # Searching is done by the API's index, so it covers every stored invoice
+    col1, col2 = st.columns(2)
+    with col1:
+        search_text = st.text_input("Search text, invoice number or vendor")
+    with col2:
+        search_vendor = st.text_input("Vendor (typos tolerated)")
+    
     try:
-        # Fetch all invoices from API
-        response = requests.get(f"{API_BASE}/invoices?limit=100")
-        if response.status_code == 200:
-            invoices = response.json()
+        if search_text or search_vendor:
+            params = {'limit': 100}
+            if search_text:
+                params['q'] = search_text
+            if search_vendor:
+                params['vendor'] = search_vendor
+            invoices = fetch("/invoices/search", params)
+        else:
+            # Fetch the latest invoices from API
+            invoices = fetch("/invoices/", {'limit': 100})
+        if isinstance(invoices, dict):
+            invoices = invoices['items']
+        
+        if invoices:
+            df = pd.DataFrame(invoices)
             
-            if invoices:
-                df = pd.DataFrame(invoices)
-                
-                # Filters
-                col1, col2 = st.columns(2)
-                with col1:
-                    vendors = ['All'] + list(df['vendor'].unique())
-                    selected_vendor = st.selectbox("Filter by Vendor", vendors)
-                
-                with col2:
-                    categories = ['All'] + list(df['category'].unique())
-                    selected_category = st.selectbox("Filter by Category", categories)
-                
-                # Apply filters
-                if selected_vendor != 'All':
-                    df = df[df['vendor'] == selected_vendor]
-                if selected_category != 'All':
-                    df = df[df['category'] == selected_category]
-                
-                st.dataframe(df)
-            else:
-                st.info("No invoices found")
+            # Filters
+            col1, col2 = st.columns(2)
+            with col1:
+                vendors = ['All'] + list(df['vendor'].unique())
+                selected_vendor = st.selectbox("Filter by Vendor", vendors)
+            
+            with col2:
+                categories = ['All'] + list(df['category'].unique())
+                selected_category = st.selectbox("Filter by Category", categories)
+            
+            # Apply filters
+            if selected_vendor != 'All':
+                df = df[df['vendor'] == selected_vendor]
+            if selected_category != 'All':
+                df = df[df['category'] == selected_category]
+            
+            st.dataframe(df)
         else:
-            st.error("Could not fetch invoices from server")
+            st.info("No invoices found")
+    except requests.HTTPError:
+        st.error("Could not fetch invoices from server")
     except:
         st.error("Could not connect to the API server")
 
@@ -101,33 +161,26 @@ with tab3:
     st.header("Spending Analytics")
     
     try:
-        # Fetch invoices for analytics
-        response = requests.get(f"{API_BASE}/invoices?limit=1000")
-        if response.status_code == 200:
-            invoices = response.json()
+        # Totals are aggregated server-side over the whole history
+        monthly_totals = fetch("/analytics/monthly")
+        category_totals = fetch("/analytics/by-category")
+        if monthly_totals or category_totals:
+            # Monthly spending trend
+            st.subheader("Monthly Spending Trend")
+            df_monthly = pd.DataFrame(monthly_totals, columns=['month', 'total_amount'])
+            fig = px.line(df_monthly, x='month', y='total_amount', title='Monthly Spending')
+            st.plotly_chart(fig, use_container_width=True)
+            
+            # Category distribution
+            st.subheader("Spending by Category")
+            df_category = pd.DataFrame(category_totals, columns=['category', 'total_amount'])
+            df_category['category'] = df_category['category'].fillna('Uncategorized')
+            fig2 = px.pie(df_category, values='total_amount', names='category', title='Spending by Category')
+            st.plotly_chart(fig2, use_container_width=True)
             
-            if invoices:
-                df = pd.DataFrame(invoices)
-                
-                # Convert date column
-                df['invoice_date'] = pd.to_datetime(df['invoice_date'], errors='coerce')
-                df = df.dropna(subset=['invoice_date', 'amount'])
-                
-                # Monthly spending trend
-                st.subheader("Monthly Spending Trend")
-                df_monthly = df.set_index('invoice_date').resample('M').sum(numeric_only=True).reset_index()
-                fig = px.line(df_monthly, x='invoice_date', y='amount', title='Monthly Spending')
-                st.plotly_chart(fig, use_container_width=True)
-                
-                # Category distribution
-                st.subheader("Spending by Category")
-                category_totals = df.groupby('category')['amount'].sum().reset_index()
-                fig2 = px.pie(category_totals, values='amount', names='category', title='Spending by Category')
-                st.plotly_chart(fig2, use_container_width=True)
-                
-            else:
-                st.info("Not enough data for analytics yet")
         else:
-            st.error("Could not fetch invoices for analytics")
+            st.info("Not enough data for analytics yet")
+    except requests.HTTPError:
+        st.error("Could not fetch invoices for analytics")
     except Exception as e:
         st.error(f"Error generating analytics: {str(e)}")
\ No newline at end of file
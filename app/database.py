@@ -1,36 +1,20 @@
-import mysql.connector
-from mysql.connector import Error
-import os
-from dotenv import load_dotenv
-load_dotenv("connection.env")
+import base64
+import json
+import logging
 
+from app.analytics import init_summary, update_summary
+from app.blobs import init_blobs, load_texts, store_blobs
+from app.db_backends import DatabaseError, get_storage
+from app.response_cache import invalidate as invalidate_responses
+from app.search import init_search, update_search
+from config import DB_BATCH_SIZE
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-def create_connection():
-    try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST','localhost'),
-            database=os.getenv('DB_NAME','invoice_extractor'),
-            user=os.getenv('DB_USER','sunny'),
-            password=os.getenv('DB_PASSWORD','M.sunny@13')
-        )
-        print("connection sucessful")
-        return connection
-    except Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
-
-def init_database():
-    conn = create_connection()
-    if conn is None:
-        return
-    
-    try:
-        cursor = conn.cursor()
-        
-        # Create tables
-        cursor.execute("""
+# Table definitions per storage backend
+SCHEMA = {
+    'mysql': [
+        """
         CREATE TABLE IF NOT EXISTS invoices (
             id INT AUTO_INCREMENT PRIMARY KEY,
             vendor VARCHAR(255) NOT NULL,
@@ -43,121 +27,247 @@ def init_database():
             file_name VARCHAR(255),
             processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        """)
-        
-        conn.commit()
-        print("Database initialized successfully")
-        
-    except Error as e:
-        print(f"Error initializing database: {e}")
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-
-def save_invoice_data(invoice_data, filename):
-    conn = create_connection()
-    if conn is None:
-        return None
-    
-    try:
-        cursor = conn.cursor()
-        
-        query = """
-        INSERT INTO invoices (vendor, invoice_date, amount, tax, category, invoice_number, raw_text, file_name)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+    ],
+    'sqlite': [
         """
-        
-        values = (
-            invoice_data.get('vendor'),
-            invoice_data.get('date'),
-            invoice_data.get('amount'),
-            invoice_data.get('tax'),
-            invoice_data.get('category'),
-            invoice_data.get('invoice_number'),
-            invoice_data.get('raw_text'),
-            filename
+        CREATE TABLE IF NOT EXISTS invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vendor VARCHAR(255) NOT NULL,
+            invoice_date DATE,
+            amount DECIMAL(10, 2) NOT NULL,
+            tax DECIMAL(10, 2) DEFAULT 0,
+            category VARCHAR(50),
+            invoice_number VARCHAR(100),
+            raw_text TEXT,
+            file_name VARCHAR(255),
+            processed_at TIMESTAMP DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now'))
         )
-        
-        cursor.execute(query, values)
-        conn.commit()
-        return cursor.lastrowid
-        
-    except Error as e:
-        print(f"Error saving invoice data: {e}")
-        return None
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-
-def get_invoices(limit=50, offset=0):
-    conn = create_connection()
-    if conn is None:
-        return []
-    
+        """,
+    ],
+}
+
+# Secondary indexes, created for new tables and added to existing ones by init_database
+INDEXES = {
+    'idx_invoices_processed_at': ('processed_at', 'id'),
+    'idx_invoices_vendor': ('vendor',),
+    'idx_invoices_category': ('category',),
+    'idx_invoices_invoice_date': ('invoice_date',),
+}
+
+INVOICE_FIELDS = ('id', 'vendor', 'invoice_date', 'amount', 'tax', 'category',
+                  'invoice_number', 'raw_text', 'file_name', 'processed_at')
+# raw_text can be kilobytes of OCR output per row, so listings leave it out unless asked
+DEFAULT_LIST_FIELDS = tuple(field for field in INVOICE_FIELDS if field != 'raw_text')
+
+def _existing_indexes(db, backend):
+    if backend == 'mysql':
+        rows = db.query(
+            "SELECT DISTINCT INDEX_NAME AS name FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", ('invoices',)
+        )
+    else:
+        rows = db.query("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'invoices'")
+    return {row['name'] for row in rows}
+
+def _migrate_indexes(db, backend):
+    """Add any missing secondary index (MySQL has no CREATE INDEX IF NOT EXISTS)"""
+    existing = _existing_indexes(db, backend)
+    for name, columns in INDEXES.items():
+        if name not in existing:
+            db.execute(f"CREATE INDEX {name} ON invoices ({', '.join(columns)})")
+            logger.info("Created index", extra={'index': name})
+
+def _serialize(row):
+    """Convert DECIMAL and DATE values so the row can be returned as JSON"""
+    for key in ('amount', 'tax'):
+        if row.get(key) is not None:
+            row[key] = float(row[key])
+    for key in ('invoice_date', 'processed_at'):
+        value = row.get(key)
+        if value is not None and not isinstance(value, str):
+            row[key] = value.isoformat()
+    return row
+
+def init_database():
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        query = "SELECT * FROM invoices ORDER BY processed_at DESC LIMIT %s OFFSET %s"
-        cursor.execute(query, (limit, offset))
-        
-        results = cursor.fetchall()
-        
-        # Convert decimal to float for JSON serialization
-        for row in results:
-            if row['amount'] is not None:
-                row['amount'] = float(row['amount'])
-            if row['tax'] is not None:
-                row['tax'] = float(row['tax'])
-            if row['invoice_date'] is not None:
-                row['invoice_date'] = row['invoice_date'].isoformat()
-            if row['processed_at'] is not None:
-                row['processed_at'] = row['processed_at'].isoformat()
-                
-        return results
-        
-    except Error as e:
-        print(f"Error fetching invoices: {e}")
-        return []
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-
-def get_invoice_by_id(invoice_id):
-    conn = create_connection()
-    if conn is None:
-        return None
-    
+        storage = get_storage()
+        with storage.session() as db:
+            for statement in SCHEMA[storage.name]:
+                db.execute(statement)
+            _migrate_indexes(db, storage.name)
+            init_blobs(db, storage.name)
+            init_summary(db, storage.name)
+            init_search(db, storage.name)
+        logger.info("Database initialized", extra={'backend': storage.name})
+
+    except DatabaseError as e:
+        logger.error("Error initializing database", extra={'error': str(e)})
+
+# raw_text is compressed into invoice_blobs; the column only holds text of rows not yet migrated
+INSERT_INVOICE = """
+    INSERT INTO invoices (vendor, invoice_date, amount, tax, category, invoice_number, file_name)
+"""
+INSERT_INVOICE_ROW = INSERT_INVOICE + "VALUES (%s, %s, %s, %s, %s, %s, %s)"
+
+def _invoice_values(invoice_data, filename):
+    return (
+        invoice_data.get('vendor'),
+        invoice_data.get('date'),
+        invoice_data.get('amount'),
+        invoice_data.get('tax'),
+        invoice_data.get('category'),
+        invoice_data.get('invoice_number'),
+        filename
+    )
+
+def _search_values(invoice_id, invoice_data):
+    return (invoice_id, invoice_data.get('vendor'), invoice_data.get('invoice_number'),
+            invoice_data.get('raw_text'))
+
+def save_invoice_data(invoice_data, filename, content_hash=None):
+    """Insert one invoice; content_hash links the original kept in blob storage"""
+    values = _invoice_values(invoice_data, filename)
+
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        query = "SELECT * FROM invoices WHERE id = %s"
-        cursor.execute(query, (invoice_id,))
-        
-        result = cursor.fetchone()
-        
-        if result:
-            # Convert decimal to float for JSON serialization
-            if result['amount'] is not None:
-                result['amount'] = float(result['amount'])
-            if result['tax'] is not None:
-                result['tax'] = float(result['tax'])
-            if result['invoice_date'] is not None:
-                result['invoice_date'] = result['invoice_date'].isoformat()
-            if result['processed_at'] is not None:
-                result['processed_at'] = result['processed_at'].isoformat()
-                
-        return result
-        
-    except Error as e:
-        print(f"Error fetching invoice: {e}")
+        storage = get_storage()
+        with storage.session() as db:
+            db.execute(INSERT_INVOICE_ROW, values)
+            invoice_id = db.lastrowid
+            store_blobs(db, [(invoice_id, invoice_data.get('raw_text'), content_hash)])
+            update_summary(db, storage.name, invoice_id, invoice_id)
+            update_search(db, storage.name, [_search_values(invoice_id, invoice_data)])
+        invalidate_responses()
+        return invoice_id
+
+    except DatabaseError as e:
+        logger.error("Error saving invoice data", extra={'error': str(e)})
         return None
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
 
-# Initialize database when module is imported
-init_database()
\ No newline at end of file
+def save_invoices_batch(items, batch_size=DB_BATCH_SIZE):
+    """Insert (invoice_data, filename[, content_hash]) items with multi-row INSERTs, one
+    transaction per batch.
+
+    Returns the new ids in input order; a failed batch yields None for its rows.
+    """
+    ids = []
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        rows = [_invoice_values(item[0], item[1]) for item in batch]
+        try:
+            storage = get_storage()
+            with storage.session() as db:
+                batch_ids = db.insert_many(INSERT_INVOICE, rows)
+                store_blobs(db, [(invoice_id, item[0].get('raw_text'), item[2] if len(item) > 2 else None)
+                                 for invoice_id, item in zip(batch_ids, batch)])
+                update_summary(db, storage.name, batch_ids[0], batch_ids[-1])
+                update_search(db, storage.name, [_search_values(invoice_id, item[0])
+                                                 for invoice_id, item in zip(batch_ids, batch)])
+            ids.extend(batch_ids)
+
+        except DatabaseError as e:
+            logger.error("Error saving invoice batch", extra={'rows': len(rows), 'error': str(e)})
+            ids.extend([None] * len(rows))
+    if any(invoice_id is not None for invoice_id in ids):
+        invalidate_responses()
+    return ids
+
+def encode_cursor(row):
+    """Opaque keyset cursor pointing just past the given row"""
+    position = json.dumps([row['processed_at'], row['id']])
+    return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        processed_at, invoice_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return processed_at, int(invoice_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def parse_fields(fields):
+    """Validate a comma separated projection, returning columns in canonical order"""
+    if not fields:
+        return DEFAULT_LIST_FIELDS
+    requested = {field.strip() for field in fields.split(',') if field.strip()}
+    unknown = requested - set(INVOICE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    # Canonical order keeps the number of distinct (prepared) statements small
+    return tuple(field for field in INVOICE_FIELDS if field in requested)
+
+def _filter_clauses(vendor=None, category=None, date_from=None, date_to=None):
+    """WHERE clauses and parameters for the invoice listing filters"""
+    clauses, params = [], []
+    if vendor:
+        clauses.append("vendor = %s")
+        params.append(vendor)
+    if category:
+        clauses.append("category = %s")
+        params.append(category)
+    if date_from:
+        clauses.append("invoice_date >= %s")
+        params.append(str(date_from))
+    if date_to:
+        clauses.append("invoice_date <= %s")
+        params.append(str(date_to))
+    return clauses, params
+
+def list_invoices(limit=50, cursor=None, fields=None, vendor=None, category=None,
+                  date_from=None, date_to=None, offset=0):
+    """Page through invoices newest first using keyset pagination.
+
+    Returns {"items": [...], "next_cursor": str or None}. Raises ValueError for a bad
+    cursor or field list.
+    """
+    columns = parse_fields(fields)
+    # The cursor needs the sort key even when the caller didn't ask for it
+    selected = tuple(dict.fromkeys(columns + ('processed_at', 'id')))
+
+    clauses, params = _filter_clauses(vendor, category, date_from, date_to)
+    if cursor:
+        processed_at, invoice_id = decode_cursor(cursor)
+        clauses.append("(processed_at < %s OR (processed_at = %s AND id < %s))")
+        params.extend([processed_at, processed_at, invoice_id])
+
+    query = f"SELECT {', '.join(selected)} FROM invoices"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY processed_at DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
+    if offset and not cursor:
+        query += " OFFSET %s"
+        params.append(offset)
+
+    try:
+        with get_storage().session() as db:
+            results = [_serialize(row) for row in db.query(query, tuple(params))]
+            if 'raw_text' in columns:
+                load_texts(db, results[:limit])
+
+    except DatabaseError as e:
+        logger.error("Error fetching invoices", extra={'error': str(e)})
+        return {"items": [], "next_cursor": None}
+
+    next_cursor = encode_cursor(results[limit - 1]) if len(results) > limit else None
+    items = [{field: row[field] for field in columns} for row in results[:limit]]
+    return {"items": items, "next_cursor": next_cursor}
+
+def get_invoices(limit=50, offset=0, **filters):
+    return list_invoices(limit=limit, offset=offset, **filters)["items"]
+
+def get_invoice_by_id(invoice_id, include_text=False):
+    """One invoice; its OCR text is only read from blob storage with include_text"""
+    fields = INVOICE_FIELDS if include_text else DEFAULT_LIST_FIELDS
+    query = f"SELECT {', '.join(fields)} FROM invoices WHERE id = %s"
+
+    try:
+        with get_storage().session() as db:
+            result = db.query_one(query, (invoice_id,))
+            if result and include_text:
+                load_texts(db, [result])
+
+        return _serialize(result) if result else None
+
+    except DatabaseError as e:
+        logger.error("Error fetching invoice", extra={'invoice_id': invoice_id, 'error': str(e)})
+        return None
@@ -0,0 +1,327 @@
+# app/db_backends.py
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from config import (
+    DB_BACKEND,
+    DB_CONFIG,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_STATEMENT_CACHE_SIZE,
+    SQLITE_DB_PATH,
+)
+
+try:
+    import mysql.connector
+    from mysql.connector import pooling
+    from mysql.connector import Error as MySQLError
+except ImportError:  # Only the SQLite backend is usable
+    mysql = None
+
+    class MySQLError(Exception):
+        pass
+
+# Catch this to handle failures from either backend
+DatabaseError = (MySQLError, sqlite3.Error)
+
+
+class PoolTimeout(MySQLError):
+    """Raised when no pooled connection became free within DB_POOL_TIMEOUT"""
+
+
+class MySQLSession:
+    """One pooled connection, running statements through cached server-side prepared cursors"""
+
+    def __init__(self, storage, conn):
+        self._storage = storage
+        self.conn = conn
+        self.lastrowid = None
+
+    def _prepared(self, sql):
+        """Return (cursor, sql) where re-executing sql on cursor reuses the server-side statement"""
+        raw = getattr(self.conn, '_cnx', self.conn)
+        statements = self._storage.statement_cache(raw)
+        entry = statements.get(sql)
+        if entry is None:
+            # The connector only skips re-preparing when handed the identical string object
+            entry = statements[sql] = (raw.cursor(prepared=True), sql)
+            if len(statements) > DB_STATEMENT_CACHE_SIZE:
+                _, (evicted, _) = statements.popitem(last=False)
+                evicted.close()
+        else:
+            statements.move_to_end(sql)
+        return entry
+
+    def execute(self, sql, params=()):
+        if not params:
+            # DDL and parameterless statements can't always be prepared
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(sql)
+                self.lastrowid = cursor.lastrowid
+                return cursor.rowcount
+            finally:
+                cursor.close()
+        cursor, sql = self._prepared(sql)
+        cursor.execute(sql, params)
+        self.lastrowid = cursor.lastrowid
+        return cursor.rowcount
+
+    def query(self, sql, params=()):
+        if params:
+            cursor, sql = self._prepared(sql)
+        else:
+            cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            if not params:
+                cursor.close()
+
+    def query_one(self, sql, params=()):
+        rows = self.query(sql, params)
+        return rows[0] if rows else None
+
+    def stream(self, sql, params=(), size=1000):
+        """Yield the result as lists of up to size tuples, read from the server as they are needed.
+
+        The cursor is unbuffered, so the connection can't run other statements until the
+        generator is exhausted or closed.
+        """
+        cursor = self.conn.cursor(buffered=False)
+        finished = False
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+            finished = True
+        finally:
+            if not finished:
+                # Rows left on the wire must be read before the connection runs anything else
+                try:
+                    while cursor.fetchmany(size):
+                        pass
+                except MySQLError:
+                    pass
+            cursor.close()
+
+    def insert_many(self, sql, rows):
+        """Insert rows with one multi-row INSERT and return their ids in order"""
+        placeholders = "(" + ", ".join(["%s"] * len(rows[0])) + ")"
+        values = [value for row in rows for value in row]
+        step = self._storage.auto_increment_step(self)
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"{sql} VALUES " + ", ".join([placeholders] * len(rows)), values)
+            # A multi-row INSERT ... VALUES knows its row count up front, so InnoDB reserves
+            # its ids in one block in every autoinc lock mode: the first, then
+            # auto_increment_increment apart
+            first = cursor.lastrowid
+        finally:
+            cursor.close()
+        return list(range(first, first + step * len(rows), step))
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+
+class MySQLStorage:
+    """Sized MySQL connection pool shared by every request in the process"""
+
+    name = "mysql"
+    # mysql.connector's pool tops out at 32 connections
+    max_pool_size = 32
+
+    def __init__(self, pool_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        if mysql is None:
+            raise MySQLError("mysql-connector-python is not installed")
+        self.pool_size = min(pool_size, self.max_pool_size)
+        self.timeout = timeout
+        # pool_reset_session=False keeps server-side prepared statements alive between checkouts;
+        # the pool still pings (and reconnects) every connection as it is handed out
+        self._pool = pooling.MySQLConnectionPool(
+            pool_name="invoice_pool",
+            pool_size=self.pool_size,
+            pool_reset_session=False,
+            **DB_CONFIG,
+        )
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._statements = {}
+        self._statements_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._autoinc_step = None
+        self.in_use = 0
+
+    def auto_increment_step(self, session):
+        """The server's auto_increment_increment, read once"""
+        if self._autoinc_step is None:
+            row = session.query_one("SELECT @@auto_increment_increment AS step")
+            self._autoinc_step = int(row['step'])
+        return self._autoinc_step
+
+    def statement_cache(self, raw):
+        """Prepared cursors for a physical connection, dropped when it reconnects"""
+        with self._statements_lock:
+            connection_id, statements = self._statements.get(id(raw), (None, None))
+            if statements is None or connection_id != raw.connection_id:
+                statements = OrderedDict()
+                self._statements[id(raw)] = (raw.connection_id, statements)
+            return statements
+
+    @contextmanager
+    def session(self):
+        """Check out a connection for one unit of work, committing on success"""
+        # The connector's pool raises instead of waiting when empty, so queue here
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No database connection free after {self.timeout}s")
+        try:
+            conn = self._pool.get_connection()
+            with self._lock:
+                self.in_use += 1
+            try:
+                session = MySQLSession(self, conn)
+                try:
+                    yield session
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            finally:
+                with self._lock:
+                    self.in_use -= 1
+                conn.close()
+        finally:
+            self._slots.release()
+
+
+class SQLiteSession:
+    """Same interface as MySQLSession on top of the sqlite3 statement cache"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lastrowid = None
+
+    @staticmethod
+    def _translate(sql):
+        return sql.replace('%s', '?')
+
+    def execute(self, sql, params=()):
+        cursor = self.conn.execute(self._translate(sql), params)
+        self.lastrowid = cursor.lastrowid
+        return cursor.rowcount
+
+    def query(self, sql, params=()):
+        return [dict(row) for row in self.conn.execute(self._translate(sql), params)]
+
+    def query_one(self, sql, params=()):
+        row = self.conn.execute(self._translate(sql), params).fetchone()
+        return dict(row) if row is not None else None
+
+    def stream(self, sql, params=(), size=1000):
+        """Yield the result as lists of up to size tuples, stepping through it as they are needed"""
+        cursor = self.conn.cursor()
+        # Plain tuples: no sqlite3.Row per row
+        cursor.row_factory = None
+        try:
+            cursor.execute(self._translate(sql), params)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def insert_many(self, sql, rows):
+        """Insert rows with one multi-row INSERT and return their ids in order"""
+        placeholders = "(" + ", ".join(["?"] * len(rows[0])) + ")"
+        values = [value for row in rows for value in row]
+        cursor = self.conn.execute(
+            self._translate(sql) + " VALUES " + ", ".join([placeholders] * len(rows)), values
+        )
+        # SQLite reports the id of the last row; the writer lock keeps the block contiguous
+        last = cursor.lastrowid
+        return list(range(last - len(rows) + 1, last + 1))
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+
+class SQLiteStorage:
+    """Local file-backed storage for tests and benchmarks; one connection per thread"""
+
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_DB_PATH):
+        self.path = path
+        self.pool_size = 0
+        self.in_use = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def session(self):
+        conn = self._connection()
+        with self._lock:
+            self.in_use += 1
+        try:
+            yield SQLiteSession(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            with self._lock:
+                self.in_use -= 1
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the process-wide storage backend selected by DB_BACKEND"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if DB_BACKEND == 'sqlite':
+                    _storage = SQLiteStorage()
+                elif DB_BACKEND == 'mysql':
+                    _storage = MySQLStorage()
+                else:
+                    raise ValueError(f"Unknown DB_BACKEND: {DB_BACKEND}")
+    return _storage
+
+
+def set_storage(storage):
+    """Swap the storage backend (used by benchmarks and tests)"""
+    global _storage
+    with _storage_lock:
+        _storage = storage
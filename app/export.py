@@ -0,0 +1,216 @@
+# app/export.py
+"""Streaming export of invoices as CSV, NDJSON or Parquet.
+
+Rows come from a server-side cursor EXPORT_CHUNK_SIZE at a time, and each chunk is encoded
+and sent before the next one is fetched, so memory use stays the same however many rows
+match. The cursor and, for SQLite, the connection belong to the thread that opened them,
+so iterate_on_thread keeps all of one export's database work on a single thread.
+"""
+import asyncio
+import csv
+import datetime
+import decimal
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.blobs import decompress_text
+from app.database import _filter_clauses, parse_fields
+from app.db_backends import get_storage
+from app.metrics import EXPORT_ROWS
+from app.response_cache import dumps
+from config import EXPORT_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    'csv': ("text/csv", "csv"),  # Starlette adds the charset
+    'ndjson': ("application/x-ndjson", "ndjson"),
+    'parquet': ("application/vnd.apache.parquet", "parquet"),
+}
+# Parquet types of the columns that aren't strings
+_PARQUET_TYPES = {'id': 'int64', 'amount': 'float64', 'tax': 'float64'}
+
+
+def _to_float(value):
+    return float(value) if isinstance(value, decimal.Decimal) else value
+
+
+def _to_iso(value):
+    return value.isoformat() if isinstance(value, datetime.date) else value
+
+
+_CONVERTERS = {'amount': _to_float, 'tax': _to_float, 'invoice_date': _to_iso, 'processed_at': _to_iso}
+
+
+def _query(columns, filters):
+    selected = [f"invoices.{column}" for column in columns]
+    query = "SELECT {} FROM invoices"
+    if 'raw_text' in columns:
+        # OCR text lives in invoice_blobs; joined here so no second query runs beside the cursor
+        selected += ["invoice_blobs.text_codec", "invoice_blobs.text_data"]
+        query += " LEFT JOIN invoice_blobs ON invoice_blobs.invoice_id = invoices.id"
+    clauses, params = _filter_clauses(**filters)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    # Primary key order: no sort, and a stable order for consumers that resume by id
+    query += " ORDER BY invoices.id"
+    return query.format(", ".join(selected)), tuple(params)
+
+
+def _normalize(columns, rows):
+    """Rows of plain values: floats for DECIMAL, ISO strings for dates, OCR text decompressed.
+
+    SQLite already returns plain values, so columns are only converted when the chunk
+    holds values that need it; rows that need nothing are passed on as they are.
+    """
+    converters = []
+    for index, column in enumerate(columns):
+        if column in _CONVERTERS:
+            sample = next((row[index] for row in rows if row[index] is not None), None)
+            if isinstance(sample, (decimal.Decimal, datetime.date)):
+                converters.append((index, _CONVERTERS[column]))
+    text_index = columns.index('raw_text') if 'raw_text' in columns else None
+    if not converters and text_index is None:
+        return rows
+    result = []
+    for row in rows:
+        values = list(row[:len(columns)])
+        for index, convert in converters:
+            values[index] = convert(values[index])
+        if text_index is not None and values[text_index] is None:
+            values[text_index] = decompress_text(row[-2], row[-1])
+        result.append(values)
+    return result
+
+
+def _csv(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _ndjson(columns, chunks):
+    for rows in chunks:
+        yield b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+
+
+class _ParquetSink:
+    """Write-only file object that hands over whatever pyarrow has written so far"""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def _parquet(columns, chunks):
+    """One row group per chunk, sent as soon as it is written; the footer comes last"""
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([(column, _PARQUET_TYPES.get(column, 'string')) for column in columns])
+    sink = _ParquetSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for rows in chunks:
+            batch = pyarrow.record_batch(
+                [pyarrow.array([row[index] for row in rows], type=field.type)
+                 for index, field in enumerate(schema)],
+                schema=schema,
+            )
+            writer.write_batch(batch)
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+_ENCODERS = {'csv': _csv, 'ndjson': _ndjson, 'parquet': _parquet}
+
+
+def export_invoices(fmt, fields=None, chunk_size=EXPORT_CHUNK_SIZE, **filters):
+    """Check an export request and return a generator of its encoded bytes, oldest invoice first.
+
+    filters are those of list_invoices (vendor, category, date_from, date_to). Raises
+    ValueError for an unknown format or field before anything is read.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt} (choose {', '.join(EXPORT_FORMATS)})")
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError("Parquet export needs pyarrow on the server: pip install pyarrow")
+    columns = parse_fields(fields)
+    query, params = _query(columns, filters)
+
+    def chunks(counts):
+        with get_storage().session() as db:
+            for rows in db.stream(query, params, chunk_size):
+                counts['rows'] += len(rows)
+                EXPORT_ROWS.inc(len(rows), format=fmt)
+                yield _normalize(columns, rows)
+
+    def generate():
+        counts = {'rows': 0}
+        started = time.perf_counter()
+        completed = False
+        try:
+            yield from _ENCODERS[fmt](list(columns), chunks(counts))
+            completed = True
+        finally:
+            logger.info("Invoice export finished" if completed else "Invoice export stopped", extra={
+                'format': fmt, 'rows': counts['rows'],
+                'seconds': round(time.perf_counter() - started, 3)})
+
+    return generate()
+
+
+async def iterate_on_thread(chunks):
+    """Drive a blocking generator from async code, every step on the same worker thread"""
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                yield chunk
+    finally:
+        # A client that went away leaves the generator open; its cleanup must run there too
+        await loop.run_in_executor(executor, chunks.close)
+        executor.shutdown(wait=False)
@@ -0,0 +1,331 @@
+# app/jobs.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import urllib.request
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.metrics import INVOICES, observe_pipeline, stage
+from config import (
+    JOBS_DB_PATH,
+    JOB_WORKERS,
+    JOB_POLL_INTERVAL,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_DELAY,
+    WEBHOOK_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Job lifecycle: queued -> extracting -> saving -> done (or failed). A failed attempt goes back
+# to queued, not to be claimed before its run_after, until JOB_MAX_ATTEMPTS are used up.
+QUEUED, EXTRACTING, SAVING, DONE, FAILED = "queued", "extracting", "saving", "done", "failed"
+
+
+def _connect():
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def init_jobs_db():
+    """Create the job table and put jobs interrupted by a restart back in the queue"""
+    os.makedirs(os.path.dirname(JOBS_DB_PATH) or ".", exist_ok=True)
+    conn = _connect()
+    try:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            webhook_url TEXT,
+            client TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL,
+            timings TEXT,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+        """)
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if 'client' not in columns:
+            # Queues created before the scheduler's per-client quotas
+            conn.execute("ALTER TABLE jobs ADD COLUMN client TEXT")
+        if 'run_after' not in columns:
+            # Queues created before failed attempts were retried with a backoff
+            conn.execute("ALTER TABLE jobs ADD COLUMN run_after REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+        conn.execute(
+            "UPDATE jobs SET status = ? WHERE status IN (?, ?)",
+            (QUEUED, EXTRACTING, SAVING),
+        )
+    finally:
+        conn.close()
+
+
+def create_job(file_path, file_name, webhook_url=None, client=None):
+    job_id = uuid.uuid4().hex
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, status, file_path, file_name, webhook_url, client, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, file_path, file_name, webhook_url, client, time.time()),
+        )
+    finally:
+        conn.close()
+    return job_id
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job that is due to the extracting stage and return it"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        started_at = time.time()
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE status = ? AND (run_after IS NULL OR run_after <= ?) "
+            "ORDER BY created_at LIMIT 1",
+            (QUEUED, started_at),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ? WHERE id = ?",
+            (EXTRACTING, started_at, row['id']),
+        )
+        conn.execute("COMMIT")
+        job = dict(row)
+        job['attempts'] += 1
+        job['started_at'] = started_at
+        return job
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def update_job(job_id, **fields):
+    for key in ('timings', 'result'):
+        if key in fields and fields[key] is not None:
+            fields[key] = json.dumps(fields[key])
+    assignments = ", ".join(f"{key} = ?" for key in fields)
+    conn = _connect()
+    try:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+    finally:
+        conn.close()
+
+
+def get_job(job_id):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return _serialize_job(dict(row))
+
+
+def active_job_counts():
+    """Number of unfinished jobs in each stage; finished ones are not counted"""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT status, COUNT(*) AS n FROM jobs WHERE status IN (?, ?, ?) GROUP BY status",
+            (QUEUED, EXTRACTING, SAVING),
+        ).fetchall()
+    finally:
+        conn.close()
+    counts = dict.fromkeys((QUEUED, EXTRACTING, SAVING), 0)
+    counts.update((row['status'], row['n']) for row in rows)
+    return counts
+
+
+def _serialize_job(job):
+    job['timings'] = json.loads(job['timings']) if job['timings'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job.pop('file_path', None)
+    return job
+
+
+def _discard_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+
+def _send_webhook(url, payload):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT):
+            pass
+    except Exception as e:
+        logger.warning("Webhook delivery failed", extra={'url': url, 'error': str(e)})
+
+
+class JobRunner:
+    """Pulls queued jobs from the SQLite queue and feeds them to the extraction engine
+    through the scheduler's bulk lane"""
+
+    def __init__(self, scheduler, batcher, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL):
+        self.scheduler = scheduler
+        self.batcher = batcher
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = None
+        self._tasks = []
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers after a new job was queued"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self):
+        while True:
+            job = await run_in_threadpool(claim_next_job)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(job)
+
+    async def _process(self, job):
+        # Imported here so the job queue stays usable without the workers' heavy deps
+        from app.cache import check_file, claim_content, release
+
+        timings = {'queued': job['started_at'] - job['created_at']}
+
+        try:
+            with stage('cache_lookup', timings):
+                key, content_hash, cached = await run_in_threadpool(check_file, job['file_path'])
+                if not (cached and cached['invoice_id']):
+                    # Another upload may be extracting the same bytes right now: wait for its invoice
+                    cached = await claim_content(key)
+        except OSError as e:
+            await self._fail(job, timings, f"Error reading file: {e}")
+            return
+
+        if cached and cached['invoice_id']:
+            # Byte-identical to an invoice we already have: link to it instead of re-running
+            invoice_data = dict(cached['result'], id=cached['invoice_id'], duplicate=True)
+            await run_in_threadpool(_discard_file, job['file_path'])
+            await run_in_threadpool(update_job, job['id'], status=DONE, timings=timings,
+                                    result=invoice_data, error=None, finished_at=time.time())
+            INVOICES.inc(source='job', outcome='duplicate')
+            await self._notify_webhook(job)
+            return
+
+        try:
+            await self._extract_and_save(job, timings, key, content_hash, cached)
+        finally:
+            await run_in_threadpool(release, key)
+
+    async def _extract_and_save(self, job, timings, key, content_hash, cached):
+        from app.scheduler import BULK
+        from app.workers import EngineBusy, run_ocr
+        from app.database import save_invoice_data
+        from app.blobs import store_original
+        from app.cache import store as cache_store
+
+        try:
+            if cached:
+                result = {'data': cached['result'], 'timings': {}}
+            else:
+                estimate = await run_in_threadpool(self.scheduler.cost_model.estimate, run_ocr, job['file_path'])
+                ocr = await self.scheduler.run(run_ocr, job['file_path'], estimate=estimate, lane=BULK,
+                                               client=job.get('client'))
+                observe_pipeline(ocr['timings'])
+                # NER runs batched together with whatever other jobs finished OCR meanwhile
+                invoice_data, batch_timings = await self.batcher.extract(ocr['text'], ocr['confidence'])
+                result = {'data': invoice_data, 'timings': {
+                    **ocr['timings'],
+                    'nlp': batch_timings['nlp'],
+                    'categorization': batch_timings['categorization'],
+                }}
+        except EngineBusy as e:
+            # The engine is full or the bulk lane is past its wait target; hand the job back
+            await run_in_threadpool(update_job, job['id'], status=QUEUED,
+                                    attempts=job['attempts'] - 1)
+            await asyncio.sleep(max(self.poll_interval, getattr(e, 'retry_after', 0)))
+            return
+        except Exception as e:
+            await self._fail(job, timings, f"Error processing file: {e}")
+            return
+
+        timings.update(result['timings'])
+        invoice_data = result['data']
+        await run_in_threadpool(update_job, job['id'], status=SAVING, timings=timings)
+
+        with stage('saving', timings):
+            invoice_id = await run_in_threadpool(save_invoice_data, invoice_data, job['file_name'],
+                                                 content_hash)
+        if invoice_id is None:
+            await self._fail(job, timings, "Error saving invoice data")
+            return
+
+        await run_in_threadpool(cache_store, key, content_hash, invoice_data, invoice_id)
+        # Only now: a retried attempt still needs the upload where the job points
+        await run_in_threadpool(store_original, job['file_path'], content_hash)
+        invoice_data['id'] = invoice_id
+        await run_in_threadpool(update_job, job['id'], status=DONE, timings=timings,
+                                result=invoice_data, error=None, finished_at=time.time())
+        INVOICES.inc(source='job', outcome='saved')
+        await self._notify_webhook(job)
+
+    async def _fail(self, job, timings, error):
+        status = QUEUED if job['attempts'] < JOB_MAX_ATTEMPTS else FAILED
+        now = time.time()
+        if status == QUEUED:
+            # Back off exponentially, so a file that keeps failing doesn't hold a worker
+            run_after, finished_at = now + JOB_RETRY_DELAY * 2 ** (job['attempts'] - 1), None
+        else:
+            run_after, finished_at = None, now
+        await run_in_threadpool(update_job, job['id'], status=status, timings=timings,
+                                error=error, run_after=run_after, finished_at=finished_at)
+        logger.warning("Job attempt failed", extra={'job_id': job['id'], 'attempt': job['attempts'],
+                                                    'retrying': status == QUEUED, 'error': error})
+        if status == FAILED:
+            # Nothing will read the upload again
+            await run_in_threadpool(_discard_file, job['file_path'])
+            INVOICES.inc(source='job', outcome='failed')
+            await self._notify_webhook(job)
+
+    async def _notify_webhook(self, job):
+        if not job.get('webhook_url'):
+            return
+        payload = await run_in_threadpool(get_job, job['id'])
+        await run_in_threadpool(_send_webhook, job['webhook_url'], payload)
@@ -0,0 +1,64 @@
+# app/logs.py
+import json
+import logging
+import sys
+import time
+
+from config import LOG_FORMAT, LOG_LEVEL
+
+# Attributes every LogRecord has; anything else was passed through extra= and is a field
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {'message', 'asctime'}
+
+_configured = False
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and the extra= fields"""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with the extra= fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Send the app's logs to stderr as JSON lines ('json') or plain text ('text').
+
+    Called by the API at startup and by every extraction worker process; repeat calls are no-ops.
+    """
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter() if fmt == 'json' else TextFormatter())
+    logger = logging.getLogger("app")
+    logger.addHandler(handler)
+    logger.setLevel(level.upper())
+    # uvicorn logs through its own handlers; ours stay on the app's loggers only
+    logger.propagate = False
+    _configured = True
@@ -3,17 +3,81 @@ import sys
 import os
 # Add the parent directory to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from datetime import date
+from fastapi import FastAPI, File, Form, HTTPException, Query, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 import os
-from datetime import datetime
-import shutil
-from app.ocr import extract_text_from_image
-from app.nlp import extract_invoice_data
-from app.categorization import categorize_expense
-from app.database import save_invoice_data
+import zipfile
+from app.blobs import find_original, store_original
+from app.bulk import expand_archive, process_bulk
+from app.cache import (
+    cache_counters,
+    cache_stats,
+    check_content,
+    claim_content,
+    init_cache_db,
+    release as release_claim,
+    store as cache_store,
+)
+from app.database import init_database, save_invoice_data
+from app.db_backends import get_storage
+from app.jobs import JobRunner, active_job_counts, create_job, get_job, init_jobs_db
+from app.logs import configure_logging
+from app import metrics
+from app.metrics import INVOICES, RESPONSE_CACHE, STAGE_SECONDS, MetricsMiddleware, observe_pipeline, stage
+from app import response_cache
+from app.profiling import ProfileMiddleware, attach, profiling
+from app.scheduler import INTERACTIVE, Scheduler
+from app.uploads import FORM_OVERHEAD, UploadRejected, UploadSizeLimit, expected_family, sniff, store_upload
+from app.utils import is_allowed_file, stored_filename
+from app.workers import EngineBusy, ExtractionBatcher, get_engine, run_pipeline, shutdown_engine
+from config import MAX_BULK_UPLOAD_SIZE, MAX_FILE_SIZE, PROFILE_REQUESTS, SCHED_CLIENT_HEADER
+
+logger = logging.getLogger("app.main")
+
+
+def _register_metrics(engine, batcher, scheduler):
+    """Point the scrape-time gauges at the state they report"""
+    metrics.CACHE_EVENTS.set_function(cache_counters)
+    metrics.EXTRACTION_PENDING.set_function(lambda: engine.pending)
+    metrics.EXTRACTION_CAPACITY.set_function(
+        lambda: {'workers': engine.workers, 'max_pending': engine.max_pending})
+    metrics.NLP_BATCH_WAITING.set_function(lambda: batcher.waiting)
+    metrics.SCHEDULER_QUEUED.set_function(scheduler.queued)
+    metrics.SCHEDULER_RUNNING.set_function(scheduler.running)
+    metrics.JOBS.set_function(active_job_counts)
+    metrics.DB_POOL.set_function(
+        lambda: {'in_use': get_storage().in_use, 'size': get_storage().pool_size})
+
 
-app = FastAPI(title="Invoice Extractor API")
+@asynccontextmanager
+async def lifespan(app):
+    # Nothing heavy happens at import time; storage is prepared here and the extraction
+    # workers load OCR/NLP state in the background while the API starts serving
+    configure_logging()
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    await run_in_threadpool(init_database)
+    await run_in_threadpool(init_jobs_db)
+    await run_in_threadpool(init_cache_db)
+    engine = get_engine()
+    engine.warm_up()
+    app.state.scheduler = Scheduler(engine)
+    app.state.batcher = ExtractionBatcher(app.state.scheduler)
+    app.state.job_runner = JobRunner(app.state.scheduler, app.state.batcher)
+    app.state.job_runner.start()
+    _register_metrics(engine, app.state.batcher, app.state.scheduler)
+    yield
+    await app.state.job_runner.stop()
+    shutdown_engine()
+
+
+app = FastAPI(title="Invoice Extractor API", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -21,55 +85,323 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# Oversized request bodies are refused while they arrive, before they are spooled
+app.add_middleware(UploadSizeLimit, limits={
+    "/upload-invoice/": MAX_FILE_SIZE + FORM_OVERHEAD,
+    "/jobs/": MAX_FILE_SIZE + FORM_OVERHEAD,
+    "/upload-invoices/bulk": MAX_BULK_UPLOAD_SIZE,
+})
+
+if PROFILE_REQUESTS:
+    # ?profile=1 on any request writes a profile report for it
+    app.add_middleware(ProfileMiddleware)
+
+# Outermost, so requests refused by the layers above are counted too
+app.add_middleware(MetricsMiddleware)
+
 UPLOAD_DIR = "data/uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+def _client_id(request):
+    """Who an upload counts against for the scheduler's per-client quota"""
+    return request.headers.get(SCHED_CLIENT_HEADER) or (request.client.host if request.client else None)
+
+async def _save_upload(file):
+    """Validate and store an uploaded file, returning (filename, file_path, upload).
+
+    upload is store_upload's result: content hash, size and, for small images, the bytes.
+    """
+    if not is_allowed_file(file.filename):
+        raise HTTPException(400, "Invalid file type. Please upload PNG, JPG, or PDF.")
+    
+    filename = stored_filename(file.filename)
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    
+    try:
+        upload = await run_in_threadpool(store_upload, file.file, file_path, expected_family(file.filename))
+    except UploadRejected as e:
+        raise HTTPException(e.status_code, str(e))
+    return filename, file_path, upload
 
 @app.post("/upload-invoice/")
-async def upload_invoice(file: UploadFile = File(...)):
+async def upload_invoice(request: Request, file: UploadFile = File(...)):
+    timings = {}
+    claimed = None
     try:
-        # Validate file type
-        if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.pdf')):
-            raise HTTPException(400, "Invalid file type. Please upload PNG, JPG, or PDF.")
-        
-        # Save uploaded file
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{file.filename}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
+        # Validate and save uploaded file
+        with stage('upload', timings):
+            filename, file_path, upload = await _save_upload(file)
         
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Byte-identical uploads reuse the earlier results and invoice; the hash was
+        # computed while the file was received
+        with stage('cache_lookup', timings):
+            key, cached = await run_in_threadpool(check_content, upload['content_hash'])
+            if not (cached and cached['invoice_id']):
+                # Another upload may be extracting the same bytes right now: wait for its invoice
+                cached = await claim_content(key)
+                if not (cached and cached['invoice_id']):
+                    claimed = key
+        if cached and cached['invoice_id']:
+            await run_in_threadpool(os.remove, file_path)
+            INVOICES.inc(source='upload', outcome='duplicate')
+            return {
+                "message": "Duplicate of an already processed invoice",
+                "duplicate": True,
+                "data": dict(cached['result'], id=cached['invoice_id'])
+            }
         
-        # Process the file
-        extracted_text = extract_text_from_image(file_path)
-        invoice_data = extract_invoice_data(extracted_text)
-        invoice_data['category'] = categorize_expense(invoice_data)
+        pages = None
+        if cached:
+            invoice_data = cached['result']
+        else:
+            # Process the file on the extraction workers, in its turn
+            start = time.perf_counter()
+            scheduler = app.state.scheduler
+            estimate = await run_in_threadpool(scheduler.cost_model.estimate, run_pipeline, file_path, upload['data'])
+            try:
+                # Small images travel with the task and are decoded from memory
+                result = await scheduler.run(run_pipeline, file_path, upload['data'], profiling(),
+                                             estimate=estimate, lane=INTERACTIVE, client=_client_id(request))
+            except EngineBusy as e:
+                # Overloaded (past the wait target) or the engine queue is full
+                await run_in_threadpool(os.remove, file_path)
+                INVOICES.inc(source='upload', outcome='busy')
+                raise HTTPException(503, "Server is busy processing other invoices. Please retry shortly.",
+                                    headers={"Retry-After": str(getattr(e, 'retry_after', 5))})
+            elapsed = time.perf_counter() - start
+            for name in ('ocr', 'nlp', 'categorization'):
+                timings[name] = result['timings'][name]
+                elapsed -= timings[name]
+            # Whatever the worker didn't spend working, the file spent waiting for a free worker
+            timings['queue'] = max(0.0, elapsed)
+            STAGE_SECONDS.observe(timings['queue'], stage='queue')
+            observe_pipeline(result['timings'])
+            attach("extraction worker (cProfile)", result.get('profile'))
+            invoice_data = result['data']
+            # For PDFs: whether each page was read from its text layer or OCRed
+            pages = result['timings'].get('pages') or None
         
         # Save to database
-        invoice_id = save_invoice_data(invoice_data, filename)
+        with stage('saving', timings):
+            invoice_id = await run_in_threadpool(save_invoice_data, invoice_data, filename,
+                                                 upload['content_hash'])
+        with stage('cache_store', timings):
+            await run_in_threadpool(cache_store, key, upload['content_hash'], invoice_data, invoice_id)
+        if invoice_id is not None:
+            await run_in_threadpool(store_original, file_path, upload['content_hash'])
         invoice_data['id'] = invoice_id
+        INVOICES.inc(source='upload', outcome='saved')
+        logger.info("Invoice processed", extra={
+            'invoice_id': invoice_id, 'upload': file.filename, 'bytes': upload['size'],
+            'pages': len(pages) if pages else 1,
+            'timings': {name: round(seconds, 4) for name, seconds in timings.items()},
+        })
         
-        return {
+        response = {
             "message": "File processed successfully",
             "data": invoice_data
         }
+        if pages:
+            response["pages"] = pages
+        return response
         
+    except HTTPException:
+        raise
     except Exception as e:
+        INVOICES.inc(source='upload', outcome='failed')
+        logger.exception("Error processing file", extra={'upload': file.filename})
         raise HTTPException(500, f"Error processing file: {str(e)}")
+    finally:
+        if claimed:
+            # Saved or given up on: uploads of the same bytes waiting on it may go ahead
+            await run_in_threadpool(release_claim, claimed)
+
+@app.post("/upload-invoices/bulk")
+async def upload_invoices_bulk(request: Request, files: List[UploadFile] = File(...)):
+    """Ingest many receipts (or zip archives of them), streaming NDJSON progress as they finish"""
+    uploads, skipped = [], []
+    for file in files:
+        if file.filename.lower().endswith('.zip'):
+            zip_path = os.path.join(UPLOAD_DIR, stored_filename(file.filename))
+            try:
+                await run_in_threadpool(store_upload, file.file, zip_path, 'zip', MAX_BULK_UPLOAD_SIZE, 0)
+                members, rejected = await run_in_threadpool(expand_archive, zip_path, UPLOAD_DIR)
+            except (UploadRejected, zipfile.BadZipFile):
+                members, rejected = [], [file.filename]
+            uploads.extend(members)
+            skipped.extend(rejected)
+        elif is_allowed_file(file.filename):
+            filename = stored_filename(file.filename)
+            file_path = os.path.join(UPLOAD_DIR, filename)
+            try:
+                # Bulk files are OCRed from disk, so nothing is kept in memory
+                stored = await run_in_threadpool(store_upload, file.file, file_path,
+                                                 expected_family(file.filename), MAX_FILE_SIZE, 0)
+            except UploadRejected:
+                skipped.append(file.filename)
+                continue
+            uploads.append((file.filename, filename, file_path, stored['content_hash']))
+        else:
+            skipped.append(file.filename)
+    
+    # Everything is on disk before streaming starts, so the request body can be released
+    return StreamingResponse(process_bulk(uploads, app.state.scheduler, app.state.batcher, skipped,
+                                          client=_client_id(request)),
+                             media_type="application/x-ndjson")
+
+@app.post("/jobs/", status_code=202)
+async def submit_job(request: Request, file: UploadFile = File(...), webhook_url: Optional[str] = Form(None)):
+    """Queue an invoice for background processing and return its job id right away"""
+    filename, file_path, _ = await _save_upload(file)
+    job_id = await run_in_threadpool(create_job, file_path, filename, webhook_url, _client_id(request))
+    app.state.job_runner.notify()
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}"
+    }
+
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Counters, gauges and latency histograms in the Prometheus text format"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    return dict(cache_stats(), responses=response_cache.cache_info())
+
+def _cached_json(request, compute):
+    """Serve a read endpoint from the response cache, or 304 when the client's copy is current.
+
+    compute() returns (payload, headers); an HTTPException it raises is sent and not cached.
+    """
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+    body, etag, headers = response_cache.get_or_compute(key, compute)
+    # Clients may keep the body but must revalidate it, which costs them only a 304
+    headers = {**headers, 'ETag': etag, 'Cache-Control': 'no-cache'}
+    if response_cache.etag_matches(request.headers.get('if-none-match'), etag):
+        RESPONSE_CACHE.inc(event='not_modified')
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 @app.get("/invoices/")
-async def get_invoices(limit: int = 50, offset: int = 0):
-    from app.database import get_invoices
-    return get_invoices(limit, offset)
+def get_invoices(request: Request, limit: int = Query(50, ge=1, le=1000), offset: int = 0,
+                 cursor: Optional[str] = None, fields: Optional[str] = None,
+                 vendor: Optional[str] = None, category: Optional[str] = None,
+                 date_from: Optional[date] = None, date_to: Optional[date] = None):
+    """List invoices newest first; follow the X-Next-Cursor header for the next page"""
+    from app.database import list_invoices
+
+    def compute():
+        try:
+            page = list_invoices(limit=limit, cursor=cursor, fields=fields, vendor=vendor,
+                                 category=category, date_from=date_from, date_to=date_to,
+                                 offset=offset)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        return page['items'], {'X-Next-Cursor': page['next_cursor']} if page['next_cursor'] else {}
+
+    return _cached_json(request, compute)
+
+@app.get("/analytics/monthly")
+def analytics_monthly(request: Request, date_from: Optional[date] = None, date_to: Optional[date] = None):
+    """Spending per month (YYYY-MM) across the whole history.
+
+    The analytics endpoints total whole months: date_from and date_to select the months they fall in.
+    """
+    from app.analytics import get_monthly_totals
+    return _cached_json(request, lambda: (get_monthly_totals(date_from, date_to), {}))
+
+@app.get("/analytics/by-category")
+def analytics_by_category(request: Request, date_from: Optional[date] = None, date_to: Optional[date] = None):
+    """Spending per category over the months from date_from to date_to"""
+    from app.analytics import get_category_totals
+    return _cached_json(request, lambda: (get_category_totals(date_from, date_to), {}))
+
+@app.get("/analytics/by-vendor")
+def analytics_by_vendor(request: Request, limit: int = Query(20, ge=1, le=1000),
+                        date_from: Optional[date] = None, date_to: Optional[date] = None):
+    """The vendors with the most spending over the months from date_from to date_to"""
+    from app.analytics import get_vendor_totals
+    return _cached_json(request, lambda: (get_vendor_totals(limit, date_from, date_to), {}))
+
+@app.get("/invoices/search")
+def search_invoices(q: Optional[str] = None, vendor: Optional[str] = None, fuzzy: bool = True,
+                    category: Optional[str] = None, date_from: Optional[date] = None,
+                    date_to: Optional[date] = None, limit: int = Query(20, ge=1, le=100),
+                    offset: int = Query(0, ge=0, le=10000)):
+    """Ranked search by words in the vendor, invoice number or OCR text (prefix matched)
+    and/or a vendor name that tolerates OCR typos"""
+    from app.search import search_invoices as run_search
+    try:
+        return run_search(q=q, vendor=vendor, fuzzy=fuzzy, category=category,
+                          date_from=date_from, date_to=date_to, limit=limit, offset=offset)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.get("/invoices/export")
+def export_invoices(format: str = "csv", fields: Optional[str] = None,
+                    vendor: Optional[str] = None, category: Optional[str] = None,
+                    date_from: Optional[date] = None, date_to: Optional[date] = None):
+    """Every matching invoice, oldest first, streamed as one CSV, NDJSON or Parquet download"""
+    from app.export import EXPORT_FORMATS, export_invoices as run_export, iterate_on_thread
+    try:
+        chunks = run_export(format, fields, vendor=vendor, category=category,
+                            date_from=date_from, date_to=date_to)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(iterate_on_thread(chunks), media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="invoices.{extension}"'})
 
 @app.get("/invoices/{invoice_id}")
-async def get_invoice(invoice_id: int):
+def get_invoice(request: Request, invoice_id: int, include_text: bool = False):
+    """One invoice; the OCR text is only loaded with include_text=true"""
     from app.database import get_invoice_by_id
-    invoice = get_invoice_by_id(invoice_id)
+
+    def compute():
+        invoice = get_invoice_by_id(invoice_id, include_text)
+        if not invoice:
+            raise HTTPException(404, "Invoice not found")
+        return invoice, {}
+
+    return _cached_json(request, compute)
+
+@app.get("/invoices/{invoice_id}/text", response_class=PlainTextResponse)
+def get_invoice_text(invoice_id: int):
+    """The OCR text of an invoice"""
+    from app.database import get_invoice_by_id
+    invoice = get_invoice_by_id(invoice_id, include_text=True)
     if not invoice:
         raise HTTPException(404, "Invoice not found")
-    return invoice
+    return PlainTextResponse(invoice['raw_text'] or "")
+
+_MEDIA_TYPES = {'pdf': "application/pdf", 'png': "image/png", 'jpeg': "image/jpeg"}
+
+@app.get("/invoices/{invoice_id}/original")
+def get_invoice_original(request: Request, invoice_id: int):
+    """The uploaded file an invoice was read from"""
+    original = find_original(invoice_id)
+    if original is None:
+        raise HTTPException(404, "Original file not available")
+    path, content_hash = original
+    # The content hash names the bytes exactly, so it is the ETag
+    etag = f'"{content_hash}"'
+    if response_cache.etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    with open(path, 'rb') as f:
+        kind = sniff(f.read(1024))
+    return FileResponse(path, media_type=_MEDIA_TYPES.get(kind, "application/octet-stream"),
+                        headers={'ETag': etag})
 
 if __name__ == "__main__":
     import uvicorn
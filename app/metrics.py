@@ -0,0 +1,237 @@
+# app/metrics.py
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from a cache hit to a long multi-page PDF
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024,
+                64 * 1024 * 1024)
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """A named family of samples, one per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # Metrics owned by another module (pool usage, queue depth) are read at scrape time
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def set_function(self, function):
+        """Read the value from function() on every scrape instead of storing it; function may
+        return a number, or a {label values tuple: number} dict for labelled metrics"""
+        self.function = function
+
+    def _collect(self):
+        if self.function is None:
+            with self._lock:
+                return dict(self._values)
+        value = self.function()
+        if isinstance(value, dict):
+            return {key if isinstance(key, tuple) else (key,): number for key, number in value.items()}
+        return {(): value}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            snapshot = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                labels = _format_labels(self.labels, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        try:
+            lines.extend(metric.render())
+        except Exception:
+            # A source that can't be read right now (database down) just drops out of this scrape
+            continue
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status",
+                        ("method", "route", "status"))
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency, body included",
+                         ("method", "route"))
+STAGE_SECONDS = Histogram("invoice_stage_seconds",
+                          "Time per file spent in each pipeline stage (OCR sub-stages summed over pages)",
+                          ("stage",))
+INVOICES = Counter("invoices_processed_total", "Invoices handled, by entry point and outcome",
+                   ("source", "outcome"))
+PAGES = Counter("invoice_pages_total", "Pages read, by text layer or OCR", ("method",))
+UPLOAD_BYTES = Histogram("upload_size_bytes", "Size of accepted uploads", buckets=SIZE_BUCKETS)
+UPLOADS_REJECTED = Counter("uploads_rejected_total", "Uploads refused for their content or size",
+                           ("status",))
+NLP_BATCHES = Histogram("nlp_batch_size", "Texts per batched NER call", buckets=COUNT_BUCKETS)
+RESPONSE_CACHE = Counter("response_cache_events_total",
+                         "Invoice read cache hits, misses, 304 responses and invalidations", ("event",))
+SCHEDULER_EVENTS = Counter("scheduler_events_total",
+                           "Extraction work admitted, refused over the SLO or moved to the bulk lane",
+                           ("lane", "event"))
+SCHEDULER_WAIT = Histogram("scheduler_wait_seconds", "Time files waited in the scheduler for a worker", ("lane",))
+EXPORT_ROWS = Counter("invoice_export_rows_total", "Invoice rows streamed by /invoices/export", ("format",))
+
+# Values other modules own, read when /metrics is scraped (wired up in the app's lifespan)
+CACHE_EVENTS = Counter("extraction_cache_events_total", "Extraction cache hits, misses and evictions",
+                       ("event",))
+EXTRACTION_PENDING = Gauge("extraction_pending", "Files submitted to the extraction engine and not finished")
+EXTRACTION_CAPACITY = Gauge("extraction_capacity", "Extraction engine workers and queue limit", ("limit",))
+NLP_BATCH_WAITING = Gauge("nlp_batch_waiting", "OCR texts waiting for the next batched NER call")
+JOBS = Gauge("jobs_active", "Unfinished background jobs by status", ("status",))
+SCHEDULER_QUEUED = Gauge("scheduler_queued", "Files waiting in each scheduler lane", ("lane",))
+SCHEDULER_RUNNING = Gauge("scheduler_running", "Files running on the engine per scheduler lane", ("lane",))
+DB_POOL = Gauge("db_pool_connections", "Database connections checked out and pool size", ("state",))
+
+_WORKER_STAGES = ('ocr', 'nlp', 'categorization')
+
+
+@contextmanager
+def stage(name, timings=None):
+    """Time a block as one pipeline stage; the seconds are also stored in timings[name]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=name)
+        if timings is not None:
+            timings[name] = seconds
+
+
+def observe_pipeline(timings):
+    """Record the stage times and pages an extraction worker reported for one file.
+
+    Workers may be separate processes, so they only measure; the numbers are counted here.
+    """
+    for name in _WORKER_STAGES:
+        if name in timings:
+            STAGE_SECONDS.observe(timings[name], stage=name)
+    for name, seconds in timings.get('stages', {}).items():
+        STAGE_SECONDS.observe(seconds, stage=name)
+    pages = timings.get('pages')
+    if pages:
+        for page in pages:
+            PAGES.inc(method=page['method'])
+    elif 'ocr' in timings:
+        PAGES.inc(method='ocr')  # An image is one OCRed page
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and their latency per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Label by the matched route, not the raw path, so ids don't explode the series
+            route = scope.get('route')
+            route = getattr(route, 'path', None) or "unmatched"
+            HTTP_REQUESTS.inc(method=scope['method'], route=route, status=status)
+            HTTP_SECONDS.observe(time.perf_counter() - start, method=scope['method'], route=route)
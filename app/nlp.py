@@ -1,97 +1,294 @@
-import spacy
+import logging
 import re
-from datetime import datetime
+import threading
+from datetime import date
+from config import SPACY_MODEL, NLP_MODE, NLP_BATCH_SIZE, NLP_N_PROCESS
 
-# Load spaCy model
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("Please download the spaCy model first: python -m spacy download en_core_web_sm")
-    nlp = None
+logger = logging.getLogger(__name__)
 
-def extract_date(text):
-    date_patterns = [
-        r'\d{1,2}[-/]\d{1,2}[-/]\d{2,4}',
-        r'\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{2,4}',
-        r'(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},?\s+\d{2,4}'
-    ]
-    
-    for pattern in date_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        if matches:
-            try:
-                # Try to parse the first date found
-                return datetime.strptime(matches[0], "%m/%d/%Y").date().isoformat()
-            except:
+_nlp = None
+_nlp_loaded = False
+_nlp_lock = threading.Lock()
+
+def _ner_components(nlp):
+    """The NER component plus any shared tok2vec/transformer it listens to"""
+    needed = {"ner"}
+    for name in nlp.pipe_names:
+        listeners = getattr(nlp.get_pipe(name), "listening_components", [])
+        if "ner" in listeners:
+            needed.add(name)
+    return needed
+
+def get_nlp():
+    """Load the spaCy model once, with everything except NER disabled"""
+    global _nlp, _nlp_loaded
+    if not _nlp_loaded:
+        # Worker threads warm up together; the others wait for the one loading the model
+        with _nlp_lock:
+            if not _nlp_loaded:
                 try:
-                    return datetime.strptime(matches[0], "%d-%m-%Y").date().isoformat()
-                except:
-                    continue
+                    import spacy
+                    nlp = spacy.load(SPACY_MODEL)
+                    # Only doc.ents is used, so the tagger, parser, lemmatizer etc. never need to run
+                    nlp.select_pipes(disable=[name for name in nlp.pipe_names
+                                              if name not in _ner_components(nlp)])
+                    _nlp = nlp
+                except (ImportError, OSError):
+                    logger.warning("spaCy model unavailable, using regex extraction only; download it with: "
+                                   f"python -m spacy download {SPACY_MODEL}")
+                _nlp_loaded = True
+    return _nlp
+
+# Patterns are compiled once. Letters are matched against a lower-cased copy of the text,
+# which lets the regex engine skip straight to candidate prefixes instead of trying
+# IGNORECASE alternatives at every position.
+_MONTHS = r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*'
+_MONTH_NUMBERS = {name: number for number, name in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), 1)}
+_MONTH_WORD = re.compile(_MONTHS)
+_WORD = re.compile(r'\w+')
+# A-Z plus the non-ASCII letters that IGNORECASE treats as equal to an ASCII one
+_CASE_FOLD = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ\u0130\u0131\u017f\u212a',
+                           'abcdefghijklmnopqrstuvwxyziisk')
+
+_NUMERIC_DATE = re.compile(r'(\d{1,2})([-/])(\d{1,2})([-/])(\d{2,4})')
+_DAY_MONTH_DATE = re.compile(r'(\d{1,2})\s+' + _MONTHS + r'\s+(\d{2,4})')
+_MONTH_DAY_DATE = re.compile(_MONTHS + r'\s+(\d{1,2}),?\s+(\d{2,4})')
+_INVOICE_NUMBER = re.compile(r'(?:invoice|inv)\.?\s*#?\s*[:]?\s*([a-z0-9-]+)')
+# 'Tax 8.25% 3.30' -> 3.30; the word boundary before the label is checked in _find_tax
+_TAX = re.compile(r'(?:tax|vat|gst)\b[^\n\d]{0,20}?(?:\d{1,2}(?:\.\d+)?\s*%[^\n\d]{0,10}?)?'
+                  r'\$?\s*(\d{1,3}(?:,\d{3})*\.\d{2})(?!\s*%)')
+# '$ 1,234.56' -> '1,234.56'. A leading '$' or blanks never change which digits are matched,
+# so leaving them out gives the same amounts while letting the scan jump from digit to digit.
+_AMOUNT = re.compile(r'\d{1,3}(?:,\d{3})*(?:\.\d{2})?')
+
+# spaCy entity labels and the fields they fill
+_ENTITY_FIELDS = {"ORG": "vendor", "DATE": "date", "MONEY": "amount"}
+_CONFIDENCE_FIELDS = ("vendor", "date", "amount", "tax", "invoice_number")
+
+# Numeric dates: the separator decides the field order (12/25/2024 vs 25-12-2024)
+_NUMERIC_ORDER = {'/': ('month', 'day'), '-': ('day', 'month')}
+
+def _lowered(text):
+    lowered = text.lower()
+    if lowered.isascii():
+        return lowered
+    # str.lower can change the length of non-ASCII text; spans must line up with the original
+    return text.translate(_CASE_FOLD)
+
+def _year(match, group):
+    # Two digit years pivot like strptime's %y; three digits are ambiguous
+    digits = match.group(group)
+    if len(digits) == 4:
+        return int(digits)
+    if len(digits) == 2:
+        # Not a fragment of a longer number such as the 24-03-14 inside 2024-03-14
+        text, start, end = match.string, match.start(), match.end(group)
+        following = text[end:end + 1]
+        if (start and text[start - 1].isdigit()) or following.isdigit() or following in ('-', '/'):
+            return None
+        year = int(digits)
+        return year + (2000 if year < 69 else 1900)
     return None
 
-def extract_amounts(text):
-    # Find currency amounts
-    amount_pattern = r'\$?\s*\d{1,3}(?:,\d{3})*(?:\.\d{2})?|\d+(?:\.\d{2})?'
-    amounts = re.findall(amount_pattern, text)
-    
-    # Convert to floats and sort to find the largest (likely the total)
-    amounts_float = []
-    for amt in amounts:
-        try:
-            clean_amt = amt.replace('$', '').replace(',', '').strip()
-            amounts_float.append(float(clean_amt))
-        except:
-            continue
-    
-    if amounts_float:
-        amounts_float.sort(reverse=True)
-        return amounts_float[0]  # Return the largest amount
-    
+def _make_date(year, month, day):
+    if year is None:
+        return None
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+def _parse_numeric(match):
+    first, sep, second, sep2, _ = match.groups()
+    if sep != sep2:
+        return None
+    parts = dict(zip(_NUMERIC_ORDER[sep], (int(first), int(second))))
+    return _make_date(_year(match, 5), parts['month'], parts['day'])
+
+def _parse_day_month(match):
+    day, month, _ = match.groups()
+    return _make_date(_year(match, 3), _MONTH_NUMBERS[month], int(day))
+
+def _parse_month_day(match):
+    month, day, _ = match.groups()
+    return _make_date(_year(match, 3), _MONTH_NUMBERS[month], int(day))
+
+# Date formats in priority order: only the first match of each format is tried
+_DATE_FORMATS = (
+    (_NUMERIC_DATE, _parse_numeric, False),
+    (_DAY_MONTH_DATE, _parse_day_month, True),
+    (_MONTH_DAY_DATE, _parse_month_day, True),
+)
+
+def _find_date(lowered, spans=None):
+    has_month = None
+    for pattern, parse, needs_month in _DATE_FORMATS:
+        if needs_month:
+            if has_month is None:
+                has_month = _MONTH_WORD.search(lowered) is not None
+            if not has_month:
+                break
+        match = pattern.search(lowered)
+        if match:
+            parsed = parse(match)
+            if parsed:
+                if spans is not None:
+                    spans['date'] = match.span()
+                return parsed
     return None
 
+def _find_invoice_number(text, lowered, spans=None):
+    match = _INVOICE_NUMBER.search(lowered)
+    if match and spans is not None:
+        spans['invoice_number'] = match.span(1)
+    # The lower-cased copy only locates the number; return it as printed
+    return text[match.start(1):match.end(1)] if match else None
+
+def _find_tax(lowered, spans=None):
+    pos = 0
+    while True:
+        match = _TAX.search(lowered, pos)
+        if not match:
+            return None
+        start = match.start()
+        if start and (lowered[start - 1].isalnum() or lowered[start - 1] == '_'):
+            pos = start + 1  # 'syntax', 'private'
+            continue
+        if spans is not None:
+            spans['tax'] = match.span(1)
+        return float(match.group(1).replace(',', ''))
+
+def extract_date(text):
+    return _find_date(_lowered(text))
+
+def extract_amounts(text):
+    amounts = _AMOUNT.findall(text)
+    if not amounts:
+        return None
+    # The largest amount is likely the total
+    return max(map(float, ' '.join(amounts).replace(',', '').split()))
+
+def _find_amount(text, spans=None):
+    """extract_amounts, also recording where the chosen amount was printed"""
+    if spans is None:
+        return extract_amounts(text)
+    best = None
+    for match in _AMOUNT.finditer(text):
+        value = float(match.group().replace(',', ''))
+        if best is None or value > best:
+            best = value
+            spans['amount'] = match.span()
+    return best
+
+def is_misread_word(word):
+    """Whether a word is letters with a few digits OCR put in their place ("Wa1mart")"""
+    digits = sum(char.isdigit() for char in word)
+    return 0 < digits < len(word) - digits
+
+def _vendor_line(line):
+    if not any(char.isdigit() for char in line):
+        return True
+    # Digits are only allowed where they are misread letters
+    return all(is_misread_word(word) for word in _WORD.findall(line) if not word.isalpha())
+
 def extract_vendor(text):
     # Simple vendor extraction - first line often contains vendor name
     lines = text.split('\n')
     for line in lines:
         line = line.strip()
-        if line and not any(char.isdigit() for char in line) and len(line) > 3:
+        if line and len(line) > 3 and _vendor_line(line):
             return line
     return "Unknown Vendor"
 
-def extract_invoice_data(text):
-    if nlp is None:
-        # Fallback if spaCy isn't available
-        return {
-            "vendor": extract_vendor(text),
-            "date": extract_date(text),
-            "amount": extract_amounts(text),
-            "tax": None,
-            "invoice_number": None,
-            "raw_text": text
-        }
-    
-    doc = nlp(text)
-    
+def extract_invoice_number(text):
+    return _find_invoice_number(text, _lowered(text))
+
+def extract_tax(text):
+    return _find_tax(_lowered(text))
+
+def _regex_invoice_data(text, spans=None):
+    """Fields found by the regexes; spans, if given, receives field -> (start, end) in text"""
+    lowered = _lowered(text)
+    vendor = extract_vendor(text)
+    if spans is not None and vendor != "Unknown Vendor":
+        start = text.find(vendor)
+        spans['vendor'] = (start, start + len(vendor))
+    return {
+        "vendor": vendor,
+        "date": _find_date(lowered, spans),
+        "amount": _find_amount(text, spans),
+        "tax": _find_tax(lowered, spans),
+        "invoice_number": _find_invoice_number(text, lowered, spans),
+        "raw_text": text
+    }
+
+def _regex_is_enough(data):
+    """In auto mode NER only runs when the regex pass left a field empty"""
+    return data["vendor"] != "Unknown Vendor" and data["date"] and data["amount"] is not None
+
+def _is_empty(data, field):
+    if field == "vendor":
+        return data["vendor"] == "Unknown Vendor"
+    if field == "amount":
+        return data["amount"] is None
+    return not data[field]
+
+def _invoice_data_from_doc(doc, fallback, spans=None):
     # Extract entities
-    dates = [ent.text for ent in doc.ents if ent.label_ == "DATE"]
-    orgs = [ent.text for ent in doc.ents if ent.label_ == "ORG"]
-    money = [ent.text for ent in doc.ents if ent.label_ == "MONEY"]
+    entities = {"vendor": [], "date": [], "amount": []}
+    for ent in doc.ents:
+        field = _ENTITY_FIELDS.get(ent.label_)
+        if field:
+            entities[field].append(ent)
     
-    # Get the most relevant data
-    vendor = orgs[0] if orgs else extract_vendor(text)
-    date = dates[0] if dates else extract_date(text)
-    amount = money[0] if money else extract_amounts(text)
+    data = dict(fallback)
+    for field, found in entities.items():
+        if not found:
+            continue
+        if NLP_MODE == 'auto' and not _is_empty(data, field):
+            # Keep what the regexes found and let NER fill the gaps
+            continue
+        # Get the most relevant data
+        data[field] = found[0].text
+        if spans is not None:
+            spans[field] = (found[0].start_char, found[0].end_char)
+    return data
+
+def _field_confidences(data, spans, confidence):
+    """Confidence (0-1) of each field: that of its least certain OCR character, None if not found"""
+    result = {}
+    for field in _CONFIDENCE_FIELDS:
+        span = spans.get(field) if data.get(field) is not None else None
+        values = confidence[span[0]:span[1]] if span else None
+        result[field] = round(min(values) / 100, 2) if values else None
+    return result
+
+def extract_invoice_data_batch(texts, batch_size=NLP_BATCH_SIZE, n_process=NLP_N_PROCESS, confidences=None):
+    """Extract invoice fields from many OCR texts, running NER over them with nlp.pipe.
+
+    confidences optionally holds, for each text, its per-character OCR confidences (0-100)
+    or None; where given, the result gets a 'confidence' dict with a value per field.
+    """
+    confidences = confidences or [None] * len(texts)
+    # A confidence only lines up with its text if it has one value per character
+    spans = [{} if confidence is not None and len(confidence) == len(text) else None
+             for text, confidence in zip(texts, confidences)]
+    nlp = get_nlp() if NLP_MODE != 'regex' else None
+    results = [_regex_invoice_data(text, text_spans) for text, text_spans in zip(texts, spans)]
     
-    # Extract invoice number
-    inv_pattern = r'(?:invoice|inv)\.?\s*#?\s*[:]?\s*([A-Z0-9-]+)'
-    inv_match = re.search(inv_pattern, text, re.IGNORECASE)
-    invoice_number = inv_match.group(1) if inv_match else None
+    if nlp is not None:
+        pending = [i for i, data in enumerate(results)
+                   if not (NLP_MODE == 'auto' and _regex_is_enough(data))]
+        docs = nlp.pipe((texts[i] for i in pending), batch_size=batch_size, n_process=n_process)
+        for i, doc in zip(pending, docs):
+            results[i] = _invoice_data_from_doc(doc, results[i], spans[i])
+    # Otherwise the regex-only fast path (or spaCy isn't available)
     
-    return {
-        "vendor": vendor,
-        "date": date,
-        "amount": amount,
-        "tax": None,  # Could be enhanced
-        "invoice_number": invoice_number,
-        "raw_text": text
-    }
\ No newline at end of file
+    for data, text_spans, confidence in zip(results, spans, confidences):
+        if text_spans is not None:
+            data["confidence"] = _field_confidences(data, text_spans, confidence)
+    return results
+
+def extract_invoice_data(text, confidence=None):
+    return extract_invoice_data_batch([text], confidences=[confidence])[0]
@@ -44,57 +44,226 @@
 
 
 # app/ocr.py (updated with better error handling)
-import pytesseract
-from pdf2image import convert_from_path
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pdf2image import convert_from_path, pdfinfo_from_path
 import cv2
+import logging
 import numpy as np
 import os
+import re
 import subprocess
+import threading
+import time
+from app.ocr_backends import OCRBackendUnavailable, get_ocr_backend
+from app.ocr_layout import read_page
+from app.preprocess import adaptive_preprocess, basic_preprocess
+from config import (
+    PDF_DPI,
+    PDF_TEXT_LAYER,
+    PDF_TEXT_MIN_CHARS,
+    PDFTOTEXT_CMD,
+    OCR_CORES,
+    OCR_PAGE_WORKERS,
+    OCR_MODE,
+    OCR_PAGES_IN_FLIGHT,
+    OCR_PREPROCESS,
+)
+
+# Replacement and private-use characters are what broken font encodings extract as
+_UNREADABLE = re.compile(r'[\ufffd\ue000-\uf8ff]')
+
+logger = logging.getLogger(__name__)
+
+# Cores OCR may keep busy. Every extraction holds one while it runs, and a PDF's pages beyond
+# the first only run on cores left over; the engine shares one budget between its processes.
+_cores = threading.BoundedSemaphore(OCR_CORES)
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+def share_cores(cores):
+    """Draw on the engine's core budget (a multiprocessing semaphore) instead of this process's own"""
+    global _cores
+    _cores = cores
+
+def _get_page_pool():
+    """Page threads live as long as the process, so each keeps its Tesseract API loaded"""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ThreadPoolExecutor(max_workers=OCR_PAGE_WORKERS, thread_name_prefix="pdf-page")
+        return _page_pool
+
+def _give_back_core(_future):
+    _cores.release()
+
+def _lap(timings, stage, start):
+    """Add the seconds since start to timings[stage] and return the current time"""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + now - start
+    return now
 
 def check_tesseract_installed():
     """Check if Tesseract is installed and accessible"""
     try:
-        # Try to get tesseract version
-        result = subprocess.run(['tesseract', '--version'], 
-                              capture_output=True, text=True, timeout=5)
-        if result.returncode == 0:
-            print("✅ Tesseract OCR is installed:", result.stdout.split('\n')[0])
-            return True
-        else:
-            print("❌ Tesseract is installed but not working properly")
-            return False
-    except (FileNotFoundError, subprocess.TimeoutExpired):
-        print("❌ Tesseract OCR is not installed or not in PATH")
-        print("💡 Install it with: sudo apt install tesseract-ocr tesseract-ocr-eng")
+        get_ocr_backend()
+        return True
+    except OCRBackendUnavailable:
+        logger.warning("Tesseract is missing; install it with: sudo apt install tesseract-ocr tesseract-ocr-eng")
         return False
 
-def preprocess_image(image):
-    """Preprocess image for better OCR results"""
+def preprocess_image(image, timings=None):
+    """Preprocess image for better OCR results; per-stage seconds are added to timings"""
     try:
-        # Convert to grayscale
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = image
-        
-        # Apply noise reduction
-        denoised = cv2.medianBlur(gray, 3)
-        
-        # Apply thresholding
-        _, thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        return thresh
+        if OCR_PREPROCESS == 'basic':
+            return basic_preprocess(image)
+        return adaptive_preprocess(image, timings)
     except Exception as e:
-        print(f"⚠️  Image preprocessing failed: {e}")
+        logger.warning("Image preprocessing failed, OCRing the original", extra={'error': str(e)})
         return image  # Return original image if preprocessing fails
 
-def extract_text_from_image(file_path):
-    """Extract text from image or PDF using Tesseract OCR"""
+def ocr_image(image, backend, timings=None):
+    """OCR a decoded page: (text, per-character confidence), the latter None with OCR_MODE=text"""
+    if OCR_MODE == 'confidence':
+        return read_page(image, backend, timings)
+    processed_img = preprocess_image(image, timings)
+    start = time.perf_counter()
+    text = backend.image_to_string(processed_img)
+    _lap(timings, 'tesseract', start)
+    return text, None
+
+def read_pdf_text_layer(file_path):
+    """Embedded text of every page, one string per page; [] when it can't be read"""
+    try:
+        # pdftotext ships with poppler, which pdf2image already needs; one run covers all pages
+        result = subprocess.run([PDFTOTEXT_CMD, "-layout", "-enc", "UTF-8", file_path, "-"],
+                                capture_output=True, timeout=60, check=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning("PDF text layer unavailable, falling back to OCR",
+                       extra={'file': file_path, 'error': str(e)})
+        return []
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    # Every page ends with a form feed, leaving an empty piece after the last one
+    return pages[:-1] if pages and not pages[-1].strip() else pages
+
+def has_usable_text(text):
+    """Whether a page's text layer holds enough readable text to skip OCR"""
+    chars = "".join(text.split())
+    if len(chars) < PDF_TEXT_MIN_CHARS:
+        return False
+    readable = sum(char.isalnum() for char in chars)
+    return readable >= 0.5 * len(chars) and len(_UNREADABLE.findall(chars)) <= 0.05 * len(chars)
+
+def ocr_pdf_page(file_path, page_number, page_count, backend, timings=None):
+    """Rasterize a single PDF page and OCR it (see ocr_image); only this page is held in memory"""
+    logger.debug("OCR of PDF page", extra={'file': file_path, 'page': page_number, 'pages': page_count})
+    start = time.perf_counter()
+    # Rendered straight to grayscale: a third of the pixels and no conversion step
+    pages = convert_from_path(file_path, dpi=PDF_DPI, first_page=page_number, last_page=page_number,
+                              grayscale=True)
+    img_np = np.array(pages[0])
+    del pages
+    _lap(timings, 'rasterize', start)
+    return ocr_image(img_np, backend, timings)
+
+def extract_text_from_pdf(file_path, backend=None, timings=None, pages=None, use_text_layer=PDF_TEXT_LAYER,
+                          confidence=None):
+    """Read a PDF page by page: the embedded text where it is usable, OCR for the rest.
+
+    When pages is a list, {'page', 'method', 'chars'} (plus 'seconds' for OCR) is appended
+    for every page in order. When confidence is a bytearray, it is extended with one value
+    per character of the text (text layers count as 100), or left empty if OCR_MODE=text.
+    """
+    page_count = pdfinfo_from_path(file_path)["Pages"]
+    texts = [None] * page_count
+    confidences = [None] * page_count
+    methods = ['ocr'] * page_count
+    ocr_seconds = [0.0] * page_count
+    
+    if use_text_layer:
+        start = time.perf_counter()
+        layer = read_pdf_text_layer(file_path)
+        if timings is not None:
+            timings['text_layer'] = time.perf_counter() - start
+        # A page count mismatch means the split can't be trusted; OCR everything
+        if len(layer) == page_count:
+            for index, text in enumerate(layer):
+                if has_usable_text(text):
+                    texts[index] = text
+                    confidences[index] = bytes([100]) * len(text)
+                    methods[index] = 'text'
+    ocr_pages = [index + 1 for index in range(page_count) if methods[index] == 'ocr']
+    if ocr_pages and backend is None:
+        # Fully digital PDFs are read without Tesseract
+        backend = get_ocr_backend()
+    
+    # Pages are rasterized lazily: at most OCR_PAGES_IN_FLIGHT are decoded at once,
+    # so peak memory follows the look-ahead window rather than the document size
+    pool = _get_page_pool()
+    in_flight = {}
+    queue = iter(ocr_pages)
+    next_page = next(queue, None)
+    try:
+        while next_page is not None or in_flight:
+            while next_page is not None and len(in_flight) < OCR_PAGES_IN_FLIGHT:
+                # One page runs on this extraction's own core; more only on idle ones
+                extra = bool(in_flight)
+                if extra and not _cores.acquire(False):
+                    break
+                page_timings = {} if timings is not None else None
+                future = pool.submit(ocr_pdf_page, file_path, next_page, page_count, backend, page_timings)
+                if extra:
+                    future.add_done_callback(_give_back_core)
+                in_flight[future] = (next_page - 1, page_timings, time.perf_counter())
+                next_page = next(queue, None)
+            
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, page_timings, started = in_flight.pop(future)
+                texts[index], confidences[index] = future.result()
+                ocr_seconds[index] = time.perf_counter() - started
+                # Stage times are summed over pages
+                for stage, seconds in (page_timings or {}).items():
+                    timings[stage] = timings.get(stage, 0.0) + seconds
+    except BaseException:
+        # The pool outlives this PDF: drop its pages that haven't started
+        for future in in_flight:
+            future.cancel()
+        raise
+    
+    if pages is not None:
+        for index, method in enumerate(methods):
+            page = {'page': index + 1, 'method': method, 'chars': len(texts[index].strip())}
+            if method == 'ocr':
+                page['seconds'] = ocr_seconds[index]
+            pages.append(page)
+    
+    if confidence is not None and all(page is not None for page in confidences):
+        for page in confidences:
+            confidence += page
+            confidence.append(100)
+    
+    # Reassemble in page order
+    return "".join(text + "\n" for text in texts)
+
+def extract_text_from_image(file_path, timings=None, pages=None, data=None, confidence=None):
+    """Extract text from image or PDF using Tesseract OCR.
+
+    data may hold an image's bytes as received, which saves reading the file back. Seconds
+    per stage (text_layer, rasterize or decode, the preprocessing steps, tesseract, recheck)
+    are added to timings. A confidence bytearray receives one value (0-100) per character
+    of the text, unless OCR_MODE=text.
+    """
+    # Runs either way; a core is only counted as busy if the budget had one left
+    held = _cores.acquire(False)
+    try:
+        return _extract_text(file_path, timings, pages, data, confidence)
+    finally:
+        if held:
+            _cores.release()
+
+def _extract_text(file_path, timings, pages, data, confidence):
     try:
-        # Check if Tesseract is installed
-        if not check_tesseract_installed():
-            raise Exception("Tesseract OCR is not installed. Please install it with: sudo apt install tesseract-ocr tesseract-ocr-eng")
-        
         # Check if file exists
         if not os.path.exists(file_path):
             raise Exception(f"File not found: {file_path}")
@@ -102,26 +271,27 @@ def extract_text_from_image(file_path):
         # Handle PDF files
         if file_path.lower().endswith('.pdf'):
             try:
-                images = convert_from_path(file_path, dpi=300)
-                full_text = ""
-                for i, img in enumerate(images):
-                    print(f"📄 Processing PDF page {i+1}/{len(images)}")
-                    img_np = np.array(img)
-                    processed_img = preprocess_image(img_np)
-                    text = pytesseract.image_to_string(processed_img)
-                    full_text += text + "\n"
-                return full_text
+                # The OCR backend is only probed if some page has no usable text layer
+                return extract_text_from_pdf(file_path, None, timings, pages, confidence=confidence)
             except Exception as e:
                 raise Exception(f"PDF processing failed: {str(e)}")
         
         # Handle image files
         else:
-            img = cv2.imread(file_path)
+            # Probed once per process; raises if Tesseract is not installed
+            backend = get_ocr_backend()
+            start = time.perf_counter()
+            if data is not None:
+                img = cv2.imdecode(np.frombuffer(memoryview(data), np.uint8), cv2.IMREAD_COLOR)
+            else:
+                img = cv2.imread(file_path)
             if img is None:
                 raise ValueError(f"Could not read image file: {file_path}")
+            _lap(timings, 'decode', start)
             
-            processed_img = preprocess_image(img)
-            text = pytesseract.image_to_string(processed_img)
+            text, char_confidence = ocr_image(img, backend, timings)
+            if confidence is not None and char_confidence is not None:
+                confidence += char_confidence
             return text
             
     except Exception as e:
@@ -144,7 +314,7 @@ def test_ocr():
                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
         
         # Test OCR on the generated image
-        text = pytesseract.image_to_string(test_image)
+        text = get_ocr_backend().image_to_string(test_image)
         print(f"📝 OCR Test Result: '{text.strip()}'")
         
         if "OCR" in text or "Test" in text or "Hello" in text:
@@ -158,9 +328,6 @@ def test_ocr():
         print(f"❌ OCR test failed: {e}")
         return False
 
-# Run test when module is imported
+# Run test when module is executed directly
 if __name__ == "__main__":
-    test_ocr()
-else:
-    # Check Tesseract on import
-    check_tesseract_installed()
\ No newline at end of file
+    test_ocr()
\ No newline at end of file
@@ -0,0 +1,160 @@
+# app/ocr_backends.py
+import logging
+import subprocess
+import threading
+
+import cv2
+import numpy as np
+
+from config import OCR_BACKEND, OCR_LANG, TESSERACT_CMD
+
+logger = logging.getLogger(__name__)
+
+
+class OCRBackendUnavailable(Exception):
+    """Raised when no usable Tesseract installation can be found"""
+
+
+def parse_tsv(tsv):
+    """Words from Tesseract's TSV output: {'text', 'conf', 'line': (block, par, line), 'box': (x, y, w, h)}"""
+    words = []
+    for row in tsv.splitlines():
+        fields = row.split('\t')
+        # The header and the rows above word level (page, block, paragraph, line) are skipped
+        if len(fields) < 12 or fields[0] != '5' or not fields[11].strip():
+            continue
+        words.append({
+            'text': fields[11].strip(),
+            'conf': max(0.0, float(fields[10])),
+            'line': (int(fields[2]), int(fields[3]), int(fields[4])),
+            'box': tuple(int(value) for value in fields[6:10]),
+        })
+    return words
+
+
+class TesserocrBackend:
+    """Drives libtesseract in-process, reusing one initialised API per thread"""
+
+    name = "tesserocr"
+
+    def __init__(self, lang=OCR_LANG):
+        import tesserocr
+
+        self._tesserocr = tesserocr
+        self.lang = lang
+        self._local = threading.local()
+        self.version = tesserocr.tesseract_version().split('\n')[0]
+
+    def _api(self):
+        api = getattr(self._local, 'api', None)
+        if api is None:
+            # Loading the traineddata is the expensive part, so do it once per thread
+            api = self._tesserocr.PyTessBaseAPI(lang=self.lang)
+            self._local.api = api
+        return api
+
+    def _set_image(self, api, image):
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        # Hand the pixel buffer over directly: no PIL conversion and no temp files
+        api.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+
+    def image_to_string(self, image):
+        api = self._api()
+        self._set_image(api, image)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+    def image_to_data(self, image, psm=None):
+        """Words with their boxes and confidences (see parse_tsv); psm overrides the page segmentation"""
+        api = self._api()
+        api.SetPageSegMode(psm if psm is not None else self._tesserocr.PSM.AUTO)
+        self._set_image(api, image)
+        try:
+            return parse_tsv(api.GetTSVText(0))
+        finally:
+            api.Clear()
+            api.SetPageSegMode(self._tesserocr.PSM.AUTO)
+
+
+class CliBackend:
+    """Fallback that runs the tesseract binary, streaming the image over stdin/stdout"""
+
+    name = "cli"
+
+    def __init__(self, cmd=TESSERACT_CMD, lang=OCR_LANG):
+        self.cmd = cmd
+        self.lang = lang
+        result = subprocess.run([cmd, '--version'], capture_output=True, text=True, timeout=5)
+        if result.returncode != 0:
+            raise OCRBackendUnavailable("Tesseract is installed but not working properly")
+        # Older builds print the version on stderr
+        self.version = (result.stdout or result.stderr).split('\n')[0]
+
+    def _run(self, image, *options):
+        # PNM is uncompressed, so encoding is a memcpy and leptonica reads it natively
+        ok, encoded = cv2.imencode('.pnm', image)
+        if not ok:
+            raise ValueError("Could not encode image for Tesseract")
+        result = subprocess.run(
+            [self.cmd, 'stdin', 'stdout', '-l', self.lang, *options],
+            input=encoded.tobytes(),
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"Tesseract failed: {result.stderr.decode(errors='replace').strip()}")
+        return result.stdout.decode('utf-8', errors='replace')
+
+    def image_to_string(self, image):
+        return self._run(image)
+
+    def image_to_data(self, image, psm=None):
+        """Words with their boxes and confidences (see parse_tsv); psm overrides the page segmentation"""
+        options = ['--psm', str(psm)] if psm is not None else []
+        return parse_tsv(self._run(image, *options, 'tsv'))
+
+
+_backend = None
+_backend_error = None
+_backend_lock = threading.Lock()
+
+
+def _probe(kind):
+    if kind in ('auto', 'tesserocr'):
+        try:
+            return TesserocrBackend()
+        except ImportError:
+            if kind == 'tesserocr':
+                raise OCRBackendUnavailable("tesserocr is not installed (pip install tesserocr)")
+        except RuntimeError as e:
+            # tesserocr is importable but could not load the language data
+            if kind == 'tesserocr':
+                raise OCRBackendUnavailable(f"tesserocr could not be initialised: {e}")
+    try:
+        return CliBackend()
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        raise OCRBackendUnavailable(
+            "Tesseract OCR is not installed. Please install it with: "
+            "sudo apt install tesseract-ocr tesseract-ocr-eng"
+        )
+
+
+def get_ocr_backend():
+    """Probe Tesseract once per process and return the backend to use for every page"""
+    global _backend, _backend_error
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None and _backend_error is None:
+                try:
+                    _backend = _probe(OCR_BACKEND)
+                    logger.info("Tesseract OCR ready", extra={'backend': _backend.name, 'version': _backend.version})
+                except OCRBackendUnavailable as e:
+                    # Remember the failure so later uploads don't fork another probe
+                    _backend_error = e
+                    logger.error(str(e))
+    if _backend is None:
+        raise _backend_error
+    return _backend
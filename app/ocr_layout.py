@@ -0,0 +1,183 @@
+# app/ocr_layout.py
+"""Confidence-driven OCR of a page (OCR_MODE=confidence).
+
+The page is first read with its text scaled down to OCR_FAST_TEXT_HEIGHT, keeping every
+word's box and confidence. Only the lines that matter are then read again, one band at a
+time, at the full preprocessing scale: lines with a word below OCR_RECHECK_CONFIDENCE and
+lines around the total, date, tax and invoice number labels. A page with more doubtful
+lines than OCR_RECHECK_MAX_LINES is read again whole instead.
+
+read_page returns the text together with a confidence (0-100) for each of its characters,
+which the NLP step turns into per-field confidences.
+"""
+import logging
+import re
+import statistics
+import time
+
+import cv2
+
+from app.preprocess import _lap, analyze, apply_geometry, binarize, identity_plan, to_gray
+from config import OCR_FAST_TEXT_HEIGHT, OCR_PREPROCESS, OCR_RECHECK_CONFIDENCE, OCR_RECHECK_MAX_LINES
+
+logger = logging.getLogger(__name__)
+
+# Labels of the fields worth a second read even when the first one looked confident
+KEY_LABELS = re.compile(r'\b(?:total|amount|balance|due|date|invoice|inv|tax|vat|gst)\b', re.IGNORECASE)
+# Tesseract page segmentation modes: a whole page, a single line
+_PSM_PAGE, _PSM_LINE = 3, 7
+# A re-read band reaches this fraction of its line height above and below the line
+_BAND_PADDING = 0.4
+# When the first pass already ran at full scale, bands are enlarged this much instead
+_RECHECK_ZOOM = 1.5
+
+
+def group_lines(words):
+    """Words grouped into lines in reading order: [{'key', 'words', 'top', 'bottom'}]"""
+    lines = {}
+    for word in words:
+        lines.setdefault(word['line'], []).append(word)
+    return [{'key': key, 'words': line_words,
+             'top': min(word['box'][1] for word in line_words),
+             'bottom': max(word['box'][1] + word['box'][3] for word in line_words)}
+            for key, line_words in lines.items()]
+
+
+def line_text(line):
+    return ' '.join(word['text'] for word in line['words'])
+
+
+def _mean_confidence(words):
+    return statistics.fmean(word['conf'] for word in words) if words else 0.0
+
+
+def assemble(lines):
+    """(text, confidence): one line of text per line and a blank line between blocks.
+
+    confidence holds one value per character of text; spaces and line breaks count as 100.
+    """
+    parts, confidence = [], bytearray()
+    block = None
+    for line in lines:
+        if block is not None and line['key'][0] != block:
+            parts.append('\n')
+            confidence.append(100)
+        block = line['key'][0]
+        for index, word in enumerate(line['words']):
+            if index:
+                parts.append(' ')
+                confidence.append(100)
+            parts.append(word['text'])
+            confidence.extend([min(100, round(word['conf']))] * len(word['text']))
+        parts.append('\n')
+        confidence.append(100)
+    return ''.join(parts), confidence
+
+
+def _targets(lines):
+    """Indices of the lines to read again, and how many of them were read poorly"""
+    doubtful, labelled = set(), set()
+    for index, line in enumerate(lines):
+        if min(word['conf'] for word in line['words']) < OCR_RECHECK_CONFIDENCE:
+            doubtful.add(index)
+        text = line_text(line)
+        if KEY_LABELS.search(text):
+            labelled.add(index)
+            # A label without a number usually has its value on the next line
+            if not any(char.isdigit() for char in text) and index + 1 < len(lines):
+                labelled.add(index + 1)
+    return doubtful | labelled, len(doubtful)
+
+
+def _bands(lines, targets):
+    """Groups of line indices sharing a row, one group per band to read again.
+
+    Lines whose middles fall within a target line's height sit on the same row (a label
+    and its value in separate columns) and are read together.
+    """
+    bands, taken = [], set()
+    for index in sorted(targets, key=lambda i: lines[i]['top']):
+        if index in taken:
+            continue
+        top, bottom = lines[index]['top'], lines[index]['bottom']
+        band = [other for other, line in enumerate(lines)
+                if other not in taken and top <= (line['top'] + line['bottom']) / 2 <= bottom]
+        if index not in band:
+            band.append(index)
+        taken.update(band)
+        bands.append(sorted(band))
+    return bands
+
+
+def _recheck(lines, bands, detail, ratio, kind, backend, zoom=1.0):
+    """Read each band of detail again as a single line; better readings replace the lines.
+
+    Line positions times ratio are rows of detail; each band cut from it is enlarged by zoom.
+    """
+    height = detail.shape[0]
+    replaced = {}
+    for band in bands:
+        top = min(lines[index]['top'] for index in band)
+        bottom = max(lines[index]['bottom'] for index in band)
+        padding = (bottom - top) * _BAND_PADDING
+        y0 = max(0, int((top - padding) * ratio))
+        y1 = min(height, int((bottom + padding) * ratio) + 1)
+        if y1 - y0 < 2:
+            continue
+        band_image = detail[y0:y1]
+        if zoom != 1.0:
+            band_image = cv2.resize(band_image, None, fx=zoom, fy=zoom, interpolation=cv2.INTER_CUBIC)
+        words = backend.image_to_data(binarize(band_image, kind), psm=_PSM_LINE)
+        old_words = [word for index in band for word in lines[index]['words']]
+        if words and _mean_confidence(words) > _mean_confidence(old_words):
+            key = lines[band[0]]['key']
+            replaced[band[0]] = {'key': key, 'words': [dict(word, line=key) for word in words],
+                                 'top': top, 'bottom': bottom}
+            replaced.update((index, None) for index in band[1:])
+    return [replaced.get(index, line) for index, line in enumerate(lines)
+            if replaced.get(index, line) is not None]
+
+
+def read_page(image, backend, timings=None):
+    """OCR one page image; returns (text, confidence) as assemble() does.
+
+    Seconds are added to timings under the usual preprocessing stages, tesseract for the
+    first pass and recheck for everything read again.
+    """
+    start = time.perf_counter()
+    gray = to_gray(image)
+    start = _lap(timings, 'gray', start)
+    plan = identity_plan(gray)
+    if OCR_PREPROCESS != 'basic':
+        try:
+            plan = analyze(gray)
+        except Exception as e:
+            logger.warning("Image analysis failed, OCRing at full resolution", extra={'error': str(e)})
+    start = _lap(timings, 'analyze', start)
+
+    fast = dict(plan)
+    if plan['text_height'] and OCR_FAST_TEXT_HEIGHT / plan['text_height'] < plan['scale']:
+        fast['scale'] = OCR_FAST_TEXT_HEIGHT / plan['text_height']
+    region = apply_geometry(gray, fast)
+    start = _lap(timings, 'geometry', start)
+    page = binarize(region, plan['kind'])
+    start = _lap(timings, 'binarize', start)
+    lines = group_lines(backend.image_to_data(page, psm=_PSM_PAGE))
+    start = _lap(timings, 'tesseract', start)
+
+    targets, doubtful = _targets(lines)
+    if not lines or doubtful > OCR_RECHECK_MAX_LINES:
+        if fast['scale'] < plan['scale']:
+            # Too much was lost at low resolution: read the whole page as a single pass would
+            page = binarize(apply_geometry(gray, plan), plan['kind'])
+            lines = group_lines(backend.image_to_data(page, psm=_PSM_PAGE))
+    elif targets and fast['scale'] < plan['scale']:
+        lines = _recheck(lines, _bands(lines, targets), apply_geometry(gray, plan),
+                         plan['scale'] / fast['scale'], plan['kind'], backend)
+    elif targets:
+        # Nothing was gained on the first pass; the second look enlarges just the bands of it,
+        # as the whole page at a larger scale could go past OCR_MAX_PIXELS
+        lines = _recheck(lines, _bands(lines, targets), region, 1.0, plan['kind'], backend,
+                         zoom=_RECHECK_ZOOM)
+    _lap(timings, 'recheck', start)
+    return assemble(lines)
@@ -0,0 +1,249 @@
+# app/preprocess.py
+import math
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from config import OCR_MAX_PIXELS, OCR_TEXT_HEIGHT
+
+# Layout decisions are made on a copy no larger than this along its long side
+_ANALYSIS_SIDE = 1000
+# Skew (degrees) smaller than this isn't worth a resample; larger is a rotated page, not skew
+_MIN_SKEW, _MAX_SKEW = 0.5, 15.0
+# Resizing by less than this either way isn't worth a resample
+_SCALE_TOLERANCE = 0.2
+_MAX_UPSCALE = 2.0
+# Text at least this fraction of OCR_TEXT_HEIGHT is left at its size rather than enlarged
+_MIN_LEGIBLE = 0.6
+
+_scratch = threading.local()
+
+
+def _buffer(name, shape):
+    """Per-thread scratch array, reused while consecutive images (e.g. PDF pages) share a size"""
+    buffers = getattr(_scratch, 'buffers', None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape:
+        buffer = buffers[name] = np.empty(shape, np.uint8)
+    return buffer
+
+
+def _lap(timings, stage, start):
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + now - start
+    return now
+
+
+def basic_preprocess(image):
+    """The original pipeline: grayscale, median blur and Otsu threshold at full resolution"""
+    if len(image.shape) == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image
+    denoised = cv2.medianBlur(gray, 3)
+    _, thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return thresh
+
+
+def to_gray(image):
+    if image.ndim == 2:
+        return image
+    code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+    return cv2.cvtColor(image, code, dst=_buffer('gray', image.shape[:2]))
+
+
+def classify(gray):
+    """'binary' for already thresholded scans, 'clean' for born-digital or flat scans, else 'photo'"""
+    # Every 4th pixel in each direction is plenty for a histogram
+    sample = np.ascontiguousarray(gray[::4, ::4])
+    hist = cv2.calcHist([sample], [0], None, [256], [0, 256]).ravel()
+    if not hist[1:255].any():
+        return 'binary'
+    if hist[:64].sum() + hist[192:].sum() >= 0.97 * sample.size:
+        return 'clean'
+    return 'photo'
+
+
+def _skew(rect):
+    """Rotation in degrees that levels a cv2.minAreaRect, or 0 when it isn't plausible skew"""
+    angle = rect[2]
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    return angle if _MIN_SKEW <= abs(angle) <= _MAX_SKEW else 0.0
+
+
+def _glyph_boxes(text_mask):
+    """(x, y, w, h) of the connected components in a text mask that are shaped like characters"""
+    _, _, stats, _ = cv2.connectedComponentsWithStats(text_mask, connectivity=8)
+    boxes, areas = stats[1:, :4], stats[1:, cv2.CC_STAT_AREA]
+    widths, heights = boxes[:, 2], boxes[:, 3]
+    # Background, rules and page edges are far taller or wider than any character
+    glyphs = ((heights >= 3) & (heights <= text_mask.shape[0] * 0.1)
+              & (widths <= heights * 3) & (areas >= 4))
+    return boxes[glyphs]
+
+
+def _document_rect(small):
+    """minAreaRect of a bright page clearly separated from its background, if there is one"""
+    blurred = cv2.GaussianBlur(small, (5, 5), 0)
+    _, page = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Close the gaps that printed text leaves in the page mask
+    page = cv2.morphologyEx(page, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+    contours, _ = cv2.findContours(page, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    areas = [cv2.contourArea(contour) for contour in contours]
+    largest = max(areas)
+    pages = [contour for contour, area in zip(contours, areas) if area >= 0.2 * largest]
+    # A page covering nearly all of the frame is a scan, not a photo of a receipt
+    if not 0.15 <= sum(cv2.contourArea(page) for page in pages) / small.size <= 0.9:
+        return None
+    if len(pages) > 1:
+        # Several receipts in one photo: keep them all, unrotated
+        x, y, w, h = cv2.boundingRect(np.concatenate(pages))
+        return ((x + w / 2, y + h / 2), (w, h), 0.0)
+    return cv2.minAreaRect(pages[0])
+
+
+def analyze(gray):
+    """Decide what an image needs before OCR.
+
+    Returns {'kind', 'angle', 'center', 'size', 'scale', 'text_height'} in full-resolution
+    coordinates: rotate by angle around center, keep a size=(w, h) region, then resize by
+    scale. text_height is the median glyph height before scaling, None if too few were seen.
+    """
+    height, width = gray.shape
+    # Whole-number reduction keeps INTER_AREA on its fast path
+    step = max(1, math.ceil(max(height, width) / _ANALYSIS_SIDE))
+    if step > 1:
+        trimmed = gray[:height - height % step, :width - width % step]
+        small = cv2.resize(trimmed, (trimmed.shape[1] // step, trimmed.shape[0] // step),
+                           interpolation=cv2.INTER_AREA)
+    else:
+        small = gray
+
+    kind = classify(gray)
+    _, text_mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    glyphs = _glyph_boxes(text_mask)
+    if not len(glyphs):
+        # Blank page: nothing to crop, level or scale
+        return {'kind': kind, 'angle': 0.0, 'center': (width / 2, height / 2),
+                'size': (width, height), 'scale': 1.0, 'text_height': None}
+
+    rect = _document_rect(small) if kind == 'photo' else None
+    if rect is not None:
+        angle = _skew(rect)
+        if angle:
+            (cx, cy), (rw, rh), raw = rect
+            if abs(raw - angle) > 45:
+                # Levelled by a quarter turn less than OpenCV's angle, so width and height swap
+                rw, rh = rh, rw
+        else:
+            x, y, rw, rh = cv2.boundingRect(cv2.boxPoints(rect))
+            cx, cy = x + rw / 2, y + rh / 2
+    else:
+        # The corners of the character boxes outline the text block
+        x, y, w, h = glyphs[:, 0], glyphs[:, 1], glyphs[:, 2], glyphs[:, 3]
+        corners = np.concatenate([np.stack(pair, axis=1) for pair in
+                                  ((x, y), (x + w, y), (x, y + h), (x + w, y + h))])
+        angle = _skew(cv2.minAreaRect(corners.astype(np.float32)))
+        x, y, w, h = cv2.boundingRect(corners.astype(np.int32))
+        margin = max(4, round(0.02 * max(small.shape)))
+        x0, y0 = max(0, x - margin), max(0, y - margin)
+        x1, y1 = min(small.shape[1], x + w + margin), min(small.shape[0], y + h + margin)
+        cx, cy, rw, rh = (x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0
+        if angle:
+            # Leave room for the corners that rotation brings in
+            rw, rh = min(small.shape[1], rw * 1.1), min(small.shape[0], rh * 1.1)
+
+    center = (cx * step, cy * step)
+    size = (max(1, round(rw * step)), max(1, round(rh * step)))
+
+    scale = 1.0
+    text_height = None
+    if len(glyphs) >= 20:
+        text_height = float(np.median(glyphs[:, 3])) * step
+        # Shrink large text to the target; only enlarge text too small to read reliably
+        if text_height > OCR_TEXT_HEIGHT or text_height < OCR_TEXT_HEIGHT * _MIN_LEGIBLE:
+            scale = min(_MAX_UPSCALE, OCR_TEXT_HEIGHT / text_height)
+    # Never hand Tesseract more than OCR_MAX_PIXELS
+    area = size[0] * size[1] * scale * scale
+    if area > OCR_MAX_PIXELS:
+        scale *= math.sqrt(OCR_MAX_PIXELS / area)
+    if abs(scale - 1.0) < _SCALE_TOLERANCE:
+        scale = 1.0
+    return {'kind': kind, 'angle': angle, 'center': center, 'size': size, 'scale': scale,
+            'text_height': text_height}
+
+
+def identity_plan(gray):
+    """A plan that keeps the whole image as it is (OCR_PREPROCESS=basic)"""
+    height, width = gray.shape
+    return {'kind': 'photo', 'angle': 0.0, 'center': (width / 2, height / 2),
+            'size': (width, height), 'scale': 1.0, 'text_height': None}
+
+
+def apply_geometry(gray, plan):
+    """Crop, resize and level the image as planned, touching only the pixels that are kept"""
+    height, width = gray.shape
+    (cx, cy), (w, h), scale, angle = plan['center'], plan['size'], plan['scale'], plan['angle']
+
+    # Axis-aligned bounds of the kept region, including what rotation swings in
+    radius = math.hypot(w, h) / 2 if angle else None
+    half_w, half_h = (radius, radius) if angle else (w / 2, h / 2)
+    x0, y0 = max(0, int(cx - half_w)), max(0, int(cy - half_h))
+    x1, y1 = min(width, int(math.ceil(cx + half_w))), min(height, int(math.ceil(cy + half_h)))
+    region = gray[y0:y1, x0:x1]
+    cx, cy = cx - x0, cy - y0
+
+    if scale != 1.0:
+        shape = (max(1, round(region.shape[0] * scale)), max(1, round(region.shape[1] * scale)))
+        region = cv2.resize(region, (shape[1], shape[0]), dst=_buffer('resized', shape),
+                            interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+        cx, cy, w, h = cx * scale, cy * scale, w * scale, h * scale
+
+    if angle:
+        out_w, out_h = max(1, round(w)), max(1, round(h))
+        matrix = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+        # Shift so the rotated region lands in an out_w x out_h canvas
+        matrix[0, 2] += out_w / 2 - cx
+        matrix[1, 2] += out_h / 2 - cy
+        region = cv2.warpAffine(region, matrix, (out_w, out_h), dst=_buffer('rotated', (out_h, out_w)),
+                                flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return region
+
+
+def binarize(image, kind):
+    """Threshold into a new array (scratch buffers are reused by the next call)"""
+    if kind == 'binary':
+        # Resampling may have introduced grey edges
+        _, thresh = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
+        return thresh
+    if kind == 'photo':
+        image = cv2.medianBlur(image, 3, dst=_buffer('denoised', image.shape))
+    _, thresh = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return thresh
+
+
+def adaptive_preprocess(image, timings=None):
+    """Grayscale, crop to the text or receipt, deskew, scale to OCR_TEXT_HEIGHT and binarize.
+
+    Steps a clean input doesn't need are skipped. Per-stage seconds are added to timings.
+    """
+    start = time.perf_counter()
+    gray = to_gray(image)
+    start = _lap(timings, 'gray', start)
+    plan = analyze(gray)
+    start = _lap(timings, 'analyze', start)
+    region = apply_geometry(gray, plan)
+    start = _lap(timings, 'geometry', start)
+    result = binarize(region, plan['kind'])
+    _lap(timings, 'binarize', start)
+    return result
@@ -0,0 +1,112 @@
+# app/profiling.py
+import contextvars
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from config import PROFILE_DIR
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+logger = logging.getLogger(__name__)
+
+# Reports collected for the request being profiled; None when it isn't
+_sections = contextvars.ContextVar("profile_sections", default=None)
+_UNSAFE = re.compile(r'[^a-z0-9]+')
+
+
+def profiling():
+    """Whether the current request asked to be profiled"""
+    return _sections.get() is not None
+
+
+def attach(title, report):
+    """Add a report made elsewhere (an extraction worker) to the current request's profile"""
+    sections = _sections.get()
+    if sections is not None and report:
+        sections.append((title, report))
+
+
+def stats_text(profiler, limit=40):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+def profile_call(fn, *args):
+    """Run fn(*args) under cProfile and return (result, report text)"""
+    profiler = cProfile.Profile()
+    result = profiler.runcall(fn, *args)
+    return result, stats_text(profiler)
+
+
+class ProfileMiddleware:
+    """ASGI middleware that profiles requests sent with ?profile=1.
+
+    The report is written to PROFILE_DIR and named in the X-Profile-Report response header.
+    pyinstrument is used when installed (it follows awaits); otherwise cProfile, which sees
+    everything on the event loop thread for the duration, other requests included. Reports
+    attached by extraction workers are appended to it.
+    """
+
+    def __init__(self, app, directory=PROFILE_DIR):
+        self.app = app
+        self.directory = directory
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get('query_string', b"").decode("latin-1")) if scope['type'] == 'http' else {}
+        if query.get('profile', [""])[-1].lower() not in ("1", "true", "yes"):
+            await self.app(scope, receive, send)
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        slug = _UNSAFE.sub("-", scope['path'].lower()).strip("-") or "root"
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}-{scope['method'].lower()}-{slug}.txt"
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message = dict(message, headers=[*message.get('headers', []),
+                                                 (b"x-profile-report", name.encode("latin-1"))])
+            await send(message)
+
+        sections = []
+        token = _sections.set(sections)
+        profiler = Profiler(async_mode="enabled") if Profiler is not None else cProfile.Profile()
+        start = time.perf_counter()
+        if Profiler is not None:
+            profiler.start()
+        else:
+            profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if Profiler is not None:
+                profiler.stop()
+                request_report = ("request (pyinstrument)", profiler.output_text(unicode=True))
+            else:
+                profiler.disable()
+                request_report = ("request (cProfile)", stats_text(profiler))
+            elapsed = time.perf_counter() - start
+            _sections.reset(token)
+            self._write(name, scope, status, elapsed, [request_report, *sections])
+
+    def _write(self, name, scope, status, elapsed, sections):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"{scope['method']} {scope['path']} status={status} seconds={elapsed:.3f}\n")
+            for title, report in sections:
+                f.write(f"\n===== {title} =====\n{report}\n")
+        logger.info("Request profiled", extra={'path': scope['path'], 'status': status,
+                                               'seconds': round(elapsed, 3), 'report': path})
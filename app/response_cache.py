@@ -0,0 +1,113 @@
+# app/response_cache.py
+"""In-process cache of serialized JSON responses for the invoice read endpoints.
+
+Entries expire after RESPONSE_CACHE_TTL seconds and the least recently used are dropped
+beyond RESPONSE_CACHE_ENTRIES / RESPONSE_CACHE_MAX_BYTES. Every write to the invoices
+table calls invalidate(), so this process never serves a response older than its last
+write; writes made by other processes (more API workers, the backfill CLI) show up once
+the TTL has passed.
+"""
+import datetime
+import decimal
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from app.metrics import RESPONSE_CACHE
+from config import RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL
+
+try:
+    import orjson
+except ImportError:  # optional; the json module is used without it
+    orjson = None
+
+_entries = OrderedDict()  # key -> (body, etag, headers, size, expires)
+_lock = threading.Lock()
+_size = 0
+# Bumped by invalidate(); a response computed across a write is not stored
+_generation = 0
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def dumps(payload):
+    """JSON bytes for rows straight from the database, without FastAPI's generic encoder"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def etag_for(body):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header names this ETag (weak comparison, as RFC 9110 asks)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _drop(key):
+    global _size
+    _size -= _entries.pop(key)[3]
+
+
+def get_or_compute(key, compute):
+    """(body, etag, headers) for key, calling compute() -> (payload, headers) on a miss.
+
+    compute runs outside the lock, so a slow query doesn't hold up other keys; exceptions
+    it raises are passed on and nothing is cached.
+    """
+    global _size
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if entry[4] > now:
+                _entries.move_to_end(key)
+                RESPONSE_CACHE.inc(event='hit')
+                return entry[:3]
+            _drop(key)
+        generation = _generation
+    RESPONSE_CACHE.inc(event='miss')
+
+    payload, headers = compute()
+    body = dumps(payload)
+    etag = etag_for(body)
+    size = len(body)
+    if RESPONSE_CACHE_TTL > 0 and size <= RESPONSE_CACHE_MAX_BYTES:
+        with _lock:
+            if generation == _generation:
+                if key in _entries:
+                    _drop(key)
+                _entries[key] = (body, etag, headers, size, now + RESPONSE_CACHE_TTL)
+                _size += size
+                while len(_entries) > RESPONSE_CACHE_ENTRIES or _size > RESPONSE_CACHE_MAX_BYTES:
+                    _drop(next(iter(_entries)))
+    return body, etag, headers
+
+
+def invalidate():
+    """Forget every cached response; called after invoices are written"""
+    global _generation, _size
+    with _lock:
+        _generation += 1
+        _entries.clear()
+        _size = 0
+    RESPONSE_CACHE.inc(event='invalidation')
+
+
+def cache_info():
+    with _lock:
+        return {'entries': len(_entries), 'bytes': _size, 'ttl': RESPONSE_CACHE_TTL}
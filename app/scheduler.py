@@ -0,0 +1,274 @@
+# app/scheduler.py
+"""Cost-aware scheduling of extraction work onto the engine.
+
+Every file is given a cost estimate before it is queued: its pages (read from the PDF's
+header and trailer) or megapixels (read from the image header), times the seconds such a
+unit has lately taken the worker function that will run it (run_pipeline and run_ocr do
+different amounts of work, so each keeps its own rates). Work then waits in one of two lanes:
+
+- interactive: single uploads someone is waiting on. Always dispatched first, and
+  SCHED_INTERACTIVE_RESERVED workers are kept for it, so a new upload never waits
+  behind a running backfill. Uploads estimated above SCHED_INTERACTIVE_MAX_COST
+  (a 50-page scan) are moved to the bulk lane.
+- bulk: bulk uploads and background jobs, in arrival order.
+
+Within a lane, no client runs more than SCHED_CLIENT_CONCURRENCY files at once; a client
+at its quota is passed over until one of its files finishes. Before queueing, the wait is
+estimated from the work already queued and running; past the lane's SLO the file is
+refused with Overloaded, which callers treat like EngineBusy (503 for uploads, try again
+later for bulk work).
+"""
+import asyncio
+import heapq
+import io
+import logging
+import os
+import re
+import time
+from collections import deque
+
+from app.metrics import SCHEDULER_EVENTS, SCHEDULER_WAIT
+from app.workers import EngineBusy
+from config import (
+    SCHED_BULK_SLO,
+    SCHED_CLIENT_CONCURRENCY,
+    SCHED_INTERACTIVE_MAX_COST,
+    SCHED_INTERACTIVE_RESERVED,
+    SCHED_INTERACTIVE_SLO,
+    SCHED_SECONDS_PER_MEGAPIXEL,
+    SCHED_SECONDS_PER_PAGE,
+    SCHED_SECONDS_PER_TEXT,
+)
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BULK = "interactive", "bulk"
+# In priority order
+LANES = (INTERACTIVE, BULK)
+SLO = {INTERACTIVE: SCHED_INTERACTIVE_SLO, BULK: SCHED_BULK_SLO}
+
+# '/Type /Pages ... /Count 12': the page tree root holds the largest count
+_PAGE_COUNT = re.compile(rb'/Count\s+(\d+)')
+# Linearized PDFs give their page count in the first object: '/Linearized 1 ... /N 12'
+_LINEARIZED_PAGES = re.compile(rb'/Linearized\s.{0,200}?/N\s+(\d+)', re.DOTALL)
+# Bytes read from each end of a PDF: writers put the catalog and page tree root next to
+# the header (linearized files) or next to the trailer (most others, and incremental updates)
+_SCAN_BYTES = 64 * 1024
+# For PDFs whose page tree is elsewhere or in compressed object streams
+_BYTES_PER_SCANNED_PAGE = 150_000
+# Weight of the newest file in the seconds-per-unit averages
+_LEARNING_RATE = 0.2
+# Seconds per unit before anything has finished
+_STARTING_RATES = {'page': SCHED_SECONDS_PER_PAGE, 'megapixel': SCHED_SECONDS_PER_MEGAPIXEL,
+                   'text': SCHED_SECONDS_PER_TEXT}
+
+
+class Overloaded(EngineBusy):
+    """Raised when a file's estimated wait is past its lane's SLO"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def pdf_page_count(file_path):
+    """Pages in a PDF from its header or the /Count entries near either end, without parsing
+    it or reading the middle of the file; None if they aren't there"""
+    with open(file_path, "rb") as f:
+        head = f.read(_SCAN_BYTES)
+        match = _LINEARIZED_PAGES.search(head, 0, 1024)
+        if match:
+            return int(match.group(1)) or None
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        tail = b""
+        if size > len(head):
+            f.seek(max(len(head), size - _SCAN_BYTES))
+            tail = f.read()
+    counts = [int(match.group(1)) for window in (head, tail) for match in _PAGE_COUNT.finditer(window)]
+    return max(counts, default=0) or None
+
+
+def image_megapixels(file_path, data=None):
+    """Megapixels from the image header (nothing is decoded); None if it can't be read"""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data) if data is not None else file_path) as image:
+            width, height = image.size
+    except Exception:
+        return None
+    return width * height / 1e6
+
+
+class CostModel:
+    """Seconds per unit of work ('page' of a PDF, 'megapixel' of an image, 'text' for batched
+    NER), learned from finished runs separately for each worker function"""
+
+    def __init__(self):
+        # (function name, unit) -> seconds per unit
+        self.rates = {}
+
+    def rate(self, work, unit):
+        return self.rates.get((work, unit), _STARTING_RATES[unit])
+
+    def estimate(self, fn, file_path, data=None):
+        """{'work', 'unit', 'units', 'seconds'} for running fn on a stored upload (reads headers only)"""
+        if file_path.lower().endswith('.pdf'):
+            unit = 'page'
+            units = pdf_page_count(file_path)
+            if units is None:
+                units = max(1, round(os.path.getsize(file_path) / _BYTES_PER_SCANNED_PAGE))
+        else:
+            unit = 'megapixel'
+            # Tiny images still pay for a Tesseract call
+            units = max(0.5, image_megapixels(file_path, data) or 12.0)
+        return self.estimate_units(fn, unit, units)
+
+    def estimate_units(self, fn, unit, units):
+        """The same for work already measured in units, such as a batch of texts"""
+        work = fn.__name__
+        return {'work': work, 'unit': unit, 'units': units, 'seconds': units * self.rate(work, unit)}
+
+    def observe(self, estimate, seconds):
+        """Fold the seconds a finished run took in its worker into the rate for its function and unit"""
+        key = (estimate['work'], estimate['unit'])
+        rate = self.rate(*key)
+        self.rates[key] = rate + _LEARNING_RATE * (seconds / estimate['units'] - rate)
+
+
+def _timed(fn, *args):
+    """Run fn in the worker and time it there, so time queued in the engine isn't counted"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class _Ticket:
+    __slots__ = ('lane', 'client', 'seconds', 'ready', 'queued', 'started')
+
+    def __init__(self, lane, client, seconds):
+        self.lane = lane
+        self.client = client
+        self.seconds = seconds
+        self.ready = asyncio.get_running_loop().create_future()
+        self.queued = time.monotonic()
+        self.started = None
+
+
+class Scheduler:
+    """Decides which queued file the engine runs next; used from the event loop only"""
+
+    def __init__(self, engine, slots=None, reserved=SCHED_INTERACTIVE_RESERVED,
+                 client_limit=SCHED_CLIENT_CONCURRENCY, cost_model=None):
+        self.engine = engine
+        self.slots = slots or engine.workers
+        # Bulk work keeps at least one worker, even on a single-core machine
+        self.bulk_slots = max(1, self.slots - reserved)
+        self.client_limit = client_limit
+        self.cost_model = cost_model or CostModel()
+        self._queues = {lane: deque() for lane in LANES}
+        self._running = set()
+        self._by_client = {}
+
+    def queued(self):
+        """{lane: files waiting}, for the metrics"""
+        return {lane: len(queue) for lane, queue in self._queues.items()}
+
+    def running(self):
+        counts = dict.fromkeys(LANES, 0)
+        for ticket in self._running:
+            counts[ticket.lane] += 1
+        return counts
+
+    def estimated_wait(self, lane):
+        """Seconds before a file queued now in lane would start.
+
+        The running files' remaining estimates and the files queued ahead in the same lane
+        are played out over the lane's workers, each taking the worker that frees up first.
+        """
+        now = time.monotonic()
+        capacity = self.slots if lane == INTERACTIVE else self.bulk_slots
+        free_at = sorted(max(0.0, ticket.seconds - (now - ticket.started)) for ticket in self._running
+                         if lane == INTERACTIVE or ticket.lane == BULK)[:capacity]
+        free_at += [0.0] * (capacity - len(free_at))
+        heapq.heapify(free_at)
+        for ticket in self._queues[lane]:
+            heapq.heapreplace(free_at, free_at[0] + ticket.seconds)
+        return free_at[0]
+
+    def lane_for(self, lane, estimate):
+        if lane == INTERACTIVE and estimate['seconds'] > SCHED_INTERACTIVE_MAX_COST:
+            SCHEDULER_EVENTS.inc(lane=lane, event='demoted')
+            return BULK
+        return lane
+
+    async def run(self, fn, *args, estimate, lane=BULK, client=None, ahead=False):
+        """Run fn(*args) on the engine when its turn comes and return the result.
+
+        estimate comes from cost_model.estimate() for fn; client is whatever identifies the
+        caller for the quota (None: no quota). Raises Overloaded when the lane is past its SLO.
+        With ahead, the work goes in front of the lane's queue and is always admitted: for
+        work that finishes files admitted earlier, such as their batched NER.
+        """
+        lane = self.lane_for(lane, estimate)
+        wait = 0.0 if ahead else self.estimated_wait(lane)
+        if wait > SLO[lane]:
+            SCHEDULER_EVENTS.inc(lane=lane, event='rejected')
+            logger.warning("Extraction refused: estimated wait over the SLO", extra={
+                'lane': lane, 'client': client, 'estimated_wait': round(wait, 1), 'cost': round(estimate['seconds'], 1)})
+            raise Overloaded(f"Estimated wait of {wait:.0f}s for {lane} work is over its {SLO[lane]:.0f}s target",
+                             retry_after=max(1, round(wait - SLO[lane])))
+        SCHEDULER_EVENTS.inc(lane=lane, event='admitted')
+
+        ticket = _Ticket(lane, client, estimate['seconds'])
+        if ahead:
+            self._queues[lane].appendleft(ticket)
+        else:
+            self._queues[lane].append(ticket)
+        self._dispatch()
+        try:
+            await ticket.ready
+            SCHEDULER_WAIT.observe(ticket.started - ticket.queued, lane=lane)
+            result, seconds = await self.engine.run(_timed, fn, *args)
+            self.cost_model.observe(estimate, seconds)
+            return result
+        finally:
+            if ticket.started is None:
+                # Cancelled while waiting for its turn
+                self._queues[lane].remove(ticket)
+            else:
+                self._finish(ticket)
+
+    def _finish(self, ticket):
+        self._running.discard(ticket)
+        if ticket.client is not None:
+            self._by_client[ticket.client] -= 1
+            if not self._by_client[ticket.client]:
+                del self._by_client[ticket.client]
+        self._dispatch()
+
+    def _next(self):
+        """Take the first ticket, interactive lane first, whose client is under its quota"""
+        bulk_running = self.running()[BULK]
+        for lane in LANES:
+            if lane == BULK and bulk_running >= self.bulk_slots:
+                continue
+            queue = self._queues[lane]
+            for ticket in queue:
+                if ticket.client is None or self._by_client.get(ticket.client, 0) < self.client_limit:
+                    queue.remove(ticket)
+                    return ticket
+        return None
+
+    def _dispatch(self):
+        while len(self._running) < self.slots:
+            ticket = self._next()
+            if ticket is None:
+                return
+            ticket.started = time.monotonic()
+            self._running.add(ticket)
+            if ticket.client is not None:
+                self._by_client[ticket.client] = self._by_client.get(ticket.client, 0) + 1
+            if not ticket.ready.done():
+                ticket.ready.set_result(None)
@@ -0,0 +1,257 @@
+# app/search.py
+import heapq
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from difflib import SequenceMatcher
+
+from app.db_backends import DatabaseError, get_storage
+from config import SEARCH_FUZZY_THRESHOLD, SEARCH_RANK_WINDOW, SEARCH_VENDOR_MATCHES, SEARCH_VENDOR_REFRESH
+
+logger = logging.getLogger(__name__)
+
+# Full-text index over vendor, invoice number and OCR text, kept in step with the invoices
+# table. The SQLite table is contentless: it holds the index only, not a second copy of the text.
+SEARCH_SCHEMA = {
+    'mysql': """
+        CREATE TABLE IF NOT EXISTS invoice_search (
+            invoice_id INT PRIMARY KEY,
+            vendor VARCHAR(255),
+            invoice_number VARCHAR(100),
+            raw_text MEDIUMTEXT,
+            FULLTEXT KEY ft_invoice_search (vendor, invoice_number, raw_text)
+        )
+    """,
+    'sqlite': """
+        CREATE VIRTUAL TABLE IF NOT EXISTS invoice_search USING fts5(
+            vendor, invoice_number, raw_text,
+            content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+        )
+    """,
+}
+
+# Rows are inserted from the values being saved: the invoices table no longer holds the text
+SEARCH_INSERT = {
+    'mysql': "INSERT INTO invoice_search (invoice_id, vendor, invoice_number, raw_text)",
+    'sqlite': "INSERT INTO invoice_search (rowid, vendor, invoice_number, raw_text)",
+}
+_REBUILD_BATCH = 1000
+
+# Matching invoice ids with a relevance score, higher is better. bm25 weights a vendor
+# hit over an invoice number hit over a word somewhere in the OCR text.
+_HITS = {
+    'mysql': """
+        SELECT invoice_id AS hit_id,
+               MATCH (vendor, invoice_number, raw_text) AGAINST (%s IN BOOLEAN MODE) AS score
+        FROM invoice_search
+        WHERE MATCH (vendor, invoice_number, raw_text) AGAINST (%s IN BOOLEAN MODE)
+    """,
+    'sqlite': """
+        SELECT rowid AS hit_id, -bm25(invoice_search, 10.0, 5.0, 1.0) AS score
+        FROM invoice_search WHERE invoice_search MATCH %s AND rowid >= %s
+    """,
+}
+# Scoring is the expensive part of an FTS5 query, so a word found in a large share of all
+# invoices is ranked among its SEARCH_RANK_WINDOW newest matches only
+_WINDOW_START = """
+    SELECT rowid AS id FROM invoice_search WHERE invoice_search MATCH %s
+    ORDER BY rowid DESC LIMIT 1 OFFSET %s
+"""
+
+_WORD = re.compile(r'\w+')
+# Vendors sharing the most trigrams with the query that get a full similarity check
+_SHORTLIST = 200
+
+
+def init_search(db, backend):
+    """Create the search index and fill it from history the first time"""
+    db.execute(SEARCH_SCHEMA[backend])
+    # A contentless FTS5 table can't be read back, so ask its document-size shadow table
+    probe = ("SELECT 1 AS present FROM invoice_search_docsize LIMIT 1" if backend == 'sqlite'
+             else "SELECT 1 AS present FROM invoice_search LIMIT 1")
+    if db.query_one(probe):
+        return
+    from app.blobs import load_texts
+
+    last_id, indexed = 0, 0
+    while True:
+        rows = db.query("SELECT id, vendor, invoice_number, raw_text FROM invoices "
+                        "WHERE id > %s ORDER BY id LIMIT %s", (last_id, _REBUILD_BATCH))
+        if not rows:
+            break
+        load_texts(db, rows)
+        update_search(db, backend, [(row['id'], row['vendor'], row['invoice_number'], row['raw_text'])
+                                    for row in rows])
+        last_id = rows[-1]['id']
+        indexed += len(rows)
+    if indexed:
+        logger.info("Search index rebuilt from existing invoices", extra={'invoices': indexed})
+
+
+def update_search(db, backend, rows):
+    """Index (invoice_id, vendor, invoice_number, raw_text) rows (call inside the insert transaction)"""
+    if rows:
+        # FTS5 wants text in every column
+        db.insert_many(SEARCH_INSERT[backend], [(invoice_id, vendor, number or '', text or '')
+                                                for invoice_id, vendor, number, text in rows])
+
+
+def match_expression(query, backend):
+    """Turn free text into an index query where every word must match as a prefix"""
+    words = _WORD.findall(query.lower())
+    if backend == 'mysql':
+        return " ".join(f"+{word}*" for word in words)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _normalize(name):
+    return " ".join(_WORD.findall(name.lower()))
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class VendorIndex:
+    """Trigram index over the distinct vendor names, for finding them despite OCR typos"""
+
+    def __init__(self, vendors=()):
+        self.vendors = []
+        self.names = []
+        self.postings = {}
+        for vendor in vendors:
+            self.add(vendor)
+
+    def add(self, vendor):
+        position = len(self.vendors)
+        self.vendors.append(vendor)
+        self.names.append(_normalize(vendor))
+        for gram in _trigrams(self.names[position]):
+            self.postings.setdefault(gram, []).append(position)
+
+    def match(self, name, limit=SEARCH_VENDOR_MATCHES, threshold=SEARCH_FUZZY_THRESHOLD, partial=True):
+        """[(vendor, similarity)] best first: word-prefix matches score 1.0, others their
+        edit similarity to the query (against the name or its first words, whichever is closer).
+
+        With partial=False only whole names are compared, for telling spellings of one name apart.
+        """
+        query = _normalize(name)
+        if not query:
+            return []
+        shared = Counter()
+        for gram in _trigrams(query):
+            shared.update(self.postings.get(gram, ()))
+
+        words = query.count(" ") + 1
+        matcher = SequenceMatcher(autojunk=False)
+        matcher.set_seq2(query)
+        matches = []
+        for position in heapq.nlargest(_SHORTLIST, shared, key=shared.get):
+            candidate = self.names[position]
+            if partial and (" " + candidate).find(" " + query) >= 0:
+                similarity = 1.0
+            else:
+                similarity = 0.0
+                # "wa1mart" should find "Walmart Supercenter", so compare with the leading words too
+                texts = {candidate, " ".join(candidate.split(" ")[:words])} if partial else (candidate,)
+                for text in texts:
+                    matcher.set_seq1(text)
+                    # The cheap upper bounds rule out most candidates before the real ratio
+                    if matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold:
+                        similarity = max(similarity, matcher.ratio())
+            if similarity >= threshold:
+                matches.append((self.vendors[position], similarity))
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:limit]
+
+
+_vendor_index = None
+_vendor_index_built = 0.0
+_vendor_index_lock = threading.Lock()
+
+
+def get_vendor_index():
+    """The vendor index, rebuilt from the summary table every SEARCH_VENDOR_REFRESH seconds"""
+    global _vendor_index, _vendor_index_built
+    with _vendor_index_lock:
+        if _vendor_index is None or time.monotonic() - _vendor_index_built > SEARCH_VENDOR_REFRESH:
+            # invoice_summary has one row per month/category/vendor, far fewer than invoices
+            with get_storage().session() as db:
+                rows = db.query("SELECT DISTINCT vendor FROM invoice_summary")
+            _vendor_index = VendorIndex([row['vendor'] for row in rows])
+            _vendor_index_built = time.monotonic()
+        return _vendor_index
+
+
+def search_invoices(q=None, vendor=None, fuzzy=True, category=None, date_from=None, date_to=None,
+                    limit=20, offset=0):
+    """Ranked invoice search by words (prefix matched) and/or vendor name.
+
+    A vendor is matched by prefix and, when fuzzy, by trigram similarity; the vendors it
+    resolved to are returned with the hits. Returns {"items": [...], "vendors": [...]}.
+    """
+    from app.database import DEFAULT_LIST_FIELDS, _filter_clauses, _serialize
+
+    storage = get_storage()
+    clauses, params = _filter_clauses(category=category, date_from=date_from, date_to=date_to)
+    vendors = []
+    if vendor:
+        try:
+            matches = get_vendor_index().match(vendor, threshold=SEARCH_FUZZY_THRESHOLD if fuzzy else 1.0)
+        except DatabaseError as e:
+            logger.error("Error loading vendors", extra={'error': str(e)})
+            return {"items": [], "vendors": []}
+        vendors = [{"vendor": name, "similarity": round(similarity, 3)} for name, similarity in matches]
+        if not matches:
+            return {"items": [], "vendors": []}
+        clauses.append(f"vendor IN ({', '.join(['%s'] * len(matches))})")
+        params.extend(name for name, _ in matches)
+
+    columns = ", ".join(DEFAULT_LIST_FIELDS)
+    expression = match_expression(q, storage.name) if q else ""
+    window_start = None
+    if expression:
+        if storage.name == 'mysql':
+            hit_params = [expression, expression]
+        else:
+            # Filters could leave the window short of results, so they get exact ranking
+            window_start = SEARCH_RANK_WINDOW if SEARCH_RANK_WINDOW and not clauses else None
+            hit_params = [expression, 0]
+        query = (f"SELECT {columns}, hits.score AS score FROM invoices "
+                 f"JOIN ({_HITS[storage.name]}) hits ON invoices.id = hits.hit_id")
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY score DESC, id DESC LIMIT %s OFFSET %s"
+        params = hit_params + params
+    elif vendors:
+        # Closest vendor first, newest first within a vendor
+        similarity = {item['vendor']: item['similarity'] for item in vendors}
+        ranking = " ".join(["WHEN %s THEN %s"] * len(vendors))
+        query = f"SELECT {columns} FROM invoices WHERE {' AND '.join(clauses)}"
+        query += f" ORDER BY CASE vendor {ranking} END DESC, processed_at DESC, id DESC LIMIT %s OFFSET %s"
+        for name, score in similarity.items():
+            params.extend([name, score])
+    else:
+        raise ValueError("Provide search words (q) or a vendor")
+    params.extend([limit, offset])
+
+    try:
+        with storage.session() as db:
+            if window_start is not None:
+                start = db.query_one(_WINDOW_START, (expression, window_start - 1))
+                if start is not None:
+                    params[1] = start['id']
+            items = [_serialize(row) for row in db.query(query, tuple(params))]
+    except DatabaseError as e:
+        logger.error("Error searching invoices", extra={'error': str(e)})
+        return {"items": [], "vendors": vendors}
+
+    for item in items:
+        if 'score' in item:
+            item['score'] = float(item['score'])
+        else:
+            item['score'] = similarity[item['vendor']]
+    return {"items": items, "vendors": vendors}
@@ -0,0 +1,132 @@
+# app/uploads.py
+import hashlib
+import os
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from app.metrics import UPLOAD_BYTES, UPLOADS_REJECTED
+from config import MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE, UPLOAD_MEMORY_LIMIT
+
+# Leading bytes of every accepted format
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'PK\x03\x04', 'zip'),
+)
+# The pipeline only cares whether a file is a PDF or an image, so a PNG named .jpg is fine
+_FAMILIES = {'pdf': 'pdf', 'png': 'image', 'jpeg': 'image', 'zip': 'zip'}
+_EXTENSION_FAMILIES = {'pdf': 'pdf', 'png': 'image', 'jpg': 'image', 'jpeg': 'image', 'zip': 'zip'}
+# Room for the multipart boundary and part headers around the file itself
+FORM_OVERHEAD = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """Raised when an upload's content or size is not acceptable"""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _megabytes(size):
+    return f"{size / (1024 * 1024):g}MB"
+
+
+def sniff(head):
+    """File kind from its first bytes: 'pdf', 'png', 'jpeg', 'zip' or None"""
+    # PDF readers accept the header anywhere in the first kilobyte
+    if b'%PDF-' in head[:1024]:
+        return 'pdf'
+    for signature, kind in _SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+def expected_family(filename):
+    """'pdf', 'image' or 'zip' according to the extension, None if it isn't accepted"""
+    if '.' not in filename:
+        return None
+    return _EXTENSION_FAMILIES.get(filename.rsplit('.', 1)[1].lower())
+
+
+def store_upload(source, file_path, expected, limit=MAX_FILE_SIZE, memory_limit=UPLOAD_MEMORY_LIMIT):
+    """Copy an upload to file_path chunk by chunk, hashing it on the way.
+
+    The type is checked on the first chunk and the size after every chunk, so junk or
+    oversized uploads are refused without being copied. Returns {'kind', 'size',
+    'content_hash', 'data'}, where data holds the bytes of images up to memory_limit so
+    they can be decoded without reading the file back.
+    """
+    head = source.read(UPLOAD_CHUNK_SIZE)
+    kind = sniff(head)
+    if kind is None or _FAMILIES[kind] != expected:
+        UPLOADS_REJECTED.inc(status=415)
+        raise UploadRejected(415, "File content does not match its extension. Please upload PNG, JPG, or PDF.")
+
+    digest = hashlib.sha256()
+    size = 0
+    kept = [] if _FAMILIES[kind] == 'image' else None
+    try:
+        with open(file_path, "wb") as target:
+            chunk = head
+            while chunk:
+                size += len(chunk)
+                if size > limit:
+                    UPLOADS_REJECTED.inc(status=413)
+                    raise UploadRejected(413, f"File is larger than the {_megabytes(limit)} limit.")
+                digest.update(chunk)
+                target.write(chunk)
+                if kept is not None and size <= memory_limit:
+                    kept.append(chunk)
+                else:
+                    kept = None
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    UPLOAD_BYTES.observe(size)
+    return {'kind': kind, 'size': size, 'content_hash': digest.hexdigest(),
+            'data': b"".join(kept) if kept is not None else None}
+
+
+class UploadSizeLimit:
+    """ASGI middleware that refuses request bodies over a per-path limit as they arrive.
+
+    A declared Content-Length over the limit is answered before any of the body is read;
+    otherwise the body is counted while it streams in and cut off once it goes over.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope['path']) if scope['type'] == 'http' else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        message = "Upload exceeds the size limit."
+        declared = dict(scope['headers']).get(b'content-length')
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            UPLOADS_REJECTED.inc(status=413)
+            await JSONResponse({'detail': message}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            event = await receive()
+            if event['type'] == 'http.request':
+                received += len(event.get('body', b''))
+                if received > limit:
+                    UPLOADS_REJECTED.inc(status=413)
+                    # Raised while FastAPI parses the form, which passes HTTPException through
+                    raise HTTPException(413, message)
+            return event
+
+        await self.app(scope, limited_receive, send)
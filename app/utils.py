@@ -0,0 +1,15 @@
+import os
+from datetime import datetime
+
+from config import ALLOWED_EXTENSIONS
+
+
+def stored_filename(original_name, tag=None):
+    """Timestamped name an upload is stored under in the upload directory"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    base = os.path.basename(original_name)
+    return f"{timestamp}_{tag}_{base}" if tag is not None else f"{timestamp}_{base}"
+
+
+def is_allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -0,0 +1,316 @@
+# app/vendors.py
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import deque
+
+from app.nlp import is_misread_word
+from app.search import VendorIndex
+from config import VENDOR_ALIAS_THRESHOLD, VENDOR_DB_PATH, VENDOR_RULES_CHECK, VENDOR_RULES_PATH
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_VENDOR = "Unknown Vendor"
+
+_WORD = re.compile(r'\w+')
+# Digits OCR reads in place of letters ("wa1mart", "5tarbucks")
+_CONFUSABLE_DIGITS = str.maketrans('0158', 'olsb')
+_CONFUSABLE_DIGITS_UPPER = str.maketrans('0158', 'OLSB')
+_STORE_NUMBER = re.compile(r'\s*(?:#|no\.)\s*\d+', re.IGNORECASE)
+# Legal-form words that vary between receipts of the same merchant
+_NOISE_WORDS = {'the', 'inc', 'llc', 'ltd', 'co', 'corp', 'corporation', 'company', 'plc', 'gmbh',
+                'pty', 'sdn', 'bhd'}
+# Vendor -> category results remembered between rule reloads
+_MEMO_LIMIT = 100000
+
+
+def display_name(name):
+    """A vendor name as first seen, tidied up to serve as the canonical spelling"""
+    name = _STORE_NUMBER.sub("", name)
+    name = _WORD.sub(lambda match: match.group().translate(
+        _CONFUSABLE_DIGITS_UPPER if match.group().isupper() else _CONFUSABLE_DIGITS
+    ) if is_misread_word(match.group()) else match.group(), name)
+    return " ".join(name.split())
+
+
+def vendor_key(name):
+    """Spelling-insensitive key for a vendor name: case, accents, punctuation, store numbers
+    and digit/letter OCR confusions don't change it"""
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    text = "".join(char for char in decomposed if not unicodedata.combining(char))
+    words = []
+    for word in _WORD.findall(text):
+        if word.isdigit():
+            continue  # Store and branch numbers
+        if is_misread_word(word):
+            word = word.translate(_CONFUSABLE_DIGITS)
+        words.append(word)
+    kept = [word for word in words if word not in _NOISE_WORDS]
+    return " ".join(kept or words)
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over the rule keywords: one pass over a text finds every
+    keyword in it, however many rules there are"""
+
+    def __init__(self, keywords):
+        """keywords: (keyword, priority) pairs; a lower priority wins when several match"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [None]
+        for keyword, priority in keywords:
+            node = 0
+            for char in keyword:
+                node = self._goto[node].get(char) or self._new_state(node, char)
+            if self._best[node] is None or priority < self._best[node]:
+                self._best[node] = priority
+
+        # Breadth-first, so every failure link points at an already finished state
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                # A state also matches every keyword that ends its longest proper suffix
+                inherited = self._best[self._fail[child]]
+                if inherited is not None and (self._best[child] is None or inherited < self._best[child]):
+                    self._best[child] = inherited
+                queue.append(child)
+
+    def _new_state(self, parent, char):
+        self._goto.append({})
+        self._fail.append(0)
+        self._best.append(None)
+        self._goto[parent][char] = len(self._goto) - 1
+        return len(self._goto) - 1
+
+    def best(self, text):
+        """Lowest priority among the keywords found in text, or None"""
+        goto, fail, best_at = self._goto, self._fail, self._best
+        node, best = 0, None
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            found = best_at[node]
+            if found is not None and (best is None or found < best):
+                best = found
+        return best
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def init_vendor_db(db_path=VENDOR_DB_PATH):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = _connect(db_path)
+    try:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS vendor_aliases (
+            alias_key TEXT PRIMARY KEY,
+            vendor TEXT NOT NULL,
+            learned INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        )
+        """)
+    finally:
+        conn.close()
+
+
+class VendorRegistry:
+    """Canonical vendor names and their categories.
+
+    Every spelling of a vendor is reduced to a vendor_key. Keys are mapped to one canonical
+    name through the rule file's aliases and an alias table shared by all worker processes:
+    the first spelling seen becomes the canonical name, and later spellings close enough to
+    it are learned as aliases. Categories come from the rule file's keyword lists, checked
+    in order against the lowercased canonical name, and are memoized.
+    """
+
+    def __init__(self, rules_path=VENDOR_RULES_PATH, db_path=VENDOR_DB_PATH):
+        self.rules_path = rules_path
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._rules_mtime = None
+        self._rules_checked = 0.0
+        try:
+            init_vendor_db(db_path)
+            self._shared = True
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Vendor alias table unavailable, aliases are kept in memory only",
+                           extra={'error': str(e)})
+            self._shared = False
+        self.reload()
+
+    def reload(self):
+        """Re-read the rule file and start over with fresh aliases and memoized categories"""
+        with open(self.rules_path, encoding="utf-8") as f:
+            rules = json.load(f)
+        self._rules_mtime = os.path.getmtime(self.rules_path)
+        self._rules_checked = time.monotonic()
+
+        self.default_category = rules.get('default', "Misc")
+        self._category_names = [rule['category'] for rule in rules.get('categories', [])]
+        # Rules are listed in priority order: the first category with a matching keyword wins
+        self._matcher = KeywordMatcher(
+            (keyword.casefold(), priority)
+            for priority, rule in enumerate(rules.get('categories', []))
+            for keyword in rule['keywords']
+        )
+        self._overrides = {vendor_key(vendor): category
+                           for vendor, category in rules.get('vendors', {}).items()}
+        self._rule_aliases = {}
+        for vendor, spellings in rules.get('aliases', {}).items():
+            for spelling in [vendor, *spellings]:
+                self._rule_aliases[vendor_key(spelling)] = vendor
+
+        self._aliases = {}
+        self._canonical = {}
+        self._index = VendorIndex()
+        self._last_rowid = 0
+        self._categories = {}
+        for vendor in rules.get('aliases', {}):
+            self._add_canonical(vendor_key(vendor), vendor)
+        self._sync()
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._rules_checked < VENDOR_RULES_CHECK:
+            return
+        self._rules_checked = now
+        try:
+            changed = os.path.getmtime(self.rules_path) != self._rules_mtime
+        except OSError:
+            return
+        if changed:
+            try:
+                self.reload()
+                logger.info("Reloaded vendor rules", extra={'path': self.rules_path})
+            except (OSError, ValueError, KeyError) as e:
+                # Keep the rules that are loaded until the file is fixed
+                logger.warning("Could not reload vendor rules", extra={'error': str(e)})
+
+    def _add_canonical(self, key, vendor):
+        if key not in self._canonical:
+            self._canonical[key] = vendor
+            self._index.add(key)
+
+    def _remember(self, key, vendor):
+        self._aliases[key] = vendor
+        canonical_key = vendor_key(vendor)
+        if canonical_key == key:
+            self._add_canonical(key, vendor)
+
+    def _sync(self):
+        """Pick up aliases other processes have added since the last look"""
+        if not self._shared:
+            return
+        try:
+            conn = _connect(self.db_path)
+            try:
+                rows = conn.execute(
+                    "SELECT rowid, alias_key, vendor FROM vendor_aliases WHERE rowid > ? ORDER BY rowid",
+                    (self._last_rowid,),
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning("Could not read vendor aliases", extra={'error': str(e)})
+            return
+        for row in rows:
+            self._remember(row['alias_key'], row['vendor'])
+            self._last_rowid = row['rowid']
+
+    def _learn(self, key, name):
+        """Map an unseen key to the closest canonical vendor, or make name a new canonical one"""
+        matches = self._index.match(key, limit=1, threshold=VENDOR_ALIAS_THRESHOLD, partial=False)
+        vendor = self._canonical[matches[0][0]] if matches else name
+        if self._shared:
+            try:
+                conn = _connect(self.db_path)
+                try:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO vendor_aliases (alias_key, vendor, learned, created_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (key, vendor, 1 if matches else 0, time.time()),
+                    )
+                    # Another worker may have got there first; its answer stands
+                    vendor = conn.execute(
+                        "SELECT vendor FROM vendor_aliases WHERE alias_key = ?", (key,)
+                    ).fetchone()['vendor']
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logger.warning("Could not record vendor alias", extra={'error': str(e)})
+        self._remember(key, vendor)
+        return vendor
+
+    def canonical(self, name):
+        """The canonical spelling of a vendor name, learning it if it hasn't been seen"""
+        if not isinstance(name, str) or name == UNKNOWN_VENDOR:
+            return name
+        key = vendor_key(name)
+        if not key:
+            return name
+        with self._lock:
+            self._maybe_reload()
+            vendor = self._rule_aliases.get(key) or self._aliases.get(key)
+            if vendor is None:
+                self._sync()
+                vendor = self._aliases.get(key) or self._learn(key, display_name(name) or name.strip())
+            return vendor
+
+    def category(self, name):
+        """Category of a vendor by the rule file, the same for all of its known spellings"""
+        if not isinstance(name, str):
+            name = ""
+        key = vendor_key(name)
+        with self._lock:
+            self._maybe_reload()
+            vendor = self._rule_aliases.get(key) or self._aliases.get(key)
+            if vendor is not None:
+                name, key = vendor, vendor_key(vendor)
+            # Keywords are found in the lowercased name, as the original rules did; the key
+            # drops digits and words a keyword could be part of
+            text = name.lower()
+            category = self._categories.get(text)
+            if category is None:
+                category = self._overrides.get(key)
+                if category is None:
+                    priority = self._matcher.best(text)
+                    category = (self._category_names[priority] if priority is not None
+                                else self.default_category)
+                if len(self._categories) >= _MEMO_LIMIT:
+                    self._categories.clear()
+                self._categories[text] = category
+            return category
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the process-wide vendor registry, loading the rule file on first use"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = VendorRegistry()
+        return _registry
+
+
+def canonical_vendor(name):
+    return get_registry().canonical(name)
@@ -0,0 +1,302 @@
+# app/workers.py
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.logs import configure_logging
+from app.metrics import NLP_BATCHES, STAGE_SECONDS
+from config import (
+    EXTRACTION_EXECUTOR,
+    EXTRACTION_WORKERS,
+    EXTRACTION_MAX_PENDING,
+    EXTRACTION_START_METHOD,
+    NLP_BATCH_SIZE,
+    NLP_BATCH_WAIT,
+    OCR_CORES,
+)
+
+
+class EngineBusy(Exception):
+    """Raised when the extraction queue is full and new work must be refused"""
+
+
+def warm_worker(cores=None):
+    """Load Tesseract, OpenCV and spaCy state once per worker process.
+
+    cores is the engine's shared core budget, for worker processes.
+    """
+    import cv2
+
+    # Spawned workers start with bare logging; give them the API's format
+    configure_logging()
+
+    # One OpenCV/Tesseract thread per task; the pools themselves provide the parallelism
+    cv2.setNumThreads(1)
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+    from app.nlp import get_nlp
+    from app.ocr import share_cores
+    from app.ocr_backends import OCRBackendUnavailable, get_ocr_backend
+
+    if cores is not None:
+        share_cores(cores)
+
+    try:
+        get_ocr_backend()
+    except OCRBackendUnavailable:
+        pass  # Reported again when the first file is processed
+    nlp = get_nlp()
+    if nlp is not None:
+        nlp("warm up")
+
+    from app.vendors import get_registry
+
+    get_registry()
+
+
+def _ready():
+    """No-op task used to bring every worker up (and through warm_worker) ahead of time"""
+    return os.getpid()
+
+
+def run_pipeline(file_path, data=None, profile=False):
+    """Run OCR, NLP and categorization on one file and return data plus stage timings.
+
+    data optionally holds the bytes of an image upload kept in memory. With profile, the
+    run is profiled here in the worker and the report returned as result['profile'].
+    """
+    if profile:
+        from app.profiling import profile_call
+
+        result, report = profile_call(run_pipeline, file_path, data)
+        return dict(result, profile=report)
+
+    from app.ocr import extract_text_from_image
+    from app.nlp import extract_invoice_data
+    from app.categorization import categorize_expense
+    from app.vendors import canonical_vendor
+
+    # 'stages' collects OCR sub-stages: text layer, rasterize/decode, preprocessing steps, tesseract
+    timings = {'stages': {}, 'pages': []}
+    # One OCR confidence per character of the text, for per-field confidences
+    confidence = bytearray()
+
+    start = time.perf_counter()
+    extracted_text = extract_text_from_image(file_path, timings['stages'], timings['pages'], data, confidence)
+    timings['ocr'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    invoice_data = extract_invoice_data(extracted_text, confidence)
+    timings['nlp'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # OCR variants of a merchant's name are stored under one spelling
+    invoice_data['vendor'] = canonical_vendor(invoice_data['vendor'])
+    invoice_data['category'] = categorize_expense(invoice_data)
+    timings['categorization'] = time.perf_counter() - start
+
+    return {"data": invoice_data, "timings": timings}
+
+
+def run_ocr(file_path):
+    """OCR stage only; the text is handed to ExtractionBatcher for batched NER"""
+    from app.ocr import extract_text_from_image
+
+    stages, pages, confidence = {}, [], bytearray()
+    start = time.perf_counter()
+    text = extract_text_from_image(file_path, stages, pages, confidence=confidence)
+    timings = {'ocr': time.perf_counter() - start, 'stages': stages, 'pages': pages}
+    return {"text": text, "confidence": confidence, "timings": timings}
+
+
+def run_extraction_batch(texts, confidences=None):
+    """NER + categorization for many OCR texts in one nlp.pipe pass"""
+    from app.nlp import extract_invoice_data_batch
+    from app.categorization import categorize_expense
+    from app.vendors import canonical_vendor
+
+    start = time.perf_counter()
+    results = extract_invoice_data_batch(texts, confidences=confidences)
+    nlp_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for invoice_data in results:
+        invoice_data['vendor'] = canonical_vendor(invoice_data['vendor'])
+        invoice_data['category'] = categorize_expense(invoice_data)
+    categorization_time = time.perf_counter() - start
+
+    timings = {'nlp': nlp_time, 'categorization': categorization_time, 'batch_size': len(texts)}
+    return {"data": results, "timings": timings}
+
+
+class ExtractionEngine:
+    """Bounded executor that runs the extraction pipeline away from the event loop"""
+
+    def __init__(self, kind=EXTRACTION_EXECUTOR, workers=EXTRACTION_WORKERS,
+                 max_pending=EXTRACTION_MAX_PENDING):
+        if kind not in ('process', 'thread'):
+            raise ValueError(f"Unknown extraction executor: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Number of submitted jobs that have not finished yet"""
+        return self._pending
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            if self.kind == 'process':
+                context = multiprocessing.get_context(EXTRACTION_START_METHOD)
+                # One core budget for all the processes, so PDF pages only spread over idle cores
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=warm_worker,
+                    initargs=(context.BoundedSemaphore(OCR_CORES),),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="extract",
+                    initializer=warm_worker,
+                )
+
+    def warm_up(self):
+        """Start all workers in the background; returns futures that finish once they are warm.
+
+        Executors only create workers as tasks arrive, so without this the first uploads
+        would wait for model loading.
+        """
+        self.start()
+        return [self._executor.submit(_ready) for _ in range(self.workers)]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def submit(self, fn, *args):
+        """Submit work, raising EngineBusy instead of queueing without bound"""
+        self.start()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise EngineBusy(f"Extraction queue is full ({self._pending} jobs pending)")
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args):
+        """Run work on the engine and await its result without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the shared extraction engine for this process"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ExtractionEngine()
+        return _engine
+
+
+def shutdown_engine():
+    global _engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+    if engine is not None:
+        engine.shutdown()
+
+
+class ExtractionBatcher:
+    """Groups OCR texts from concurrent jobs into one batched NER call on the engine.
+
+    Batches go through the scheduler's bulk lane, ahead of the files waiting there, so they
+    never take the workers kept for interactive uploads and count towards its wait estimates.
+    """
+
+    def __init__(self, scheduler, max_batch=NLP_BATCH_SIZE, max_wait=NLP_BATCH_WAIT):
+        self.scheduler = scheduler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._waiting = []
+        self._flusher = None
+        self._running = set()
+
+    @property
+    def waiting(self):
+        """Number of texts gathered for the next batch"""
+        return len(self._waiting)
+
+    async def extract(self, text, confidence=None):
+        """Return (invoice_data, timings) for one text, sharing an nlp.pipe batch with its peers.
+
+        confidence is the text's per-character OCR confidence, if known (see run_ocr).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((text, confidence, future))
+        if len(self._waiting) >= self.max_batch:
+            self._flush_now()
+        elif self._flusher is None:
+            self._flusher = asyncio.get_running_loop().call_later(self.max_wait, self._flush_now)
+        return await future
+
+    def _flush_now(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        batch, self._waiting = self._waiting, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        from app.scheduler import BULK
+
+        texts = [text for text, _, _ in batch]
+        confidences = [confidence for _, confidence, _ in batch]
+        estimate = self.scheduler.cost_model.estimate_units(run_extraction_batch, 'text', len(texts))
+        try:
+            while True:
+                try:
+                    result = await self.scheduler.run(run_extraction_batch, texts, confidences,
+                                                      estimate=estimate, lane=BULK, ahead=True)
+                    break
+                except EngineBusy:
+                    await asyncio.sleep(self.max_wait or 0.05)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        # Observed once per batch: the time is shared by every text in it
+        NLP_BATCHES.observe(len(texts))
+        STAGE_SECONDS.observe(result['timings']['nlp'], stage='nlp')
+        STAGE_SECONDS.observe(result['timings']['categorization'], stage='categorization')
+        for (_, _, future), invoice_data in zip(batch, result['data']):
+            if not future.done():
+                future.set_result((invoice_data, result['timings']))
@@ -0,0 +1,89 @@
+# benchmarks/bench_categorization.py
+"""Categorization cost as the rule set grows: linear keyword scans vs the single-pass matcher.
+
+Usage: python benchmarks/bench_categorization.py [--vendors 20000] [--rules 4,100,1000,10000]
+
+Also reports how many OCR-style misspellings of a vendor end up under its canonical name
+and category.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.vendors import KeywordMatcher, VendorRegistry
+from benchmarks.bench_search import misspell, vendor_names
+
+
+def linear_category(vendor, rules):
+    """The original approach: one any(keyword in vendor) scan per category, in order"""
+    vendor = vendor.lower()
+    for category, keywords in rules:
+        if any(keyword in vendor for keyword in keywords):
+            return category
+    return "Misc"
+
+
+def synthetic_rules(count, rng):
+    """count keywords spread over categories of 25; the real four categories come first"""
+    rules = [("Food", ["restaurant", "cafe", "food", "grocer", "supermarket", "bakery"]),
+             ("Travel", ["hotel", "flight", "airline", "taxi", "uber", "lyft", "transport"])]
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    while sum(len(keywords) for _, keywords in rules) < count:
+        keywords = ["".join(rng.choice(letters) for _ in range(rng.randint(5, 9))) for _ in range(25)]
+        rules.append((f"Category {len(rules)}", keywords))
+    return rules
+
+
+def measure(func, vendors):
+    start = time.perf_counter()
+    for vendor in vendors:
+        func(vendor)
+    return (time.perf_counter() - start) / len(vendors) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vendors", type=int, default=20000)
+    parser.add_argument("--rules", default="4,100,1000,10000")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vendors = [f"{name} {rng.choice(['Cafe', 'Hotel', 'Store', 'Taxi', ''])}".strip()
+               for name in vendor_names(args.vendors, rng)]
+
+    print(f"{'keywords':>9} {'linear us/vendor':>17} {'matcher us/vendor':>18}")
+    for count in (int(value) for value in args.rules.split(",")):
+        rules = synthetic_rules(count, rng)
+        matcher = KeywordMatcher((keyword, priority) for priority, (_, keywords) in enumerate(rules)
+                                 for keyword in keywords)
+        names = [category for category, _ in rules]
+
+        def single_pass(vendor):
+            priority = matcher.best(vendor.lower())
+            return names[priority] if priority is not None else "Misc"
+
+        assert all(single_pass(vendor) == linear_category(vendor, rules) for vendor in vendors[:2000])
+        print(f"{sum(len(k) for _, k in rules):>9} {measure(lambda v: linear_category(v, rules), vendors):>17.2f} "
+              f"{measure(single_pass, vendors):>18.2f}")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        registry = VendorRegistry(db_path=os.path.join(scratch, "vendors.db"))
+        sample = vendors[:1000]
+        canonical = {vendor: registry.canonical(vendor) for vendor in sample}
+        variants = [(vendor, misspell(vendor, rng)) for vendor in sample]
+        start = time.perf_counter()
+        same_name = sum(registry.canonical(variant) == canonical[vendor] for vendor, variant in variants)
+        same_category = sum(registry.category(variant) == registry.category(vendor)
+                            for vendor, variant in variants)
+        elapsed = (time.perf_counter() - start) / len(variants) * 1e6
+        print(f"\nmisspelt vendors: canonical name kept {same_name}/{len(variants)}, "
+              f"category kept {same_category}/{len(variants)}  ({elapsed:.0f} us each, learning included)")
+
+
+if __name__ == "__main__":
+    main()
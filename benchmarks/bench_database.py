@@ -0,0 +1,70 @@
+# benchmarks/bench_database.py
+"""Latency percentiles for invoice lookups through the configured storage backend.
+
+Usage: DB_BACKEND=sqlite python benchmarks/bench_database.py [--rows 1000] [--lookups 2000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import get_invoice_by_id, init_database, save_invoice_data
+from app.db_backends import get_storage
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        'p50': pick(0.50) * 1000,
+        'p95': pick(0.95) * 1000,
+        'p99': pick(0.99) * 1000,
+        'mean': statistics.fmean(ordered) * 1000,
+    }
+
+
+def seed(rows):
+    ids = []
+    for i in range(rows):
+        ids.append(save_invoice_data({
+            'vendor': f"Vendor {i % 50}",
+            'date': f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+            'amount': round(random.uniform(1, 500), 2),
+            'tax': 0,
+            'category': "Misc",
+            'invoice_number': f"INV-{i:06d}",
+            'raw_text': "lorem ipsum " * 200,
+        }, f"bench_{i}.jpg"))
+    return [i for i in ids if i is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    storage = get_storage()
+    init_database()
+    ids = seed(args.rows)
+    if not ids:
+        print("Could not seed the database; check the connection settings")
+        return
+
+    samples = []
+    for _ in range(args.lookups):
+        start = time.perf_counter()
+        get_invoice_by_id(random.choice(ids))
+        samples.append(time.perf_counter() - start)
+
+    stats = percentiles(samples)
+    print(f"backend={storage.name} pool_size={storage.pool_size} lookups={args.lookups}")
+    print("  ".join(f"{name}={value:.3f}ms" for name, value in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/bench_export.py
+"""Streaming export against paging through /invoices/: rows per second and peak memory.
+
+Usage: DB_BACKEND=sqlite SQLITE_DB_PATH=/tmp/export.db python benchmarks/bench_export.py [--rows 100000]
+       [--formats csv,ndjson,parquet] [--page-size 50]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import init_database, list_invoices, save_invoices_batch
+from app.db_backends import get_storage
+from app.export import export_invoices
+
+
+def seed(rows, batch=5000):
+    """Top the table up to rows invoices"""
+    with get_storage().session() as db:
+        present = db.query_one("SELECT COUNT(*) AS n FROM invoices")['n']
+    for start in range(present, rows, batch):
+        save_invoices_batch([({
+            'vendor': f"Vendor {i % 500}",
+            'date': f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+            'amount': round(random.uniform(1, 500), 2),
+            'tax': round(random.uniform(0, 40), 2),
+            'category': "Misc",
+            'invoice_number': f"INV-{i:07d}",
+            'raw_text': None,
+        }, f"bench_{i}.jpg") for i in range(start, min(rows, start + batch))])
+
+
+def measure(label, run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows, size = run()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22} rows={rows:>8}  {seconds:7.2f}s  {rows / seconds:>10.0f} rows/s  "
+          f"{size / 1e6:8.1f}MB out  peak={peak / 1e6:.1f}MB")
+
+
+def export_run(fmt):
+    def run():
+        size = sum(len(chunk) for chunk in export_invoices(fmt))
+        with get_storage().session() as db:
+            return db.query_one("SELECT COUNT(*) AS n FROM invoices")['n'], size
+    return run
+
+
+def paging_run(page_size):
+    def run():
+        rows = size = 0
+        cursor = None
+        while True:
+            page = list_invoices(limit=page_size, cursor=cursor)
+            rows += len(page['items'])
+            size += sum(len(str(item)) for item in page['items'])
+            cursor = page['next_cursor']
+            if not cursor:
+                return rows, size
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--formats", default="csv,ndjson,parquet")
+    parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args()
+
+    init_database()
+    seed(args.rows)
+    print(f"backend={get_storage().name}")
+    for fmt in args.formats.split(","):
+        try:
+            measure(f"export {fmt}", export_run(fmt))
+        except ValueError as e:
+            print(f"export {fmt:<15} skipped: {e}")
+    measure(f"paging limit={args.page_size}", paging_run(args.page_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# benchmarks/bench_extraction.py
+"""Measure extraction throughput on data/uploads as the worker count grows.
+
+Usage: python benchmarks/bench_extraction.py [--rounds 4] [--workers 1,2,4]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import wait
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import EXTRACTION_WORKERS
+from app.workers import ExtractionEngine, run_pipeline
+
+
+def sample_files(directory="data/uploads"):
+    patterns = ("*.jpg", "*.jpeg", "*.png", "*.pdf")
+    files = []
+    for pattern in patterns:
+        files.extend(glob.glob(os.path.join(directory, pattern)))
+    return sorted(files)
+
+
+def measure(files, workers, kind):
+    engine = ExtractionEngine(kind=kind, workers=workers, max_pending=len(files))
+    engine.start()
+    try:
+        # Warm every worker before timing
+        wait([engine.submit(run_pipeline, files[0]) for _ in range(workers)])
+
+        start = time.perf_counter()
+        futures = [engine.submit(run_pipeline, path) for path in files]
+        wait(futures)
+        elapsed = time.perf_counter() - start
+    finally:
+        engine.shutdown()
+
+    failed = sum(1 for f in futures if f.exception() is not None)
+    return elapsed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default="data/uploads")
+    parser.add_argument("--rounds", type=int, default=4, help="times each sample file is repeated")
+    parser.add_argument("--workers", default=None, help="comma separated worker counts")
+    parser.add_argument("--executor", default="process", choices=("process", "thread"))
+    args = parser.parse_args()
+
+    files = sample_files(args.dir) * args.rounds
+    if not files:
+        print(f"No sample files found in {args.dir}")
+        return
+
+    if args.workers:
+        counts = [int(n) for n in args.workers.split(",")]
+    else:
+        counts = sorted({1, 2, 4, EXTRACTION_WORKERS} & set(range(1, EXTRACTION_WORKERS + 1)))
+
+    baseline = None
+    print(f"{'workers':>8} {'seconds':>9} {'receipts/s':>11} {'speedup':>8} {'failed':>7}")
+    for workers in counts:
+        elapsed, failed = measure(files, workers, args.executor)
+        rate = len(files) / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>8} {elapsed:>9.2f} {rate:>11.2f} {rate / baseline:>7.2f}x {failed:>7}")
+
+
+if __name__ == "__main__":
+    main()
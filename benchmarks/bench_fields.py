@@ -0,0 +1,109 @@
+# benchmarks/bench_fields.py
+"""Regex field extraction throughput: the original per-call patterns vs the compiled extractor.
+
+Usage: python benchmarks/bench_fields.py [--corpus DIR_OF_TXT_FILES] [--docs 3000] [--rounds 5]
+
+Without --corpus a synthetic set of receipt texts is used. Saved OCR output (one .txt file
+per receipt) gives more realistic numbers.
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.nlp import _regex_invoice_data
+from benchmarks.bench_nlp import synthetic_receipts
+
+
+def legacy_fields(text):
+    """The extraction as originally written, kept here as the reference point"""
+    date = None
+    for pattern in [r'\d{1,2}[-/]\d{1,2}[-/]\d{2,4}',
+                    r'\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{2,4}',
+                    r'(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},?\s+\d{2,4}']:
+        matches = re.findall(pattern, text, re.IGNORECASE)
+        if matches:
+            try:
+                date = datetime.strptime(matches[0], "%m/%d/%Y").date().isoformat()
+                break
+            except ValueError:
+                try:
+                    date = datetime.strptime(matches[0], "%d-%m-%Y").date().isoformat()
+                    break
+                except ValueError:
+                    continue
+
+    amounts = []
+    for amt in re.findall(r'\$?\s*\d{1,3}(?:,\d{3})*(?:\.\d{2})?|\d+(?:\.\d{2})?', text):
+        amounts.append(float(amt.replace('$', '').replace(',', '').strip()))
+    amounts.sort(reverse=True)
+
+    vendor = "Unknown Vendor"
+    for line in text.split('\n'):
+        line = line.strip()
+        if line and not any(char.isdigit() for char in line) and len(line) > 3:
+            vendor = line
+            break
+
+    inv_match = re.search(r'(?:invoice|inv)\.?\s*#?\s*[:]?\s*([A-Z0-9-]+)', text, re.IGNORECASE)
+    return {
+        "vendor": vendor,
+        "date": date,
+        "amount": amounts[0] if amounts else None,
+        "invoice_number": inv_match.group(1) if inv_match else None,
+    }
+
+
+def load_corpus(directory, docs):
+    if directory:
+        texts = []
+        for path in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                texts.append(f.read())
+        return texts
+    return synthetic_receipts(docs)
+
+
+def measure(func, texts, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(texts) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="directory of OCR text files")
+    parser.add_argument("--docs", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpus, args.docs)
+    if not texts:
+        print("No texts found")
+        return
+
+    legacy = measure(legacy_fields, texts, args.rounds)
+    compiled = measure(_regex_invoice_data, texts, args.rounds)
+    print(f"texts={len(texts)} avg_chars={sum(map(len, texts)) // len(texts)}")
+    print(f"original  {legacy:10.0f} docs/s")
+    print(f"compiled  {compiled:10.0f} docs/s  ({compiled / legacy:.2f}x)")
+
+    changed = sum(1 for text in texts
+                  if {k: v for k, v in _regex_invoice_data(text).items()
+                      if k in ("vendor", "amount", "invoice_number")}
+                  != {k: v for k, v in legacy_fields(text).items() if k != "date"})
+    print(f"texts with a different vendor/amount/invoice number: {changed}")
+
+
+if __name__ == "__main__":
+    main()
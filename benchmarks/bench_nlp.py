@@ -0,0 +1,76 @@
+# benchmarks/bench_nlp.py
+"""Compare entity extraction throughput: full pipeline per doc, trimmed nlp.pipe batches, regex only.
+
+Usage: python benchmarks/bench_nlp.py [--docs 500] [--batch-size 64]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SPACY_MODEL
+from app import nlp as nlp_module
+
+VENDORS = ["Walmart Supercenter", "Shell Station 42", "Starbucks Coffee", "Office Depot",
+           "Uber Technologies", "Marriott Hotel", "Local Diner", "Hardware Store"]
+
+
+def synthetic_receipts(count, seed=0):
+    """OCR-like receipt texts, a few hundred characters each"""
+    rng = random.Random(seed)
+    texts = []
+    for i in range(count):
+        lines = [rng.choice(VENDORS), f"{rng.randint(1, 999)} Main Street", ""]
+        lines.append(f"Date: {rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2024")
+        lines.append(f"Invoice #: INV-{i:06d}")
+        for _ in range(rng.randint(3, 12)):
+            lines.append(f"Item {rng.randint(1, 500)}  ${rng.uniform(1, 80):.2f}")
+        lines.append(f"Tax: ${rng.uniform(0, 20):.2f}")
+        lines.append(f"Total: ${rng.uniform(20, 500):.2f}")
+        texts.append("\n".join(lines))
+    return texts
+
+
+def measure(label, func, texts):
+    start = time.perf_counter()
+    func(texts)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(texts) / elapsed:10.1f} docs/s  ({elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    texts = synthetic_receipts(args.docs)
+    measure("regex only", lambda docs: [nlp_module._regex_invoice_data(t) for t in docs], texts)
+
+    try:
+        import spacy
+        full = spacy.load(SPACY_MODEL)
+    except (ImportError, OSError):
+        print(f"spaCy model {SPACY_MODEL} not available; skipping NER runs")
+        return
+
+    trimmed = nlp_module.get_nlp()
+    print(f"full pipeline: {full.pipe_names}")
+    print(f"trimmed pipeline: {trimmed.pipe_names}")
+    # Warm both pipelines so model loading isn't timed
+    full("warm up")
+    trimmed("warm up")
+
+    measure("full pipeline, per doc", lambda docs: [full(t) for t in docs], texts)
+    measure("trimmed, per doc", lambda docs: [trimmed(t) for t in docs], texts)
+    measure(f"trimmed, nlp.pipe({args.batch_size})",
+            lambda docs: list(trimmed.pipe(docs, batch_size=args.batch_size)), texts)
+    measure("extract_invoice_data_batch",
+            lambda docs: nlp_module.extract_invoice_data_batch(docs, batch_size=args.batch_size), texts)
+
+
+if __name__ == "__main__":
+    main()
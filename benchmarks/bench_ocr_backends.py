@@ -0,0 +1,72 @@
+# benchmarks/bench_ocr_backends.py
+"""Compare per-page OCR cost of the old pytesseract path with the OCR backends.
+
+Usage: python benchmarks/bench_ocr_backends.py [--pages 20]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.ocr_backends import CliBackend, TesserocrBackend
+
+
+def receipt_page(lines=30):
+    """Render a plain receipt-like page so every backend sees the same pixels"""
+    page = np.full((lines * 40 + 40, 900), 255, dtype=np.uint8)
+    for i in range(lines):
+        text = f"ITEM {i:03d} SAMPLE PRODUCT DESCRIPTION   {i * 1.25:8.2f}"
+        cv2.putText(page, text, (20, 40 + i * 40), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+    return page
+
+
+def legacy_image_to_string(image):
+    """What every page used to cost: a version probe plus pytesseract's temp files"""
+    import pytesseract
+
+    subprocess.run(['tesseract', '--version'], capture_output=True, text=True, timeout=5)
+    return pytesseract.image_to_string(image)
+
+
+def measure(name, fn, page, pages):
+    fn(page)  # warm up (loads traineddata for in-process backends)
+    start = time.perf_counter()
+    for _ in range(pages):
+        fn(page)
+    per_page = (time.perf_counter() - start) / pages
+    print(f"{name:<24} {per_page * 1000:>10.1f} ms/page")
+    return per_page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=20)
+    args = parser.parse_args()
+
+    page = receipt_page()
+    results = {}
+    results['legacy (pytesseract)'] = measure("legacy (pytesseract)", legacy_image_to_string, page, args.pages)
+
+    cli = CliBackend()
+    results['cli'] = measure("cli (stdin/stdout)", cli.image_to_string, page, args.pages)
+
+    try:
+        tess = TesserocrBackend()
+    except ImportError:
+        print("tesserocr not installed; skipping the in-process backend")
+    else:
+        results['tesserocr'] = measure("tesserocr (in-process)", tess.image_to_string, page, args.pages)
+
+    legacy = results['legacy (pytesseract)']
+    for name, per_page in results.items():
+        print(f"{name:<24} saves {(legacy - per_page) * 1000:>8.1f} ms/page vs legacy")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# benchmarks/bench_pdf.py
+"""PDF extraction: embedded text layer vs rasterize-and-OCR, per page.
+
+Usage: python benchmarks/bench_pdf.py [--dir data/uploads] [--pages 3]
+
+PDFs found in --dir are measured. Otherwise a born-digital invoice is generated, and
+the fields extracted by each method are checked against the values printed on it.
+Needs poppler (pdftotext, pdftoppm); the OCR run also needs Tesseract.
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.nlp import _regex_invoice_data
+from app.ocr import extract_text_from_pdf
+from app.ocr_backends import OCRBackendUnavailable
+
+EXPECTED = {'vendor': "Northwind Office Supply", 'date': "2024-03-15",
+            'invoice_number': "NW-20240315", 'amount': 1336.41}
+
+
+def _escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_text_pdf(path, pages):
+    """Minimal PDF with one Helvetica text stream per page (a list of lines each)"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        body = "BT /F1 11 Tf 14 TL 56 780 Td " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        stream = body.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def sample_invoice(page_count):
+    first = [EXPECTED['vendor'], "12 Harbour Road", "",
+             f"Invoice #: {EXPECTED['invoice_number']}", "Date: 03/15/2024", ""]
+    first += [f"Item {i:02d}   Copier paper, box of 5        $ {40 + i:.2f}" for i in range(20)]
+    last = ["Subtotal   $1,234.56", "Sales Tax 8.25%   $101.85", "Total   $1,336.41"]
+    middle = [f"Item {i:02d}   Toner cartridge               $ {60 + i:.2f}" for i in range(20, 40)]
+    return [first] + [middle] * max(0, page_count - 2) + [last]
+
+
+def measure(path, use_text_layer):
+    pages = []
+    start = time.perf_counter()
+    text = extract_text_from_pdf(path, None, pages=pages, use_text_layer=use_text_layer)
+    return text, pages, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default="data/uploads")
+    parser.add_argument("--pages", type=int, default=3)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.dir, "*.pdf")))
+    generated = not files
+    if generated:
+        path = os.path.join(tempfile.mkdtemp(), "digital_invoice.pdf")
+        write_text_pdf(path, sample_invoice(args.pages))
+        files = [path]
+
+    for path in files:
+        print(os.path.basename(path))
+        for label, use_text_layer in (("text layer", True), ("ocr only", False)):
+            try:
+                text, pages, elapsed = measure(path, use_text_layer)
+            except OCRBackendUnavailable as e:
+                print(f"  {label:<10} skipped: {e}")
+                continue
+            methods = ",".join(page['method'] for page in pages)
+            print(f"  {label:<10} {elapsed * 1000:9.1f}ms  pages={methods}")
+            if generated:
+                fields = _regex_invoice_data(text)
+                correct = [name for name, value in EXPECTED.items() if fields[name] == value]
+                print(f"  {'':<10} fields correct {len(correct)}/{len(EXPECTED)}: {', '.join(correct)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# benchmarks/bench_preprocess.py
+"""Accuracy vs latency of basic (full resolution) and adaptive preprocessing on sample images.
+
+Usage: python benchmarks/bench_preprocess.py [--dir data/uploads] [--rounds 3]
+
+When an image has a sidecar transcript (receipt.jpg -> receipt.txt) OCR accuracy is
+measured against it; otherwise the adaptive output is compared with the basic one.
+Without Tesseract only preprocessing time and pixel counts are reported.
+"""
+import argparse
+import difflib
+import glob
+import os
+import statistics
+import sys
+import time
+
+import cv2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.nlp import _regex_invoice_data
+from app.ocr_backends import OCRBackendUnavailable, get_ocr_backend
+from app.preprocess import adaptive_preprocess, analyze, basic_preprocess, to_gray
+
+
+def sample_images(directory):
+    files = []
+    for pattern in ("*.jpg", "*.jpeg", "*.png"):
+        files.extend(glob.glob(os.path.join(directory, pattern)))
+    return sorted(files)
+
+
+def similarity(a, b):
+    # Whitespace layout differs between runs far more than the characters do
+    return difflib.SequenceMatcher(None, " ".join(a.split()), " ".join(b.split())).ratio()
+
+
+def run_mode(preprocess, image, backend, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        processed = preprocess(image)
+        samples.append(time.perf_counter() - start)
+    result = {'preprocess': statistics.median(samples), 'pixels': processed.size}
+    if backend is not None:
+        start = time.perf_counter()
+        result['text'] = backend.image_to_string(processed)
+        result['ocr'] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default="data/uploads")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    files = sample_images(args.dir)
+    if not files:
+        print(f"No sample images in {args.dir}")
+        return
+    try:
+        backend = get_ocr_backend()
+    except OCRBackendUnavailable:
+        backend = None
+        print("Tesseract not available: reporting preprocessing only\n")
+
+    totals = {'basic': [], 'adaptive': []}
+    for path in files:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        plan = analyze(to_gray(image))
+        stages = {}
+        adaptive_preprocess(image, stages)
+        basic = run_mode(basic_preprocess, image, backend, args.rounds)
+        adaptive = run_mode(adaptive_preprocess, image, backend, args.rounds)
+        totals['basic'].append(basic)
+        totals['adaptive'].append(adaptive)
+
+        print(f"{os.path.basename(path)}  {image.shape[1]}x{image.shape[0]}  kind={plan['kind']} "
+              f"angle={plan['angle']:.1f} scale={plan['scale']:.2f}")
+        print("  stages: " + "  ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in stages.items()))
+        for name, result in (('basic', basic), ('adaptive', adaptive)):
+            line = f"  {name:<9} preprocess={result['preprocess'] * 1000:7.1f}ms  pixels={result['pixels']:>9}"
+            if backend is not None:
+                line += f"  ocr={result['ocr'] * 1000:7.1f}ms"
+            print(line)
+
+        if backend is not None:
+            transcript_path = os.path.splitext(path)[0] + ".txt"
+            if os.path.exists(transcript_path):
+                with open(transcript_path, encoding="utf-8") as f:
+                    truth = f.read()
+                print(f"  accuracy  basic={similarity(basic['text'], truth):.3f}  "
+                      f"adaptive={similarity(adaptive['text'], truth):.3f}")
+            else:
+                fields = ('vendor', 'date', 'amount', 'invoice_number')
+                before, after = _regex_invoice_data(basic['text']), _regex_invoice_data(adaptive['text'])
+                same = [field for field in fields if before[field] == after[field]]
+                print(f"  text similarity to basic={similarity(basic['text'], adaptive['text']):.3f}  "
+                      f"fields unchanged={len(same)}/{len(fields)}")
+
+    print("\ntotal")
+    for name, results in totals.items():
+        line = (f"  {name:<9} preprocess={sum(r['preprocess'] for r in results) * 1000:8.1f}ms  "
+                f"pixels={sum(r['pixels'] for r in results):>10}")
+        if backend is not None:
+            line += f"  ocr={sum(r['ocr'] for r in results) * 1000:8.1f}ms"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
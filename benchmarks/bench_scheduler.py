@@ -0,0 +1,86 @@
+# benchmarks/bench_scheduler.py
+"""Interactive upload latency during a bulk backfill: first-come-first-served vs the scheduler.
+
+Files are simulated by sleeping on the extraction engine's threads, so only the queueing
+is measured: small interactive files arrive at a steady rate while bulk tasks keep the
+engine saturated with large ones, and the interactive p50/p95 are compared with what an
+idle engine gives.
+
+Usage: python benchmarks/bench_scheduler.py [--workers 4] [--seconds 8] [--small 0.05] [--large 1.5]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.scheduler import BULK, INTERACTIVE, Scheduler
+from app.workers import ExtractionEngine
+
+
+def busy(seconds):
+    time.sleep(seconds)
+
+
+def _estimate(unit, seconds):
+    return {'work': busy.__name__, 'unit': unit, 'units': 1, 'seconds': seconds}
+
+
+async def scenario(policy, args, backfill=True):
+    engine = ExtractionEngine(kind='thread', workers=args.workers, max_pending=10_000)
+    await asyncio.gather(*(asyncio.wrap_future(future) for future in engine.warm_up()))
+    scheduler = Scheduler(engine)
+
+    async def run(lane, seconds):
+        if policy == "fifo":
+            await engine.run(busy, seconds)
+        else:
+            unit = 'megapixel' if lane == INTERACTIVE else 'page'
+            await scheduler.run(busy, seconds, estimate=_estimate(unit, seconds), lane=lane, client=lane)
+
+    stop = time.monotonic() + args.seconds
+
+    async def bulk_feeder():
+        while time.monotonic() < stop:
+            await run(BULK, args.large)
+
+    latencies = []
+
+    async def upload():
+        start = time.monotonic()
+        await run(INTERACTIVE, args.small)
+        latencies.append(time.monotonic() - start)
+
+    # Like a bulk upload, which keeps twice the workers' worth of files in flight
+    feeders = [asyncio.create_task(bulk_feeder()) for _ in range(args.workers * 2 if backfill else 0)]
+    uploads = []
+    while time.monotonic() < stop:
+        uploads.append(asyncio.create_task(upload()))
+        await asyncio.sleep(args.interval)
+    await asyncio.gather(*uploads, *feeders)
+    engine.shutdown()
+    ordered = sorted(latencies)
+    return statistics.median(ordered), ordered[int(0.95 * (len(ordered) - 1))], len(ordered)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=8.0)
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between interactive uploads")
+    parser.add_argument("--small", type=float, default=0.05, help="seconds per interactive file")
+    parser.add_argument("--large", type=float, default=1.5, help="seconds per bulk file")
+    args = parser.parse_args()
+
+    for label, policy, backfill in (("idle engine", "scheduled", False),
+                                    ("backfill, first come first served", "fifo", True),
+                                    ("backfill, scheduler", "scheduled", True)):
+        p50, p95, count = asyncio.run(scenario(policy, args, backfill))
+        print(f"{label:<36} uploads={count:<4} p50={p50 * 1000:8.1f}ms  p95={p95 * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/bench_search.py
+"""Latency of /invoices/search queries (words, prefixes, invoice numbers, misspelt vendors).
+
+Usage: DB_BACKEND=sqlite SQLITE_DB_PATH=data/bench_search.db python benchmarks/bench_search.py [--rows 200000]
+
+Seeds --rows synthetic invoices on the first run (the database is reused afterwards), then
+times each query kind. Point SQLITE_DB_PATH at a scratch file: the rows are not removed.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import init_database, save_invoices_batch
+from app.db_backends import get_storage
+from app.search import search_invoices
+from benchmarks.bench_database import percentiles
+
+SYLLABLES = ["al", "be", "cor", "dan", "el", "fir", "gal", "hol", "in", "jor", "kel", "lum",
+             "mar", "nor", "ost", "pel", "quin", "ros", "sal", "tor", "ul", "ver", "wel", "zan"]
+KINDS = ["Market", "Hardware", "Pharmacy", "Cafe", "Office Supply", "Fuel", "Books", "Electronics"]
+WORDS = ["milk", "bread", "coffee", "paper", "toner", "cable", "diesel", "battery", "notebook",
+         "sandwich", "printer", "stapler", "charger", "monitor", "keyboard", "aspirin"]
+
+
+def vendor_names(count, rng):
+    names = set()
+    while len(names) < count:
+        stem = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+        names.add(f"{stem} {rng.choice(KINDS)}")
+    return sorted(names)
+
+
+def misspell(name, rng):
+    """One OCR-style substitution, e.g. l -> 1 or o -> 0"""
+    swaps = {'l': '1', 'o': '0', 'e': 'c', 'a': 'o', 'r': 'n', 'i': 'l', 's': '5'}
+    positions = [i for i, char in enumerate(name) if char in swaps]
+    if not positions:
+        return name
+    i = rng.choice(positions)
+    return name[:i] + swaps[name[i]] + name[i + 1:]
+
+
+def seed(rows, vendors, rng, batch=5000):
+    for start in range(0, rows, batch):
+        items = []
+        for i in range(start, min(rows, start + batch)):
+            vendor = rng.choice(vendors)
+            lines = [vendor, f"Invoice #: INV-{i:07d}"]
+            lines += [f"{rng.choice(WORDS)} x{rng.randint(1, 5)}  ${rng.uniform(1, 80):.2f}"
+                      for _ in range(rng.randint(3, 10))]
+            items.append(({'vendor': vendor, 'date': f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+                           'amount': round(rng.uniform(5, 500), 2), 'tax': 0, 'category': "Misc",
+                           'invoice_number': f"INV-{i:07d}", 'raw_text': "\n".join(lines)},
+                          f"bench_{i}.jpg"))
+        save_invoices_batch(items)
+
+
+def time_queries(label, queries, rounds=1):
+    samples, hits = [], 0
+    for _ in range(rounds):
+        for kwargs in queries:
+            start = time.perf_counter()
+            result = search_invoices(**kwargs)
+            samples.append(time.perf_counter() - start)
+            hits += bool(result['items'])
+    stats = percentiles(samples)
+    print(f"{label:<18} " + "  ".join(f"{name}={value:7.2f}ms" for name, value in stats.items())
+          + f"  with_hits={hits}/{len(samples)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--vendors", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vendors = vendor_names(args.vendors, rng)
+    init_database()
+    with get_storage().session() as db:
+        existing = db.query_one("SELECT COUNT(*) AS n FROM invoices")['n']
+    if existing < args.rows:
+        start = time.perf_counter()
+        seed(args.rows - existing, vendors, rng)
+        print(f"seeded {args.rows - existing} invoices in {time.perf_counter() - start:.1f}s")
+    print(f"backend={get_storage().name} invoices={max(existing, args.rows)} vendors={len(vendors)}")
+
+    n = args.queries
+    # The first vendor lookup builds the trigram index; keep it out of the timings
+    search_invoices(vendor=vendors[0])
+    time_queries("word", [{'q': rng.choice(WORDS)} for _ in range(n)])
+    time_queries("prefix", [{'q': rng.choice(WORDS)[:3]} for _ in range(n)])
+    time_queries("invoice number", [{'q': f"INV-{rng.randrange(args.rows):07d}"} for _ in range(n)])
+    time_queries("vendor typo", [{'vendor': misspell(rng.choice(vendors), rng)} for _ in range(n)])
+    time_queries("words + filters", [{'q': f"{rng.choice(WORDS)} {rng.choice(WORDS)}",
+                                      'vendor': rng.choice(vendors).split()[0],
+                                      'date_from': "2024-03-01", 'date_to': "2024-09-30"}
+                                     for _ in range(n)])
+
+    found = sum(any(item['vendor'] == name for item in search_invoices(vendor=misspell(name, rng))['vendors'])
+                for name in rng.sample(vendors, min(n, len(vendors))))
+    print(f"misspelt vendors resolved to the right name: {found}/{min(n, len(vendors))}")
+
+
+if __name__ == "__main__":
+    main()
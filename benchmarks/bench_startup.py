@@ -0,0 +1,87 @@
+# benchmarks/bench_startup.py
+"""Cold-start cost of the API: import time of app.main and time until the first request is served.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--port 8765] [--top 10]
+
+Every measurement runs in a fresh interpreter, so nothing is shared between runs.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(module):
+    """Seconds to import module in a new interpreter, measured inside that interpreter"""
+    code = ("import time; start = time.perf_counter(); "
+            f"import {module}; print(time.perf_counter() - start)")
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(module, top):
+    """(cumulative microseconds, module) for the slowest imports according to -X importtime"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            rows.append((int(match.group(1)), match.group(3)))
+    return sorted(rows, reverse=True)[:top]
+
+
+def time_first_request(port, timeout=60):
+    """Seconds from launching uvicorn until GET /invoices/ answers"""
+    url = f"http://127.0.0.1:{port}/invoices/?limit=1"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError("uvicorn exited during startup")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    response.read()
+                return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise RuntimeError(f"No response from {url} after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    imports = [time_import("app.main") for _ in range(args.runs)]
+    print(f"import app.main        median={statistics.median(imports) * 1000:8.1f}ms  "
+          f"max={max(imports) * 1000:8.1f}ms")
+
+    first = [time_first_request(args.port) for _ in range(args.runs)]
+    print(f"start to first request median={statistics.median(first) * 1000:8.1f}ms  "
+          f"max={max(first) * 1000:8.1f}ms")
+
+    print(f"\nslowest imports (cumulative):")
+    for micros, module in slowest_imports("app.main", args.top):
+        print(f"  {micros / 1000:8.1f}ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+# benchmarks/bench_suite.py
+"""End-to-end benchmark suite: per-stage latency, throughput, peak RSS and extraction accuracy.
+
+Usage: python benchmarks/bench_suite.py [--count 40] [--seed 0] [--rounds 3] [--workers 2] [--out FILE.json]
+                                        [--compare OLD.json] [--tolerance 0.1]
+
+A synthetic corpus with known ground truth (benchmarks/synthetic.py) is generated in a
+scratch directory and run through each stage, then the whole pipeline on the extraction
+engine. Invoices go to a scratch SQLite database, so the suite works offline and never
+touches data/. Stages whose tools are missing (Tesseract, poppler) are reported as skipped.
+
+Results are saved as JSON (by default data/benchmarks/<time>-<commit>.json). The same
+--seed and --count give the same corpus, so --compare against a run from another commit
+shows what changed; changes beyond --tolerance are flagged, and --fail-on-regression
+turns them into a non-zero exit status. Settings are compared the same way: a run with
+OCR_MODE=confidence and --compare against an OCR_MODE=text run shows what the two-pass OCR
+gains or loses in pipeline time and per-field accuracy.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import wait
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Everything the suite writes goes to a scratch directory; set before config is imported
+SCRATCH = tempfile.mkdtemp(prefix="bench_suite_")
+os.environ.update({
+    'DB_BACKEND': "sqlite",
+    'SQLITE_DB_PATH': os.path.join(SCRATCH, "invoices.db"),
+    'VENDOR_DB_PATH': os.path.join(SCRATCH, "vendors.db"),
+    'CACHE_DB_PATH': os.path.join(SCRATCH, "cache.db"),
+    'JOBS_DB_PATH': os.path.join(SCRATCH, "jobs.db"),
+})
+
+import cv2
+
+from app.categorization import categorize_expense
+from app.database import init_database, save_invoice_data, save_invoices_batch
+from app.nlp import extract_invoice_data, get_nlp
+from app.ocr import read_pdf_text_layer
+from app.ocr_backends import OCRBackendUnavailable, get_ocr_backend
+from app.preprocess import adaptive_preprocess
+from app.vendors import canonical_vendor, vendor_key
+from app.workers import ExtractionEngine, run_pipeline
+from benchmarks.bench_database import percentiles
+from benchmarks.synthetic import write_corpus
+from config import NLP_MODE, OCR_BACKEND, OCR_MODE, OCR_PREPROCESS, PDF_DPI, PDF_TEXT_LAYER, PDFTOTEXT_CMD
+
+FIELDS = ('vendor', 'date', 'invoice_number', 'amount', 'tax', 'category')
+# Metrics where a higher number is better; for latency and memory lower is better
+_HIGHER_IS_BETTER = ('per_second', 'pages_per_second')
+
+
+def _reset_peak_rss():
+    """Start a new high-water mark for this process's RSS (Linux 4.0+)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak RSS since the last reset (or since start where resets aren't supported)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_stage(results, name, items, func, rounds=1):
+    """Time func on every item (rounds times over) and record latency percentiles,
+    throughput and peak RSS. Returns the first round's outputs in order (None where it raised).
+    """
+    _reset_peak_rss()
+    samples, outputs, errors, first_error = [], [], 0, None
+    started = time.perf_counter()
+    for round_number in range(rounds):
+        for item in items:
+            start = time.perf_counter()
+            try:
+                output = func(item)
+            except Exception as e:
+                errors += 1
+                first_error = first_error or f"{type(e).__name__}: {e}"
+                output = None
+            else:
+                samples.append(time.perf_counter() - start)
+            if round_number == 0:
+                outputs.append(output)
+    elapsed = time.perf_counter() - started
+
+    if not samples:
+        results[name] = {'skipped': first_error or "no input"}
+        print(f"{name:<16} skipped: {results[name]['skipped']}")
+        return outputs
+    stats = {key: round(value, 3) for key, value in percentiles(samples).items()}
+    results[name] = {'count': len(samples), 'errors': errors, **stats,
+                     'per_second': round(len(samples) / elapsed, 2), 'peak_rss_mb': round(peak_rss_mb(), 1)}
+    if first_error:
+        results[name]['first_error'] = first_error
+    print(f"{name:<16} " + "  ".join(f"{key}={stats[key]:8.2f}ms" for key in ('p50', 'p95', 'p99'))
+          + f"  {results[name]['per_second']:9.1f}/s  rss={results[name]['peak_rss_mb']:.0f}MB"
+          + (f"  errors={errors}" if errors else ""))
+    return outputs
+
+
+def _same(field, got, expected):
+    if expected is None or got is None:
+        return got is None and expected is None
+    if field in ('amount', 'tax'):
+        try:
+            return abs(float(str(got).replace('$', '').replace(',', '')) - expected) < 0.005
+        except ValueError:
+            return False
+    if field == 'vendor':
+        return vendor_key(str(got)) == vendor_key(expected)
+    return str(got) == str(expected)
+
+
+def accuracy(documents, extracted):
+    """Share of documents with each field right, all fields right, and all right per noise level"""
+    scored = [(document, {field: _same(field, data.get(field), document['truth'][field]) for field in FIELDS})
+              for document, data in zip(documents, extracted) if data is not None]
+    if not scored:
+        return None
+    result = {'documents': len(scored),
+              'fields': {field: round(sum(marks[field] for _, marks in scored) / len(scored), 3)
+                         for field in FIELDS},
+              'all_fields': round(sum(all(marks.values()) for _, marks in scored) / len(scored), 3)}
+    by_noise = {}
+    for document, marks in scored:
+        by_noise.setdefault(f"{document['kind']}/{document['noise']}", []).append(all(marks.values()))
+    result['by_kind'] = {key: round(sum(values) / len(values), 3) for key, values in sorted(by_noise.items())}
+    return result
+
+
+def _print_accuracy(label, result):
+    if result is None:
+        print(f"{label:<16} no documents extracted")
+        return
+    fields = "  ".join(f"{field}={value:.0%}" for field, value in result['fields'].items())
+    print(f"{label:<16} all fields {result['all_fields']:.0%} of {result['documents']}  ({fields})")
+
+
+def _categorize(data):
+    data = dict(data, vendor=canonical_vendor(data['vendor']))
+    data['category'] = categorize_expense(data)
+    return data
+
+
+def measure_engine(paths, pages, workers, kind):
+    """Whole-pipeline throughput on the extraction engine, after warming every worker"""
+    engine = ExtractionEngine(kind=kind, workers=workers, max_pending=len(paths) + workers)
+    try:
+        wait(engine.warm_up())
+        _reset_peak_rss()
+        start = time.perf_counter()
+        futures = [engine.submit(run_pipeline, path) for path in paths]
+        wait(futures)
+        elapsed = time.perf_counter() - start
+    finally:
+        engine.shutdown()
+    failed = sum(1 for future in futures if future.exception() is not None)
+    # Process workers are children; their peak is reported once they have exited
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {'workers': workers, 'executor': kind, 'documents': len(paths), 'failed': failed,
+            'seconds': round(elapsed, 3), 'per_second': round(len(paths) / elapsed, 2),
+            'pages_per_second': round(pages / elapsed, 2), 'peak_rss_mb': round(peak_rss_mb(), 1),
+            'peak_worker_rss_mb': round(children, 1) if kind == 'process' else None}
+
+
+def _commit():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                               check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def _tools():
+    try:
+        get_ocr_backend()
+        tesseract = True
+    except OCRBackendUnavailable:
+        tesseract = False
+    return {'tesseract': tesseract, 'poppler': shutil.which("pdftoppm") is not None,
+            'pdftotext': shutil.which(PDFTOTEXT_CMD) is not None, 'spacy': get_nlp() is not None}
+
+
+def _changes(old, new, path=()):
+    """(metric path, old, new) for every number present in both results"""
+    for key, value in new.items():
+        if key not in old:
+            continue
+        if isinstance(value, dict) and isinstance(old[key], dict):
+            yield from _changes(old[key], value, path + (key,))
+        elif isinstance(value, (int, float)) and isinstance(old[key], (int, float)) and not isinstance(value, bool):
+            yield path + (key,), old[key], value
+
+
+def compare(old, new, tolerance):
+    """Print how latency, throughput and accuracy moved; returns the number of regressions"""
+    print(f"\ncompared with {old['meta']['commit']} ({old['meta']['created']}):")
+    corpus = ('count', 'seed', 'max_pages')
+    if any(old['meta']['args'].get(key) != new['meta']['args'].get(key) for key in corpus):
+        print("  note: the runs used different corpora (--count/--seed/--max-pages); accuracy is not comparable")
+    if old['meta']['tools'] != new['meta']['tools']:
+        print(f"  note: tools differ: {old['meta']['tools']} -> {new['meta']['tools']}")
+    if old['meta'].get('config') != new['meta'].get('config'):
+        print(f"  note: settings differ: {old['meta'].get('config')} -> {new['meta'].get('config')}")
+    regressions = 0
+    for section in ('stages', 'engine', 'accuracy'):
+        for path, before, after in _changes(old.get(section) or {}, new.get(section) or {}):
+            metric = path[-1]
+            if section == 'stages' and metric not in ('p50', 'p95', 'per_second', 'peak_rss_mb'):
+                continue
+            if section == 'engine' and metric not in ('per_second', 'pages_per_second', 'peak_rss_mb'):
+                continue
+            if before == after:
+                continue
+            if section == 'accuracy':
+                # The corpus is the same for the same seed, so any lost document counts
+                worse = metric != 'documents' and after < before
+            elif before:
+                change = (after - before) / before
+                worse = change < -tolerance if metric in _HIGHER_IS_BETTER else change > tolerance
+            else:
+                worse = False
+            regressions += worse
+            relative = f"{(after - before) / before:+.0%}" if before else "new"
+            print(f"  {'.'.join((section,) + path):<48} {before:>10} -> {after:<10} {relative:>6}"
+                  + ("  REGRESSION" if worse else ""))
+    print(f"{regressions} regression(s) beyond the tolerance")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=40, help="documents in the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-pages", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the corpus for the cheap stages")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--executor", default="process", choices=("process", "thread"))
+    parser.add_argument("--out", default=None, help="result file (default data/benchmarks/<time>-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="earlier result file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change flagged as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch corpus and databases")
+    args = parser.parse_args()
+
+    try:
+        corpus = os.path.join(SCRATCH, "corpus")
+        documents = write_corpus(corpus, args.count, args.seed, max_pages=args.max_pages)
+        paths = [os.path.join(corpus, document['file']) for document in documents]
+        transcripts = []
+        for path in paths:
+            with open(os.path.splitext(path)[0] + ".txt", encoding="utf-8") as f:
+                transcripts.append(f.read())
+        images = [path for path, document in zip(paths, documents) if document['kind'] == 'receipt']
+        digital = [path for path, document in zip(paths, documents) if document['kind'] == 'digital_pdf']
+        page_count = sum(document['pages'] for document in documents)
+        tools = _tools()
+        print(f"corpus: {len(documents)} documents, {page_count} pages in {SCRATCH}; "
+              f"tools: {', '.join(name for name, present in tools.items() if present) or 'none'}\n")
+
+        stages = {}
+        rounds = args.rounds
+        decoded = run_stage(stages, "decode", images, cv2.imread, rounds)
+        processed = run_stage(stages, "preprocess", [image for image in decoded if image is not None],
+                              adaptive_preprocess, rounds)
+        if tools['pdftotext']:
+            run_stage(stages, "text_layer", digital, read_pdf_text_layer, rounds)
+        else:
+            stages['text_layer'] = {'skipped': f"{PDFTOTEXT_CMD} not found"}
+        if tools['poppler']:
+            from pdf2image import convert_from_path
+
+            run_stage(stages, "rasterize", [path for path in paths if path.endswith(".pdf")],
+                      lambda path: convert_from_path(path, dpi=PDF_DPI, first_page=1, last_page=1, grayscale=True))
+        else:
+            stages['rasterize'] = {'skipped': "poppler not found"}
+        if tools['tesseract']:
+            backend = get_ocr_backend()
+            run_stage(stages, "tesseract", processed, backend.image_to_string)
+        else:
+            stages['tesseract'] = {'skipped': "Tesseract not installed"}
+
+        # Field extraction on the exact printed text: the ceiling for end-to-end accuracy
+        fields = run_stage(stages, "nlp", transcripts, extract_invoice_data, rounds)
+        # The first round includes learning each new vendor; later ones are lookups
+        categorized = run_stage(stages, "categorization", [data for data in fields if data], _categorize, rounds)
+
+        init_database()
+        rows = [data for data in categorized if data]
+        run_stage(stages, "db_insert", rows, lambda data: save_invoice_data(data, "bench_suite.png"))
+        run_stage(stages, "db_insert_batch", [rows], lambda batch: save_invoices_batch(
+            [(data, "bench_suite.png") for data in batch]))
+        stages['db_insert_batch']['rows'] = len(rows)
+
+        # The full pipeline per document, as an upload runs it
+        pipeline = run_stage(stages, "pipeline", paths, run_pipeline)
+
+        print()
+        results = {'transcript': accuracy(documents, categorized)}
+        _print_accuracy("fields (text)", results['transcript'])
+        results['pipeline'] = accuracy(documents, [result['data'] if result else None for result in pipeline])
+        _print_accuracy("fields (pipeline)", results['pipeline'])
+
+        engine = None
+        if any(pipeline):
+            engine = measure_engine(paths, page_count, args.workers, args.executor)
+            print(f"\nengine           {engine['per_second']:.2f} documents/s  {engine['pages_per_second']:.2f} pages/s  "
+                  f"workers={args.workers} ({args.executor})  failed={engine['failed']}")
+        else:
+            print("\nengine           skipped: the pipeline did not complete on any document")
+
+        report = {
+            'meta': {
+                'commit': _commit(), 'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                'args': {key: value for key, value in vars(args).items() if key not in ('out', 'compare')},
+                'tools': tools,
+                'config': {'NLP_MODE': NLP_MODE, 'OCR_BACKEND': OCR_BACKEND, 'OCR_MODE': OCR_MODE,
+                           'OCR_PREPROCESS': OCR_PREPROCESS, 'PDF_DPI': PDF_DPI, 'PDF_TEXT_LAYER': PDF_TEXT_LAYER},
+            },
+            'corpus': {'documents': len(documents), 'pages': page_count,
+                       'bytes': sum(document['bytes'] for document in documents)},
+            'stages': stages,
+            'accuracy': {key: value for key, value in results.items() if value is not None},
+            'engine': engine,
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(SCRATCH, ignore_errors=True)
+
+    out = args.out or os.path.join("data", "benchmarks",
+                                   f"{time.strftime('%Y%m%d-%H%M%S')}-{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"\nresults saved to {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
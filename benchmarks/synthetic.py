@@ -0,0 +1,181 @@
+# benchmarks/synthetic.py
+"""Synthetic receipts and invoices with known ground truth, for benchmarks and accuracy checks.
+
+Usage: python benchmarks/synthetic.py [--out data/synthetic] [--count 40] [--seed 0]
+
+Writes receipt images (PNG/JPEG) at several noise levels and multi-page PDFs, both
+born-digital (text layer) and scanned (images only). Every document gets a sidecar
+transcript (name.txt, as bench_preprocess expects) and manifest.json lists the fields
+printed on each one.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_pdf import write_text_pdf
+
+# Vendor names and the category the shipped rules give them
+VENDORS = {
+    "Harbor Cafe": "Food", "Green Leaf Restaurant": "Food", "Sunrise Bakery": "Food",
+    "Fresh Grocer Market": "Food", "City Taxi Company": "Travel", "Skyline Hotel": "Travel",
+    "Metro Transport": "Travel", "Bright Electric": "Utilities", "Fastlink Internet": "Utilities",
+    "Oak Street Housing": "Rent", "Northwind Office Supply": "Misc", "Pixel Hardware": "Misc",
+}
+ITEMS = ["Coffee", "Bagel", "Copier paper", "Toner cartridge", "Taxi fare", "Room night",
+         "Sandwich", "USB cable", "Notebook", "Monthly plan", "Parking", "Desk lamp"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August",
+          "September", "October", "November", "December"]
+# Rendering conditions, from a clean print to a poor phone photo
+NOISE_LEVELS = ("clean", "noisy", "skewed", "lowres")
+# Document kinds: (kind, extension)
+KINDS = (("receipt", "png"), ("receipt", "jpg"), ("digital_pdf", "pdf"), ("scanned_pdf", "pdf"))
+
+_FONT_SIZE = 22
+_LINES_PER_PAGE = 48
+
+
+def _format_date(year, month, day, style):
+    if style == 0:
+        return f"{month:02d}/{day:02d}/{year}"
+    if style == 1:
+        return f"{day:02d}-{month:02d}-{year}"
+    if style == 2:
+        return f"{day} {MONTHS[month - 1][:3]} {year}"
+    return f"{MONTHS[month - 1]} {day}, {year}"
+
+
+def make_document(rng, index, items=None):
+    """Ground truth for one receipt and the lines printed on it"""
+    vendor = rng.choice(sorted(VENDORS))
+    year, month, day = 2024, rng.randint(1, 12), rng.randint(1, 28)
+    invoice_number = f"INV-{index:06d}"
+    count = items if items is not None else rng.randint(3, 12)
+    prices = [round(rng.uniform(1, 80), 2) for _ in range(count)]
+    subtotal = round(sum(prices), 2)
+    rate = rng.choice([0.0, 5.0, 8.25, 10.0])
+    tax = round(subtotal * rate / 100, 2)
+    total = round(subtotal + tax, 2)
+
+    lines = [vendor, f"{rng.randint(1, 99)} Market Street", "",
+             f"Invoice #: {invoice_number}", f"Date: {_format_date(year, month, day, rng.randint(0, 3))}", ""]
+    lines += [f"{rng.choice(ITEMS):<18} ${price:>8.2f}" for price in prices]
+    lines += ["", f"Subtotal           ${subtotal:>8.2f}"]
+    if rate:
+        lines.append(f"Tax {rate:g}%           ${tax:>8.2f}")
+    lines += [f"Total              ${total:>8.2f}", "", "Thank you!"]
+
+    truth = {'vendor': vendor, 'date': f"{year}-{month:02d}-{day:02d}", 'invoice_number': invoice_number,
+             'amount': total, 'tax': tax if rate else None, 'category': VENDORS[vendor]}
+    return truth, lines
+
+
+def _font(size):
+    try:
+        return ImageFont.truetype("DejaVuSansMono.ttf", size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:  # Pillow < 10.1
+            return ImageFont.load_default()
+
+
+def render_page(lines, rng, noise="clean", font_size=_FONT_SIZE):
+    """Grayscale image of the lines as printed and captured under the given noise level"""
+    font = _font(font_size)
+    line_height = int(font_size * 1.5)
+    width = max(int(font.getlength(line)) for line in lines if line) + 2 * font_size
+    height = line_height * len(lines) + 2 * font_size
+    page = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    for number, line in enumerate(lines):
+        draw.text((font_size, font_size + number * line_height), line, fill=0, font=font)
+    image = np.array(page)
+
+    if noise == "noisy":
+        image = cv2.GaussianBlur(image, (3, 3), 0)
+        image = np.clip(image.astype(np.int16) + rng.randint(-40, 0)
+                        + np.random.default_rng(rng.randint(0, 2**31)).normal(0, 25, image.shape), 0, 255)
+        image = image.astype(np.uint8)
+    elif noise == "skewed":
+        # A photo: rotated a few degrees on a darker background, with a margin around the paper
+        image = cv2.copyMakeBorder(image, 80, 80, 80, 80, cv2.BORDER_CONSTANT, value=90)
+        angle = rng.uniform(2, 6) * rng.choice([-1, 1])
+        matrix = cv2.getRotationMatrix2D((image.shape[1] / 2, image.shape[0] / 2), angle, 1.0)
+        image = cv2.warpAffine(image, matrix, (image.shape[1], image.shape[0]), borderValue=90)
+    elif noise == "lowres":
+        small = cv2.resize(image, None, fx=0.55, fy=0.55, interpolation=cv2.INTER_AREA)
+        image = cv2.resize(small, (image.shape[1], image.shape[0]), interpolation=cv2.INTER_LINEAR)
+    return image
+
+
+def _pages(lines):
+    return [lines[start:start + _LINES_PER_PAGE] for start in range(0, len(lines), _LINES_PER_PAGE)]
+
+
+def write_document(directory, name, kind, extension, lines, rng, noise):
+    """Write one document and its transcript; returns (file name, page count)"""
+    path = os.path.join(directory, f"{name}.{extension}")
+    pages = _pages(lines)
+    if kind == "receipt":
+        image = render_page(lines, rng, noise)
+        params = [cv2.IMWRITE_JPEG_QUALITY, 70 if noise != "clean" else 92] if extension == "jpg" else []
+        cv2.imwrite(path, image, params)
+        pages = [lines]
+    elif kind == "digital_pdf":
+        write_text_pdf(path, pages)
+    else:
+        # Scanned: one image per page, placed at 200 dpi
+        images = [Image.fromarray(render_page(page, rng, noise)) for page in pages]
+        images[0].save(path, save_all=True, append_images=images[1:], resolution=200.0)
+    with open(os.path.join(directory, f"{name}.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return os.path.basename(path), len(pages)
+
+
+def write_corpus(directory, count, seed=0, noise_levels=NOISE_LEVELS, max_pages=3):
+    """Generate count documents cycling through kinds and noise levels; returns the manifest.
+
+    Multi-page documents get enough line items to fill 1..max_pages pages.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    manifest = []
+    for index in range(count):
+        kind, extension = KINDS[index % len(KINDS)]
+        noise = "clean" if kind == "digital_pdf" else noise_levels[(index // len(KINDS)) % len(noise_levels)]
+        items = None
+        if kind != "receipt":
+            items = rng.randint(1, max_pages) * _LINES_PER_PAGE - 16
+        truth, lines = make_document(rng, index, items)
+        name = f"{index:04d}_{kind}_{noise}"
+        file_name, page_count = write_document(directory, name, kind, extension, lines, rng, noise)
+        manifest.append({'file': file_name, 'kind': kind, 'noise': noise, 'pages': page_count,
+                         'bytes': os.path.getsize(os.path.join(directory, file_name)), 'truth': truth})
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({'seed': seed, 'documents': manifest}, f, indent=1)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default="data/synthetic")
+    parser.add_argument("--count", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-pages", type=int, default=3)
+    args = parser.parse_args()
+
+    manifest = write_corpus(args.out, args.count, args.seed, max_pages=args.max_pages)
+    pages = sum(document['pages'] for document in manifest)
+    print(f"wrote {len(manifest)} documents ({pages} pages) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
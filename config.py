@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 
+load_dotenv("connection.env")
 load_dotenv()
 
 # Database configuration
@@ -8,10 +9,135 @@ DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'localhost'),
     'database': os.getenv('DB_NAME', 'invoice_extractor'),
     'user': os.getenv('DB_USER', 'sunny'),
-    'password': os.getenv('DB_PASSWORD', 'M.sunny@13')
+    'password': os.getenv('DB_PASSWORD', 'M.sunny@13'),
+    'port': int(os.getenv('DB_PORT', 3306))
 }
+DB_BACKEND = os.getenv('DB_BACKEND', 'mysql')  # 'mysql' or 'sqlite'
+SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH', 'data/invoices.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 128))  # prepared statements per connection
 
 # File upload settings
 UPLOAD_DIR = "data/uploads"
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
\ No newline at end of file
+MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 10 * 1024 * 1024))  # 10MB per receipt
+MAX_BULK_UPLOAD_SIZE = int(os.getenv('MAX_BULK_UPLOAD_SIZE', 500 * 1024 * 1024))  # whole bulk request, archives included
+MAX_ARCHIVE_FILES = int(os.getenv('MAX_ARCHIVE_FILES', 1000))  # entries a bulk zip may list
+MAX_ARCHIVE_EXPANDED_SIZE = int(os.getenv('MAX_ARCHIVE_EXPANDED_SIZE', 1024 * 1024 * 1024))  # bytes extracted from one zip
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 256 * 1024))
+UPLOAD_MEMORY_LIMIT = int(os.getenv('UPLOAD_MEMORY_LIMIT', 4 * 1024 * 1024))  # images up to this are decoded from memory
+ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
+
+
+def _available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Extraction engine settings
+EXTRACTION_EXECUTOR = os.getenv('EXTRACTION_EXECUTOR', 'process')  # 'process' or 'thread'
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', 0)) or _available_cores()
+EXTRACTION_MAX_PENDING = int(os.getenv('EXTRACTION_MAX_PENDING', 0)) or EXTRACTION_WORKERS * 4
+EXTRACTION_START_METHOD = os.getenv('EXTRACTION_START_METHOD', 'spawn')
+
+# Scheduler settings: priority lanes, per-client quotas and admission control
+SCHED_INTERACTIVE_RESERVED = int(os.getenv('SCHED_INTERACTIVE_RESERVED', 1))  # workers bulk work never takes
+SCHED_CLIENT_CONCURRENCY = int(os.getenv('SCHED_CLIENT_CONCURRENCY', 0)) or max(1, EXTRACTION_WORKERS // 2)  # files one client may have running
+SCHED_CLIENT_HEADER = os.getenv('SCHED_CLIENT_HEADER', 'X-Client-Id')  # identifies clients; the remote address without it
+SCHED_INTERACTIVE_SLO = float(os.getenv('SCHED_INTERACTIVE_SLO', 5))  # seconds of estimated wait before an upload gets a 503
+SCHED_BULK_SLO = float(os.getenv('SCHED_BULK_SLO', 300))  # seconds of estimated wait before bulk work is deferred
+SCHED_INTERACTIVE_MAX_COST = float(os.getenv('SCHED_INTERACTIVE_MAX_COST', 10))  # estimated seconds past which an upload runs in the bulk lane
+# Starting cost estimates, refined from the files that finish
+SCHED_SECONDS_PER_PAGE = float(os.getenv('SCHED_SECONDS_PER_PAGE', 2.0))
+SCHED_SECONDS_PER_MEGAPIXEL = float(os.getenv('SCHED_SECONDS_PER_MEGAPIXEL', 0.1))
+SCHED_SECONDS_PER_TEXT = float(os.getenv('SCHED_SECONDS_PER_TEXT', 0.02))  # NER and categorization of one OCR text
+
+# Background job queue settings
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', 'data/jobs.db')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 0)) or EXTRACTION_WORKERS
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))  # seconds
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 30))  # seconds before the first retry; doubles with each failed attempt
+WEBHOOK_TIMEOUT = float(os.getenv('WEBHOOK_TIMEOUT', 10))  # seconds
+
+# OCR settings
+OCR_BACKEND = os.getenv('OCR_BACKEND', 'auto')  # 'auto', 'tesserocr' or 'cli'
+OCR_LANG = os.getenv('OCR_LANG', 'eng')
+TESSERACT_CMD = os.getenv('TESSERACT_CMD', 'tesseract')
+PDF_DPI = int(os.getenv('PDF_DPI', 300))
+# Read the embedded text of born-digital PDF pages instead of rasterizing them for OCR
+PDF_TEXT_LAYER = os.getenv('PDF_TEXT_LAYER', 'true').lower() in ('1', 'true', 'yes')
+PDF_TEXT_MIN_CHARS = int(os.getenv('PDF_TEXT_MIN_CHARS', 20))
+PDFTOTEXT_CMD = os.getenv('PDFTOTEXT_CMD', 'pdftotext')
+# Cores OCR may keep busy across all extraction workers: each extraction holds one, and a PDF
+# spreads its other pages over whichever are idle at the time
+OCR_CORES = int(os.getenv('OCR_CORES', 0)) or _available_cores()
+OCR_PAGE_WORKERS = int(os.getenv('OCR_PAGE_WORKERS', 0)) or OCR_CORES  # long-lived page threads per worker process
+OCR_PAGES_IN_FLIGHT = int(os.getenv('OCR_PAGES_IN_FLIGHT', 0)) or OCR_PAGE_WORKERS * 2
+OCR_PREPROCESS = os.getenv('OCR_PREPROCESS', 'adaptive')  # 'adaptive' or 'basic' (full resolution)
+OCR_TEXT_HEIGHT = int(os.getenv('OCR_TEXT_HEIGHT', 30))  # glyph height in pixels images are scaled to
+OCR_MAX_PIXELS = int(os.getenv('OCR_MAX_PIXELS', 4_000_000))
+# 'text': one plain pass per page; 'confidence' (opt-in until benchmarks/bench_suite.py shows it
+# cheaper and more accurate on real receipts): a fast low-resolution pass, then only doubtful and
+# key lines read again, with per-character confidences
+OCR_MODE = os.getenv('OCR_MODE', 'text')
+OCR_FAST_TEXT_HEIGHT = int(os.getenv('OCR_FAST_TEXT_HEIGHT', 20))  # glyph height in pixels of the first pass
+OCR_RECHECK_CONFIDENCE = float(os.getenv('OCR_RECHECK_CONFIDENCE', 70))  # words below this get their line read again
+OCR_RECHECK_MAX_LINES = int(os.getenv('OCR_RECHECK_MAX_LINES', 12))  # more doubtful lines than this: read the whole page again
+
+# Content-addressed OCR/extraction cache settings
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', 'data/cache.db')
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 50000))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 512 * 1024 * 1024))  # 512MB of cached text/results
+CACHE_MAX_AGE = int(os.getenv('CACHE_MAX_AGE', 30 * 24 * 3600))  # 30 days
+CACHE_CLAIM_TIMEOUT = float(os.getenv('CACHE_CLAIM_TIMEOUT', 1800))  # seconds before a claim left by a dead process lapses
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 500))  # rows per multi-row INSERT
+
+# Blob storage settings: compressed OCR text and content-addressed originals
+BLOB_DIR = os.getenv('BLOB_DIR', 'data/blobs')
+BLOB_COMPRESSION = os.getenv('BLOB_COMPRESSION', 'auto')  # 'zstd', 'zlib' or 'auto' (zstd when installed)
+
+# Invoice read response cache settings (per API process)
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 30))  # seconds; also bounds staleness from other processes' writes (0 = off)
+RESPONSE_CACHE_ENTRIES = int(os.getenv('RESPONSE_CACHE_ENTRIES', 1024))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Invoice export (/invoices/export) settings
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 5000))  # rows fetched and encoded at a time
+
+# Offline backfill (python -m app.cli) settings
+BACKFILL_CHECKPOINT_PATH = os.getenv('BACKFILL_CHECKPOINT_PATH', 'data/backfill.db')  # files finished so far
+
+# Bulk upload settings
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', 100))  # results buffered before a DB flush
+BULK_FLUSH_INTERVAL = float(os.getenv('BULK_FLUSH_INTERVAL', 1.0))  # seconds
+
+# Search settings
+SEARCH_FUZZY_THRESHOLD = float(os.getenv('SEARCH_FUZZY_THRESHOLD', 0.75))  # edit similarity for a vendor match
+SEARCH_VENDOR_MATCHES = int(os.getenv('SEARCH_VENDOR_MATCHES', 10))  # vendors a fuzzy name expands to
+SEARCH_RANK_WINDOW = int(os.getenv('SEARCH_RANK_WINDOW', 10000))  # newest matches ranked for very common words (0 = all)
+SEARCH_VENDOR_REFRESH = float(os.getenv('SEARCH_VENDOR_REFRESH', 60))  # seconds before new vendors are fuzzy-matchable
+
+# Vendor registry settings
+# Categories, aliases and per-vendor overrides; shipped with the code, so found relative to it
+VENDOR_RULES_PATH = os.getenv('VENDOR_RULES_PATH',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'vendor_rules.json'))
+VENDOR_DB_PATH = os.getenv('VENDOR_DB_PATH', 'data/vendors.db')  # learned aliases, shared by the workers
+VENDOR_ALIAS_THRESHOLD = float(os.getenv('VENDOR_ALIAS_THRESHOLD', 0.88))  # similarity for a new spelling to join a vendor
+VENDOR_RULES_CHECK = float(os.getenv('VENDOR_RULES_CHECK', 5))  # seconds between checks for an edited rules file
+
+# Logging and profiling settings
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' (one object per line) or 'text'
+# Lets a single request be profiled by adding ?profile=1; leave off in production
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'data/profiles')
+
+# NLP settings
+SPACY_MODEL = os.getenv('SPACY_MODEL', 'en_core_web_sm')
+NLP_MODE = os.getenv('NLP_MODE', 'ner')  # 'ner', 'auto' (NER only fills regex gaps) or 'regex'
+NLP_BATCH_SIZE = int(os.getenv('NLP_BATCH_SIZE', 64))
+NLP_N_PROCESS = int(os.getenv('NLP_N_PROCESS', 1))
+NLP_BATCH_WAIT = float(os.getenv('NLP_BATCH_WAIT', 0.02))  # seconds to gather concurrent texts
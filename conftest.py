@@ -0,0 +1,30 @@
+# conftest.py
+"""Shared pytest fixtures: scratch SQLite storage and extraction cache, so tests never
+touch data/ or need MySQL."""
+import pytest
+
+from app import blobs, cache, db_backends, search
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """A fresh SQLite invoice database (with blob storage under tmp_path) for one test"""
+    from app.database import init_database
+
+    monkeypatch.setattr(blobs, 'BLOB_DIR', str(tmp_path / "blobs"))
+    # The fuzzy vendor index is per process; a new database needs a new one
+    monkeypatch.setattr(search, '_vendor_index', None)
+    previous = db_backends._storage
+    scratch = db_backends.SQLiteStorage(str(tmp_path / "invoices.db"))
+    db_backends.set_storage(scratch)
+    init_database()
+    yield scratch
+    db_backends.set_storage(previous)
+
+
+@pytest.fixture
+def cache_db(tmp_path, monkeypatch):
+    """A fresh extraction cache for one test"""
+    monkeypatch.setattr(cache, 'CACHE_DB_PATH', str(tmp_path / "cache.db"))
+    cache.init_cache_db()
+    return cache.CACHE_DB_PATH
@@ -0,0 +1,74 @@
+# test_analytics.py
+"""Checks for the running invoice_summary totals (app/analytics.py) and the analytics
+endpoints, against a scratch SQLite database (the storage fixture in conftest.py).
+
+Usage: pytest test_analytics.py
+"""
+from datetime import date
+
+import pytest
+
+from app.analytics import get_category_totals, get_monthly_totals, get_vendor_totals
+from app.database import save_invoice_data, save_invoices_batch
+
+
+def invoice(vendor, day, amount, tax=None, category="Misc"):
+    return {'vendor': vendor, 'date': day, 'amount': amount, 'tax': tax, 'category': category,
+            'invoice_number': None, 'raw_text': vendor}
+
+
+def grouped(storage, key, where=""):
+    """Totals straight from the invoices table, shaped like the summary's"""
+    with storage.session() as db:
+        rows = db.query(f"""
+            SELECT {key} AS name, COUNT(*) AS invoice_count, SUM(amount) AS total_amount,
+                   COALESCE(SUM(tax), 0) AS total_tax
+            FROM invoices {where} GROUP BY 1
+        """)
+    return {row['name']: (row['invoice_count'], round(row['total_amount'], 2), round(row['total_tax'], 2))
+            for row in rows}
+
+
+def summarized(rows, key):
+    return {row[key]: (row['invoice_count'], round(row['total_amount'], 2), round(row['total_tax'], 2))
+            for row in rows}
+
+
+def test_summary_matches_a_group_by_after_new_inserts(storage):
+    save_invoices_batch([(invoice("ACME", "2024-01-05", 10.0, 1.0), "a.png"),
+                         (invoice("Globex", "2024-01-20", 5.5, category="Travel"), "b.png"),
+                         (invoice("ACME", None, 3.25), "c.png")])
+    # One at a time, and a batch landing on rows the summary already has
+    save_invoice_data(invoice("ACME", "2024-02-01", 7.0, 0.7), "d.png")
+    save_invoices_batch([(invoice("Globex", "2024-01-31", 1.1, category="Travel"), "e.png"),
+                         (invoice("Initech", "2024-03-15", 20.0, 2.0, category="Office"), "f.png")])
+
+    assert summarized(get_monthly_totals(), 'month') == grouped(
+        storage, "SUBSTR(invoice_date, 1, 7)", "WHERE invoice_date IS NOT NULL")
+    assert summarized(get_category_totals(), 'category') == grouped(storage, "category")
+    assert summarized(get_vendor_totals(), 'vendor') == grouped(storage, "vendor")
+
+
+def test_ranges_cover_whole_months(storage):
+    save_invoices_batch([(invoice("ACME", "2024-01-05", 10.0), "a.png"),
+                         (invoice("ACME", "2024-02-28", 20.0), "b.png"),
+                         (invoice("ACME", "2024-03-01", 40.0), "c.png")])
+    months = get_monthly_totals(date(2024, 1, 31), date(2024, 2, 1))
+    assert [row['month'] for row in months] == ["2024-01", "2024-02"]
+    assert get_vendor_totals(date_from=date(2024, 2, 15))[0]['total_amount'] == 60.0
+    assert get_category_totals(date_to=date(2024, 1, 1))[0]['total_amount'] == 10.0
+
+
+@pytest.mark.parametrize("path", ["/analytics/monthly", "/analytics/by-category", "/analytics/by-vendor"])
+def test_endpoints_take_dates(storage, path):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    save_invoices_batch([(invoice("ACME", "2024-01-05", 10.0), "a.png"),
+                         (invoice("ACME", "2024-03-01", 40.0), "b.png")])
+    client = TestClient(app)
+    response = client.get(path, params={'date_from': "2024-01-20", 'date_to': "2024-02-10"})
+    assert response.status_code == 200
+    assert [row['total_amount'] for row in response.json()] == [10.0]
+    for junk in ("2024-1", "january", "2024-13-01", "2024-01-05' OR 1=1"):
+        assert client.get(path, params={'date_from': junk}).status_code == 422, junk
@@ -0,0 +1,130 @@
+# test_blobs.py
+"""Checks for blob storage (app/blobs.py): migrating invoices written before OCR text and
+originals moved out of the invoices table, and compacting what is left behind.
+
+Legacy rows are inserted straight into a scratch SQLite database (the storage fixture in
+conftest.py) with their text inline and their files in a scratch upload directory.
+
+Usage: pytest test_blobs.py
+"""
+import hashlib
+import os
+
+import pytest
+
+from app import blobs
+from app.blobs import compact, load_texts, migrate, original_path
+from app.database import get_invoice_by_id, save_invoices_batch
+
+TEXTS = [
+    "ACME Corp\nInvoice INV-1\nTotal 12.50\n",
+    "Café Müller – Rechnung\n€ 4,20   \n\n",
+    "Same scan, uploaded twice",
+    "Same scan, uploaded twice",
+    "File went missing\r\nTotal 1.00",
+]
+FILES = [b"%PDF-1.4\nacme", b"\x89PNG\r\n\x1a\ncafe", b"%PDF-1.4\nsame", b"%PDF-1.4\nsame", None]
+
+
+@pytest.fixture
+def legacy(storage, tmp_path):
+    """Invoices as they were stored before blob storage, plus one saved the current way"""
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    ids = []
+    with storage.session() as db:
+        for number, (text, data) in enumerate(zip(TEXTS, FILES)):
+            name = f"{number}.pdf"
+            db.execute("INSERT INTO invoices (vendor, invoice_date, amount, category, raw_text, file_name) "
+                       "VALUES (%s, %s, %s, %s, %s, %s)", ("ACME", "2023-06-01", 1.0, "Misc", text, name))
+            ids.append(db.lastrowid)
+            if data is not None:
+                (uploads / name).write_bytes(data)
+    [current] = save_invoices_batch([({'vendor': "Globex", 'date': "2024-01-15", 'amount': 2.0, 'tax': None,
+                                       'category': "Misc", 'invoice_number': None, 'raw_text': "Already stored"},
+                                      "new.pdf")])
+    return ids, current, str(uploads)
+
+
+def snapshot(storage):
+    with storage.session() as db:
+        invoices = db.query("SELECT * FROM invoices ORDER BY id")
+        stored = db.query("SELECT * FROM invoice_blobs ORDER BY invoice_id")
+    files = sorted(os.path.relpath(os.path.join(directory, name), blobs.BLOB_DIR)
+                   for directory, _, names in os.walk(blobs.BLOB_DIR) for name in names)
+    return invoices, stored, files
+
+
+def test_migrate_moves_inline_text_and_upload_files(storage, legacy):
+    ids, current, uploads = legacy
+    counts = migrate(batch_size=2, upload_dir=uploads)
+    assert counts['texts'] == 5 and counts['originals'] == 4 and counts['missing_files'] == 1
+    assert counts['text_bytes'] == sum(len(text.encode('utf-8')) for text in TEXTS)
+    assert counts['stored_bytes'] > 0
+
+    with storage.session() as db:
+        assert db.query_one("SELECT COUNT(*) AS n FROM invoices WHERE raw_text IS NOT NULL")['n'] == 0
+        hashes = {row['invoice_id']: row['content_hash'] for row in db.query(
+            "SELECT invoice_id, content_hash FROM invoice_blobs")}
+    assert set(hashes) == set(ids) | {current}
+    for invoice_id, data in zip(ids, FILES):
+        if data is None:
+            assert hashes[invoice_id] is None
+        else:
+            assert hashes[invoice_id] == hashlib.sha256(data).hexdigest()
+            with open(original_path(hashes[invoice_id]), "rb") as f:
+                assert f.read() == data
+    # The two identical uploads share one stored original
+    assert hashes[ids[2]] == hashes[ids[3]]
+    assert os.listdir(uploads) == []
+
+
+def test_a_second_migration_changes_nothing(storage, legacy):
+    ids, current, uploads = legacy
+    migrate(batch_size=2, upload_dir=uploads)
+    before = snapshot(storage)
+    counts = migrate(batch_size=2, upload_dir=uploads)
+    assert (counts['texts'], counts['originals'], counts['missing_files']) == (0, 0, 0)
+    assert snapshot(storage) == before
+
+
+def test_migrated_text_reads_back_byte_for_byte(storage, legacy):
+    ids, current, uploads = legacy
+    migrate(batch_size=2, upload_dir=uploads)
+    with storage.session() as db:
+        rows = load_texts(db, db.query("SELECT id, raw_text FROM invoices ORDER BY id"))
+    assert [row['raw_text'].encode('utf-8') for row in rows] == [
+        text.encode('utf-8') for text in TEXTS + ["Already stored"]]
+    for invoice_id, text in zip(ids, TEXTS):
+        assert get_invoice_by_id(invoice_id, include_text=True)['raw_text'].encode('utf-8') == text.encode('utf-8')
+        assert 'raw_text' not in get_invoice_by_id(invoice_id)
+
+
+def test_compact_only_removes_unreferenced_blobs(storage, legacy):
+    ids, current, uploads = legacy
+    migrate(upload_dir=uploads)
+    shared = original_path(hashlib.sha256(FILES[2]).hexdigest())
+    acme = original_path(hashlib.sha256(FILES[0]).hexdigest())
+    # Invoice 0 and one of the two sharing a scan are deleted without their blobs
+    with storage.session() as db:
+        db.execute("DELETE FROM invoices WHERE id IN (%s, %s)", (ids[0], ids[2]))
+    stray = original_path(hashlib.sha256(b"left behind").hexdigest())
+    os.makedirs(os.path.dirname(stray))
+    with open(stray, "wb") as f:
+        f.write(b"left behind")
+    with open(os.path.join(blobs.BLOB_DIR, "README"), "w") as f:
+        f.write("not an original")
+
+    assert compact() == {'blob_rows': 2, 'originals': 2}
+    assert not os.path.exists(acme) and not os.path.exists(stray)
+    # Still linked from the other invoice with the same scan
+    assert os.path.exists(shared)
+    assert os.path.exists(os.path.join(blobs.BLOB_DIR, "README"))
+    with storage.session() as db:
+        assert {row['invoice_id'] for row in db.query("SELECT invoice_id FROM invoice_blobs")} == {
+            ids[1], ids[3], ids[4], current}
+    assert get_invoice_by_id(ids[3], include_text=True)['raw_text'] == TEXTS[3]
+
+    before = snapshot(storage)
+    assert compact() == {'blob_rows': 0, 'originals': 0}
+    assert snapshot(storage) == before
@@ -0,0 +1,145 @@
+# test_bulk.py
+"""Checks for the bulk upload (app/bulk.py): zip handling and concurrent duplicates.
+
+Archives are built in a temporary directory; members that can't be read are made by
+patching the flags or compression method of an ordinary archive's central directory.
+Bulk runs use a scratch SQLite database and cache, with stand-ins for the scheduler and
+the NER batcher.
+
+Usage: pytest test_bulk.py
+"""
+import asyncio
+import hashlib
+import json
+import os
+import zipfile
+
+import pytest
+
+from app import bulk, cache
+from app.bulk import expand_archive, process_bulk
+from app.cache import check_content
+from app.uploads import UploadRejected
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 1000
+
+
+def archive(path, members, patch=None):
+    """Write a zip of (name, bytes) members; patch maps a member name to (flags, method)"""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    if patch:
+        data = bytearray(open(path, "rb").read())
+        offset = data.find(b"PK\x01\x02")
+        while offset != -1:
+            name_length = int.from_bytes(data[offset + 28:offset + 30], "little")
+            name = data[offset + 46:offset + 46 + name_length].decode()
+            if name in patch:
+                flags, method = patch[name]
+                data[offset + 8:offset + 10] = flags.to_bytes(2, "little")
+                data[offset + 10:offset + 12] = method.to_bytes(2, "little")
+            offset = data.find(b"PK\x01\x02", offset + 4)
+        open(path, "wb").write(bytes(data))
+    return str(path)
+
+
+def test_supported_members_are_extracted_and_the_archive_removed(tmp_path):
+    zip_path = archive(tmp_path / "in.zip", [("a.png", PNG), ("notes.txt", b"hello"), ("dir/b.png", PNG)])
+    members, skipped = expand_archive(zip_path, str(tmp_path))
+    assert [name for name, _, _, _ in members] == ["a.png", "b.png"]
+    assert skipped == ["notes.txt"]
+    assert all(os.path.exists(path) for _, _, path, _ in members)
+    assert not os.path.exists(zip_path)
+
+
+def test_unreadable_members_are_skipped(tmp_path):
+    zip_path = archive(tmp_path / "in.zip", [("ok.png", PNG), ("locked.png", PNG), ("odd.png", PNG)],
+                       # Encrypted, and compressed with AES (method 99), which zipfile can't read
+                       patch={"locked.png": (0x1, 8), "odd.png": (0, 99)})
+    members, skipped = expand_archive(zip_path, str(tmp_path))
+    assert [name for name, _, _, _ in members] == ["ok.png"]
+    assert skipped == ["locked.png", "odd.png"]
+    assert sorted(os.listdir(tmp_path)) == sorted(filename for _, filename, _, _ in members)
+
+
+def test_archives_listing_too_many_files_are_refused(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk, 'MAX_ARCHIVE_FILES', 2)
+    zip_path = archive(tmp_path / "in.zip", [(f"{i}.png", PNG) for i in range(3)])
+    with pytest.raises(UploadRejected):
+        expand_archive(zip_path, str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+
+def test_extraction_stops_at_the_expanded_size_limit(tmp_path, monkeypatch):
+    # Room for two members; the rest are skipped however well they compress
+    monkeypatch.setattr(bulk, 'MAX_ARCHIVE_EXPANDED_SIZE', len(PNG) * 2 + 10)
+    zip_path = archive(tmp_path / "in.zip", [(f"{i}.png", PNG) for i in range(4)])
+    members, skipped = expand_archive(zip_path, str(tmp_path))
+    assert len(members) == 2 and skipped == ["2.png", "3.png"]
+    assert sum(os.path.getsize(path) for _, _, path, _ in members) <= len(PNG) * 2 + 10
+
+
+class StubScheduler:
+    """Stands in for the scheduler: OCR 'reads' the file's bytes after a short pause"""
+
+    slots = 2
+
+    class cost_model:
+        @staticmethod
+        def estimate(fn, file_path, data=None):
+            return {'work': fn.__name__, 'unit': 'page', 'units': 1, 'seconds': 0.1}
+
+    def __init__(self):
+        self.runs = 0
+
+    async def run(self, fn, file_path, estimate, lane, client=None):
+        self.runs += 1
+        await asyncio.sleep(0.05)
+        if b"broken" in open(file_path, "rb").read():
+            raise ValueError("unreadable page")
+        return {'text': "ACME\nTotal 12.50", 'confidence': bytearray(), 'timings': {}}
+
+
+class StubBatcher:
+    async def extract(self, text, confidence=None):
+        return {'vendor': "ACME", 'date': None, 'amount': 12.5, 'tax': None, 'category': "Other",
+                'invoice_number': None, 'raw_text': text}, {}
+
+
+def upload(tmp_path, name, data):
+    path = tmp_path / "uploads" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(data)
+    return (name, name, str(path), hashlib.sha256(data).hexdigest())
+
+
+async def run_bulk(uploads, scheduler):
+    lines = [json.loads(line) async for line in process_bulk(uploads, scheduler, StubBatcher())]
+    return lines[:-1], lines[-1]['summary']
+
+
+def test_concurrent_bulk_uploads_of_the_same_content_save_one_invoice(tmp_path, storage, cache_db):
+    scheduler = StubScheduler()
+
+    async def scenario():
+        return await asyncio.gather(run_bulk([upload(tmp_path, "a.png", PNG)], scheduler),
+                                    run_bulk([upload(tmp_path, "b.png", PNG)], scheduler))
+
+    (first, _), (second, _) = asyncio.run(scenario())
+    statuses = sorted(event['status'] for event in first + second)
+    assert statuses == ["duplicate", "saved"]
+    assert len({event['id'] for event in first + second}) == 1
+    assert scheduler.runs == 1
+    with storage.session() as db:
+        assert db.query_one("SELECT COUNT(*) AS n FROM invoices")['n'] == 1
+    # The claim was given back with the save
+    assert cache.claim(check_content(hashlib.sha256(PNG).hexdigest())[0])
+
+
+def test_failed_extractions_leave_no_files_or_claims(tmp_path, storage, cache_db):
+    broken = PNG + b"broken"
+    events, summary = asyncio.run(run_bulk([upload(tmp_path, "bad.png", broken)], StubScheduler()))
+    assert [event['status'] for event in events] == ["failed"]
+    assert os.listdir(tmp_path / "uploads") == []
+    assert cache.claim(check_content(hashlib.sha256(broken).hexdigest())[0])
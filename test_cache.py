@@ -0,0 +1,144 @@
+# test_cache.py
+"""Checks for the content-hash extraction cache (app/cache.py).
+
+Each test gets a scratch cache database (the cache_db fixture in conftest.py); settings are
+changed by patching the values app.cache imported from config.
+
+Usage: pytest test_cache.py
+"""
+import asyncio
+import json
+import sqlite3
+
+from app import cache
+from app.cache import cache_key, check_content, claim, claim_content, evict, lookup, release, store
+
+RESULT = {'vendor': "ACME", 'amount': 12.5, 'raw_text': "ACME\nTotal 12.50"}
+
+
+def age(db_path, key, seconds):
+    """Make an entry look older than it is"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE extraction_cache SET created_at = created_at - ? WHERE cache_key = ?",
+                 (seconds, key))
+    conn.commit()
+    conn.close()
+
+
+def keys(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT cache_key FROM extraction_cache").fetchall()
+    conn.close()
+    return {row[0] for row in rows}
+
+
+def test_key_changes_with_the_settings_that_change_the_output(monkeypatch):
+    baseline = cache_key("abc")
+    assert cache_key("abc") == baseline and cache_key("abd") != baseline
+    for name, value in (('PDF_DPI', 150), ('OCR_LANG', "deu"), ('OCR_PREPROCESS', "basic"),
+                        ('OCR_TEXT_HEIGHT', 40), ('OCR_MAX_PIXELS', 1), ('PDF_TEXT_LAYER', False)):
+        with monkeypatch.context() as patch:
+            patch.setattr(cache, name, value)
+            assert cache_key("abc") != baseline, name
+
+
+def test_confidence_settings_only_count_in_confidence_mode(monkeypatch):
+    monkeypatch.setattr(cache, 'OCR_MODE', "text")
+    text = cache_key("abc")
+    monkeypatch.setattr(cache, 'OCR_RECHECK_CONFIDENCE', 10.0)
+    assert cache_key("abc") == text
+
+    monkeypatch.setattr(cache, 'OCR_MODE', "confidence")
+    confidence = cache_key("abc")
+    assert confidence != text
+    monkeypatch.setattr(cache, 'OCR_RECHECK_MAX_LINES', 1)
+    assert cache_key("abc") != confidence
+
+
+def test_stored_results_link_duplicates_to_their_invoice(cache_db):
+    key, cached = check_content("abc")
+    assert cached is None
+    store(key, "abc", RESULT, invoice_id=7)
+    key_again, cached = check_content("abc")
+    assert key_again == key
+    assert cached == {'result': RESULT, 'invoice_id': 7}
+    # A result cached without an invoice (the save failed) is reused but isn't a duplicate
+    other, _ = check_content("def")
+    store(other, "def", RESULT)
+    assert lookup(other)['invoice_id'] is None
+
+
+def test_a_pipeline_version_bump_misses_old_entries(cache_db, monkeypatch):
+    key, _ = check_content("abc")
+    store(key, "abc", RESULT, invoice_id=7)
+    monkeypatch.setattr(cache, 'PIPELINE_VERSION', cache.PIPELINE_VERSION + 1)
+    new_key, cached = check_content("abc")
+    assert new_key != key and cached is None
+    # The stale entry just waits for eviction
+    assert key in keys(cache_db)
+
+
+def test_expired_entries_miss_and_are_evicted(cache_db):
+    key, _ = check_content("abc")
+    store(key, "abc", RESULT, invoice_id=7)
+    age(cache_db, key, cache.CACHE_MAX_AGE + 1)
+    assert lookup(key) is None
+    assert evict() == 1
+    assert keys(cache_db) == set()
+
+
+def test_least_recently_used_entries_go_first(cache_db, monkeypatch):
+    entries = {name: check_content(name)[0] for name in ("a", "b", "c")}
+    for name, key in entries.items():
+        store(key, name, RESULT)
+    # Reading a makes b the least recently used
+    assert lookup(entries["a"]) is not None
+    monkeypatch.setattr(cache, 'CACHE_MAX_ENTRIES', 2)
+    assert evict() == 1
+    assert keys(cache_db) == {entries["a"], entries["c"]}
+
+
+def test_entries_are_evicted_down_to_the_byte_limit(cache_db, monkeypatch):
+    entries = [check_content(name)[0] for name in ("a", "b", "c")]
+    for key in entries:
+        store(key, "x", RESULT)
+    size = len(json.dumps(RESULT))
+    monkeypatch.setattr(cache, 'CACHE_MAX_BYTES', size * 2)
+    assert evict() == 1
+    assert keys(cache_db) == set(entries[1:])
+    assert cache.cache_stats()['bytes'] == size * 2
+
+
+def test_claims_are_exclusive_until_released_or_lapsed(cache_db, monkeypatch):
+    key, _ = check_content("abc")
+    assert claim(key)
+    assert not claim(key)
+    release(key)
+    assert claim(key)
+    # The holder died without releasing
+    monkeypatch.setattr(cache, 'CACHE_CLAIM_TIMEOUT', -1)
+    assert claim(key)
+
+
+def test_claim_content_waits_for_the_holder_and_returns_its_invoice(cache_db, monkeypatch):
+    monkeypatch.setattr(cache, '_CLAIM_POLL_SECONDS', 0.01)
+    key, _ = check_content("abc")
+    assert claim(key)
+
+    async def scenario():
+        waiting = asyncio.ensure_future(claim_content(key))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        store(key, "abc", RESULT, invoice_id=7)
+        release(key)
+        return await waiting
+
+    assert asyncio.run(scenario())['invoice_id'] == 7
+    # The duplicate didn't keep the claim
+    assert claim(key)
+
+
+def test_claim_content_holds_the_claim_when_there_is_nothing_to_link(cache_db):
+    key, _ = check_content("abc")
+    assert asyncio.run(claim_content(key)) is None
+    assert not claim(key)
@@ -0,0 +1,105 @@
+# test_cli.py
+"""Checks for the offline backfill (app/cli.py): checkpointing and what reaches each output.
+
+Extraction is replaced by an engine whose futures are already resolved, and the database
+writer runs against a scratch SQLite database (the storage fixture in conftest.py).
+
+Usage: pytest test_cli.py
+"""
+import json
+from concurrent.futures import Future
+
+import pytest
+
+from app import database
+from app.cli import DONE, FAILED, Checkpoint, DatabaseWriter, JSONLinesWriter, backfill
+
+
+class StubEngine:
+    """Resolves every file at once, with an error for names listed in fail"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.submitted = []
+
+    def submit(self, fn, path):
+        self.submitted.append(path)
+        future = Future()
+        name = path.rsplit("/", 1)[-1]
+        if name in self.fail:
+            future.set_exception(ValueError("unreadable scan"))
+        else:
+            future.set_result({'data': {'vendor': name, 'date': "2024-01-15", 'amount': 1.0, 'tax': None,
+                                        'category': "Misc", 'invoice_number': None, 'raw_text': name}})
+        return future
+
+
+@pytest.fixture
+def scans(tmp_path):
+    root = tmp_path / "scans"
+    root.mkdir()
+    for name in ("a.png", "b.png", "c.png", "d.png"):
+        (root / name).write_bytes(b"\x89PNG\r\n\x1a\n" + name.encode())
+    return str(root)
+
+
+def run(scans, tmp_path, engine, retry_failed=False, db=True):
+    writers = [JSONLinesWriter(str(tmp_path / "out.jsonl"))]
+    if db:
+        writers.insert(0, DatabaseWriter())
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.db"))
+    try:
+        return backfill(scans, writers, checkpoint, engine, window=2, batch_size=3, retry_failed=retry_failed)
+    finally:
+        checkpoint.close()
+        for writer in writers:
+            if hasattr(writer, 'close'):
+                writer.close()
+
+
+def lines(tmp_path):
+    with open(tmp_path / "out.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def statuses(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.db"))
+    try:
+        return {row['path'].rsplit("/", 1)[-1]: row['status']
+                for row in checkpoint.conn.execute("SELECT path, status FROM backfill_files")}
+    finally:
+        checkpoint.close()
+
+
+def test_a_second_run_only_processes_what_is_left(scans, tmp_path):
+    counts = run(scans, tmp_path, StubEngine(fail={"b.png"}), db=False)
+    assert (counts['done'], counts['failed']) == (3, 1)
+    assert statuses(tmp_path) == {"a.png": DONE, "b.png": FAILED, "c.png": DONE, "d.png": DONE}
+
+    engine = StubEngine()
+    assert run(scans, tmp_path, engine, db=False)['skipped'] == 4 and engine.submitted == []
+    run(scans, tmp_path, engine, retry_failed=True, db=False)
+    assert [path.rsplit("/", 1)[-1] for path in engine.submitted] == ["b.png"]
+    assert sorted(line['file'] for line in lines(tmp_path)) == ["a.png", "b.png", "c.png", "d.png"]
+
+
+def test_records_the_database_refused_are_not_written_until_a_retry_saves_them(scans, tmp_path, storage,
+                                                                               monkeypatch):
+    save = database.save_invoices_batch
+
+    def refuse_c(items, *args, **kwargs):
+        ids = save(items, *args, **kwargs)
+        return [None if data['file'] == "c.png" else invoice_id for (data, _), invoice_id in zip(items, ids)]
+
+    monkeypatch.setattr(database, 'save_invoices_batch', refuse_c)
+    run(scans, tmp_path, StubEngine())
+    assert statuses(tmp_path)["c.png"] == FAILED
+    assert sorted(line['file'] for line in lines(tmp_path)) == ["a.png", "b.png", "d.png"]
+
+    monkeypatch.setattr(database, 'save_invoices_batch', save)
+    run(scans, tmp_path, StubEngine(), retry_failed=True)
+    assert set(statuses(tmp_path).values()) == {DONE}
+    # Each file once, with the id it was saved under
+    written = lines(tmp_path)
+    assert sorted(line['file'] for line in written) == ["a.png", "b.png", "c.png", "d.png"]
+    assert all(line['invoice_id'] is not None for line in written)
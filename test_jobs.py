@@ -0,0 +1,197 @@
+# test_jobs.py
+"""Checks for the background job queue (app/jobs.py).
+
+Each test gets a scratch JOBS_DB_PATH. JobRunner._process runs against a scratch invoice
+database and cache, with stand-ins for the scheduler and the NER batcher.
+
+Usage: pytest test_jobs.py
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from app import cache, jobs
+from app.jobs import (
+    DONE,
+    EXTRACTING,
+    FAILED,
+    QUEUED,
+    SAVING,
+    JobRunner,
+    claim_next_job,
+    create_job,
+    get_job,
+    init_jobs_db,
+    update_job,
+)
+from app.workers import EngineBusy
+
+
+@pytest.fixture
+def jobs_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOBS_DB_PATH', str(tmp_path / "jobs.db"))
+    init_jobs_db()
+    return jobs.JOBS_DB_PATH
+
+
+def attempts(job_id):
+    conn = sqlite3.connect(jobs.JOBS_DB_PATH)
+    value = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    conn.close()
+    return value
+
+
+class StubScheduler:
+    """Stands in for the scheduler; raises busy, or an error, instead of running OCR when told to"""
+
+    class cost_model:
+        @staticmethod
+        def estimate(fn, file_path, data=None):
+            return {'work': fn.__name__, 'unit': 'page', 'units': 1, 'seconds': 0.1}
+
+    def __init__(self, busy=False, error=None):
+        self.busy = busy
+        self.error = error
+        self.clients = []
+
+    async def run(self, fn, file_path, estimate, lane, client=None):
+        self.clients.append(client)
+        if self.busy:
+            raise EngineBusy("queue full")
+        if self.error:
+            raise self.error
+        return {'text': "ACME\nTotal 12.50", 'confidence': bytearray(), 'timings': {'ocr': 0.1}}
+
+
+class StubBatcher:
+    async def extract(self, text, confidence=None):
+        return {'vendor': "ACME", 'date': None, 'amount': 12.5, 'tax': None, 'category': "Misc",
+                'invoice_number': None, 'raw_text': text}, {'nlp': 0.01, 'categorization': 0.0}
+
+
+def queued_file(tmp_path, name="a.png", data=b"\x89PNG\r\n\x1a\n" + b"\x00" * 100, client=None):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return create_job(str(path), name, client=client)
+
+
+def test_each_job_is_claimed_by_one_worker(jobs_db, tmp_path):
+    created = [create_job(str(tmp_path / f"{i}.png"), f"{i}.png") for i in range(20)]
+    claimed, lock = [], threading.Lock()
+
+    def worker():
+        while (job := claim_next_job()) is not None:
+            with lock:
+                claimed.append(job)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(job['id'] for job in claimed) == sorted(created)
+    assert all(job['attempts'] == 1 for job in claimed)
+    assert {get_job(job_id)['status'] for job_id in created} == {EXTRACTING}
+
+
+def test_oldest_job_is_claimed_first(jobs_db, tmp_path):
+    first = create_job(str(tmp_path / "a.png"), "a.png")
+    create_job(str(tmp_path / "b.png"), "b.png")
+    assert claim_next_job()['id'] == first
+
+
+def test_interrupted_jobs_are_requeued_on_restart(jobs_db, tmp_path):
+    extracting, saving, done = (create_job(str(tmp_path / f"{i}.png"), f"{i}.png") for i in range(3))
+    update_job(extracting, status=EXTRACTING)
+    update_job(saving, status=SAVING)
+    update_job(done, status=DONE)
+    init_jobs_db()
+    assert [get_job(job_id)['status'] for job_id in (extracting, saving, done)] == [QUEUED, QUEUED, DONE]
+
+
+def test_failed_attempts_are_retried_up_to_the_limit(jobs_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 2)
+    job_id = create_job(str(tmp_path / "missing.png"), "missing.png")
+    runner = JobRunner(StubScheduler(), StubBatcher(), workers=1, poll_interval=0)
+
+    # The file is gone, so every attempt fails reading it
+    asyncio.run(runner._process(claim_next_job()))
+    job = get_job(job_id)
+    assert job['status'] == QUEUED and job['attempts'] == 1 and job['finished_at'] is None
+    assert "Error reading file" in job['error']
+
+    update_job(job_id, run_after=time.time())
+    asyncio.run(runner._process(claim_next_job()))
+    job = get_job(job_id)
+    assert job['status'] == FAILED and job['attempts'] == 2 and job['finished_at'] is not None
+    assert claim_next_job() is None
+
+
+def test_retries_back_off_exponentially(jobs_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 4)
+    monkeypatch.setattr(jobs, 'JOB_RETRY_DELAY', 30)
+    job_id = create_job(str(tmp_path / "missing.png"), "missing.png")
+    later = create_job(str(tmp_path / "b.png"), "b.png")
+    runner = JobRunner(StubScheduler(), StubBatcher(), workers=1, poll_interval=0)
+
+    for attempt, delay in ((1, 30), (2, 60), (3, 120)):
+        job = claim_next_job()
+        assert job['id'] == job_id and job['attempts'] == attempt
+        before = time.time()
+        asyncio.run(runner._process(job))
+        run_after = get_job(job_id)['run_after']
+        assert before + delay <= run_after <= time.time() + delay
+        # Not claimed again before then, while newer jobs go ahead of it
+        assert claim_next_job()['id'] == later
+        update_job(later, status=QUEUED)
+        update_job(job_id, run_after=time.time())
+
+
+def test_a_job_that_runs_out_of_attempts_removes_its_upload(jobs_db, tmp_path, storage, cache_db, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 2)
+    job_id = queued_file(tmp_path)
+    runner = JobRunner(StubScheduler(error=RuntimeError("corrupt image")), StubBatcher(),
+                       workers=1, poll_interval=0)
+
+    asyncio.run(runner._process(claim_next_job()))
+    # A retry still needs the file
+    assert get_job(job_id)['status'] == QUEUED and (tmp_path / "a.png").exists()
+
+    update_job(job_id, run_after=time.time())
+    asyncio.run(runner._process(claim_next_job()))
+    job = get_job(job_id)
+    assert job['status'] == FAILED and "corrupt image" in job['error']
+    assert not (tmp_path / "a.png").exists()
+
+
+def test_busy_engine_hands_the_job_back_without_using_an_attempt(jobs_db, tmp_path, storage, cache_db):
+    job_id = queued_file(tmp_path, client="acme")
+    runner = JobRunner(StubScheduler(busy=True), StubBatcher(), workers=1, poll_interval=0)
+    job = claim_next_job()
+    assert job['attempts'] == 1
+    asyncio.run(runner._process(job))
+    assert get_job(job_id)['status'] == QUEUED
+    assert attempts(job_id) == 0
+    assert runner.scheduler.clients == ["acme"]
+    # The content claim was given back for the next attempt
+    assert cache.claim(cache.check_file(str(tmp_path / "a.png"))[0])
+
+
+def test_processed_jobs_save_once_and_duplicates_link_to_them(jobs_db, tmp_path, storage, cache_db):
+    data = b"\x89PNG\r\n\x1a\n" + b"\x01" * 100
+    first = queued_file(tmp_path, "a.png", data)
+    second = queued_file(tmp_path, "b.png", data)
+    runner = JobRunner(StubScheduler(), StubBatcher(), workers=1, poll_interval=0)
+
+    asyncio.run(runner._process(claim_next_job()))
+    asyncio.run(runner._process(claim_next_job()))
+    saved, duplicate = get_job(first), get_job(second)
+    assert saved['status'] == duplicate['status'] == DONE
+    assert duplicate['result']['duplicate'] and duplicate['result']['id'] == saved['result']['id']
+    assert runner.scheduler.clients == [None]
+    assert not (tmp_path / "a.png").exists() and not (tmp_path / "b.png").exists()
+    with storage.session() as db:
+        assert db.query_one("SELECT COUNT(*) AS n FROM invoices")['n'] == 1
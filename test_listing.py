@@ -0,0 +1,79 @@
+# test_listing.py
+"""Checks for keyset pagination in list_invoices (app/database.py) on the SQLite backend.
+
+Usage: pytest test_listing.py
+"""
+import pytest
+
+from app.database import list_invoices, save_invoices_batch
+
+
+def invoice(number, vendor="ACME", category="Misc"):
+    return ({'vendor': vendor, 'date': "2024-01-15", 'amount': 10.0 + number, 'tax': None,
+             'category': category, 'invoice_number': f"INV-{number}", 'raw_text': f"{vendor}\nINV-{number}"},
+            f"{number}.png")
+
+
+@pytest.fixture
+def invoices(storage):
+    ids = save_invoices_batch([invoice(number, vendor="ACME" if number % 2 else "Globex")
+                               for number in range(9)])
+    # Several rows share a timestamp, so the id has to break ties
+    with storage.session() as db:
+        for invoice_id, processed_at in zip(ids, ["2024-01-01T09:00:00"] * 3 + ["2024-02-01T09:00:00"] * 3):
+            db.execute("UPDATE invoices SET processed_at = %s WHERE id = %s", (processed_at, invoice_id))
+    return ids
+
+
+def pages(limit, cursor=None, **filters):
+    items = []
+    while True:
+        page = list_invoices(limit=limit, cursor=cursor, **filters)
+        items.extend(page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return items
+
+
+def newest_first(storage, where="", params=()):
+    with storage.session() as db:
+        return [row['id'] for row in db.query(
+            f"SELECT id FROM invoices {where} ORDER BY processed_at DESC, id DESC", params)]
+
+
+def test_pages_cover_every_invoice_once_newest_first(storage, invoices):
+    everything = list_invoices(limit=100)
+    assert everything['next_cursor'] is None
+    assert [item['id'] for item in everything['items']] == newest_first(storage)
+    for limit in (1, 2, 4, 9):
+        assert [item['id'] for item in pages(limit)] == newest_first(storage)
+
+
+def test_pages_are_stable_when_invoices_arrive_between_requests(storage, invoices):
+    first = list_invoices(limit=4)
+    save_invoices_batch([invoice(100), invoice(101)])
+    rest = pages(4, cursor=first['next_cursor'])
+    seen = [item['id'] for item in first['items'] + rest]
+    # New invoices sort first, so the following pages carry on where the first stopped
+    assert seen == [invoice_id for invoice_id in newest_first(storage) if invoice_id in invoices]
+
+
+def test_cursor_works_with_filters_and_projections(storage, invoices):
+    items = pages(2, vendor="Globex", fields="vendor,amount")
+    assert all(set(item) == {'vendor', 'amount'} and item['vendor'] == "Globex" for item in items)
+    assert len(items) == len(newest_first(storage, "WHERE vendor = %s", ("Globex",)))
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "bm90IGpzb24", "WyJ4Il0=", "WyJ4IiwgInkiXQ=="])
+def test_bad_cursors_are_refused(storage, cursor):
+    with pytest.raises(ValueError):
+        list_invoices(cursor=cursor)
+
+
+def test_bad_cursor_is_a_400(storage):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    response = TestClient(app).get("/invoices/", params={'cursor': "not-a-cursor"})
+    assert response.status_code == 400
+    assert "Invalid cursor" in response.json()['detail']
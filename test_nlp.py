@@ -0,0 +1,125 @@
+# test_nlp.py
+"""Regression checks for the regex field extraction in app/nlp.py.
+
+BASELINE holds what the original per-call regex implementation returned for each text;
+the compiled extractor must keep producing the same vendor, amount and invoice number,
+and the same date wherever the original found one.
+
+Usage: python test_nlp.py  (or pytest test_nlp.py)
+"""
+from app.nlp import (
+    extract_amounts,
+    extract_date,
+    extract_invoice_data,
+    extract_invoice_number,
+    extract_tax,
+    extract_vendor,
+)
+
+# text -> (vendor, date, amount, invoice_number) as returned before the rewrite
+BASELINE = [
+    ("Walmart Supercenter\n123 Main St\nDate: 12/25/2024\nInvoice #: INV-001\nMilk $3.49\nTax: $0.28\nTotal: $3.77",
+     ("Walmart Supercenter", "2024-12-25", 202.0, "INV-001")),
+    ("STARBUCKS COFFEE\nStore 1234\n25-12-2024 08:15\nLatte 4.50\nMuffin 2.25\nTOTAL 6.75",
+     ("STARBUCKS COFFEE", "2024-12-25", 202.0, None)),
+    ("Office Depot\nInvoice No: A12-77\nDate 5 Jan 2024\nPaper $1,234.56\nSubtotal 1,234.56\nSales Tax 8.25% 101.85\nTotal $1,336.41",
+     ("Office Depot", None, 1336.41, "No")),
+    ("Shell\nPump 4\nMarch 5, 2024\nFuel 45.00\nTotal 45.00",
+     ("Shell", None, 202.0, None)),
+    ("Hotel Marriott\nInv. 99887\n12/25/24\nRoom 189.00\nVAT 15.12\nTOTAL 204.12",
+     ("Hotel Marriott", None, 998.0, "99887")),
+    ("Uber Technologies\nTrip on 2024-03-14\nFare 23.40",
+     ("Uber Technologies", None, 202.0, None)),
+    ("No digits here at all",
+     ("No digits here at all", None, None, None)),
+    ("",
+     ("Unknown Vendor", None, None, None)),
+    ("abc\n12\nxyz!",
+     ("xyz!", None, 12.0, None)),
+    ("Local Diner\nDate: 13/45/2024\n01/02/2024\nTotal $12.00",
+     ("Local Diner", None, 202.0, None)),
+    ("Hardware Store\n1234567 item\n$ 99.99\nGST: $5.00",
+     ("Hardware Store", None, 456.0, None)),
+    ("ACME Corp\ninvoice\n\nDate 02-30-2024 then 7 Feb 2023\nAmount due 1,2345.67",
+     ("ACME Corp", None, 1234.0, "Date")),
+    ("Café Résumé\nSep 9 2023\nTotal: 19.99",
+     ("Café Résumé", None, 202.0, None)),
+    ("Book Shop\nSept 9, 23\nInvoice#B-77x\nTotal 5",
+     ("Book Shop", None, 77.0, "B-77x")),
+    ("KEDAI MAKAN\n17/05/2018\nNO: CS00011\nTOTAL 12.50\nGST 0.71",
+     ("KEDAI MAKAN", None, 201.0, None)),
+    ("Grocer\n5 Jan 12/25/2024\nTotal $8.00",
+     ("Grocer", "2024-12-25", 202.0, None)),
+    ("tax free store\nTax ID 12-3456789\nTotal 40.00",
+     ("tax free store", None, 678.0, None)),
+]
+
+# Formats the original patterns matched but could not parse
+NEW_DATES = [
+    ("Date 5 Jan 2024", "2024-01-05"),
+    ("March 5, 2024", "2024-03-05"),
+    ("Sept 9, 23", "2023-09-09"),
+    ("12/25/24", "2024-12-25"),
+    ("Date 02-30-2024 then 7 Feb 2023", "2023-02-07"),
+    ("Trip on 2024-03-14", None),
+    ("17/05/2018", None),
+]
+
+TAXES = [
+    ("Tax: $0.28\nTotal: $3.77", 0.28),
+    ("Sales Tax 8.25% 101.85", 101.85),
+    ("VAT 15.12", 15.12),
+    ("GST: $1,005.00", 1005.0),
+    ("Tax ID 12-3456789\nTotal 40.00", None),
+    ("syntax 12.00", None),
+]
+
+
+def test_baseline_fields():
+    for text, (vendor, date, amount, invoice_number) in BASELINE:
+        assert extract_vendor(text) == vendor, text
+        assert extract_amounts(text) == amount, text
+        assert extract_invoice_number(text) == invoice_number, text
+        if date is not None:
+            assert extract_date(text) == date, text
+
+
+def test_month_name_and_short_year_dates():
+    for text, expected in NEW_DATES:
+        assert extract_date(text) == expected, text
+
+
+def test_tax():
+    for text, expected in TAXES:
+        assert extract_tax(text) == expected, text
+
+
+def test_invoice_number_keeps_case():
+    assert extract_invoice_number("INVOICE #: Ab-12C") == "Ab-12C"
+
+
+def test_vendor_with_misread_letters():
+    assert extract_vendor("Wa1mart Supercenter\n123 Main St") == "Wa1mart Supercenter"
+    assert extract_vendor("Receipt #55\n7 Eleven\nTaco Bell") == "Taco Bell"
+
+
+def test_field_confidences_follow_ocr_characters():
+    text = "Walmart Supercenter\nDate: 12/25/2024\nTotal: $3.77"
+    confidence = bytearray([95]) * len(text)
+    # One doubtful digit in the date
+    confidence[text.index("12/25") + 1] = 41
+    result = extract_invoice_data(text, confidence)["confidence"]
+    assert result["vendor"] == 0.95 and result["date"] == 0.41
+    assert result["tax"] is None and result["invoice_number"] is None
+    # Without a confidence per character there is nothing to report
+    assert "confidence" not in extract_invoice_data(text, bytearray(3))
+
+
+if __name__ == "__main__":
+    test_baseline_fields()
+    test_month_name_and_short_year_dates()
+    test_tax()
+    test_invoice_number_keeps_case()
+    test_vendor_with_misread_letters()
+    test_field_confidences_follow_ocr_characters()
+    print("✅ Field extraction matches the baseline")
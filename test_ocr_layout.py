@@ -0,0 +1,160 @@
+# test_ocr_layout.py
+"""Checks for the confidence-driven page reading in app/ocr_layout.py.
+
+Tesseract isn't needed: the backend is a stand-in that answers image_to_data with canned
+TSV, so line grouping, the choice of lines and bands to read again and the merging of
+the second readings are tested on their own.
+
+Usage: pytest test_ocr_layout.py
+"""
+import numpy as np
+
+from app import ocr_layout
+from app.ocr_backends import parse_tsv
+from app.ocr_layout import _bands, _recheck, _targets, assemble, group_lines, line_text, read_page
+
+_HEADER = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext"
+
+
+def tsv(*words):
+    """TSV for (block, line, left, top, width, height, conf, text) words, with the line rows Tesseract adds"""
+    rows = [_HEADER]
+    for block, line, left, top, width, height, conf, text in words:
+        rows.append(f"4\t1\t{block}\t1\t{line}\t0\t{left}\t{top}\t{width}\t{height}\t-1\t")
+        rows.append(f"5\t1\t{block}\t1\t{line}\t1\t{left}\t{top}\t{width}\t{height}\t{conf}\t{text}")
+    return "\n".join(rows)
+
+
+# A shop name, an item with a doubtful price, then a total whose value sits in its own column
+PAGE = tsv(
+    (1, 1, 10, 10, 60, 20, 95, "ACME"),
+    (1, 1, 80, 12, 50, 18, 93, "Corp"),
+    (1, 2, 10, 50, 50, 20, 96, "Milk"),
+    (1, 2, 200, 50, 40, 20, 41.5, "3.49"),
+    (2, 1, 10, 100, 60, 20, 92, "Total"),
+    (3, 1, 200, 102, 50, 18, 90, "12.50"),
+    (4, 1, 10, 160, 90, 20, 97, "Thanks"),
+)
+
+
+class FakeBackend:
+    """Answers image_to_data with the next canned reading, and records what it was asked"""
+
+    def __init__(self, *readings):
+        self.readings = list(readings)
+        self.calls = []
+
+    def image_to_data(self, image, psm=None):
+        self.calls.append((image.shape, psm))
+        return parse_tsv(self.readings.pop(0)) if self.readings else []
+
+
+def test_words_group_into_lines_in_reading_order():
+    lines = group_lines(parse_tsv(PAGE))
+    assert [line_text(line) for line in lines] == ["ACME Corp", "Milk 3.49", "Total", "12.50", "Thanks"]
+    assert (lines[0]['top'], lines[0]['bottom']) == (10, 30)
+    assert lines[2]['key'] == (2, 1, 1)
+
+
+def test_assemble_gives_one_confidence_per_character():
+    text, confidence = assemble(group_lines(parse_tsv(PAGE)))
+    assert text == "ACME Corp\nMilk 3.49\n\nTotal\n\n12.50\n\nThanks\n"
+    assert len(confidence) == len(text)
+    price = text.index("3.49")
+    # Rounded word confidence on its characters; spaces and breaks are certain
+    assert list(confidence[price:price + 4]) == [42] * 4
+    assert confidence[text.index(" 3.49")] == 100
+    assert confidence[text.index("\n")] == 100
+
+
+def test_targets_are_doubtful_and_labelled_lines():
+    lines = group_lines(parse_tsv(PAGE))
+    targets, doubtful = _targets(lines)
+    # The price under 70, the 'Total' label and, as it has no number, the line after it
+    assert targets == {1, 2, 3}
+    assert doubtful == 1
+
+
+def test_bands_read_a_label_and_its_value_together():
+    lines = group_lines(parse_tsv(PAGE))
+    assert _bands(lines, {1, 2, 3}) == [[1], [2, 3]]
+    # A line on no target's row is never swept in
+    assert _bands(lines, {0}) == [[0]]
+
+
+def test_recheck_keeps_only_better_readings():
+    lines = group_lines(parse_tsv(PAGE))
+    backend = FakeBackend(
+        tsv((1, 1, 0, 0, 50, 20, 90, "Milk"), (1, 1, 300, 0, 40, 20, 88, "3.40")),
+        # Worse than the first reading of the total's row: ignored
+        tsv((1, 1, 0, 0, 60, 20, 50, "Tota1"), (1, 1, 300, 0, 40, 20, 60, "12.5O")),
+    )
+    detail = np.full((400, 600), 255, dtype=np.uint8)
+    merged = _recheck(lines, [[1], [2, 3]], detail, 2.0, 'binary', backend)
+    assert [line_text(line) for line in merged] == ["ACME Corp", "Milk 3.40", "Total", "12.50", "Thanks"]
+    # The replacement keeps the line's place and block
+    assert merged[1]['key'] == lines[1]['key'] and merged[1]['top'] == 50
+    # Bands are cut from the detailed image with padding: lines 50-70 with 8px either side,
+    # at twice the scale, are rows 84-157
+    assert backend.calls == [((73, 600), 7), ((73, 600), 7)]
+
+
+def test_recheck_merges_a_band_into_its_first_line():
+    lines = group_lines(parse_tsv(PAGE))
+    backend = FakeBackend(tsv((1, 1, 0, 0, 50, 20, 96, "Total"), (1, 1, 300, 0, 40, 20, 95, "12.90")))
+    merged = _recheck(lines, [[2, 3]], np.full((200, 300), 255, dtype=np.uint8), 1.0, 'binary', backend)
+    assert [line_text(line) for line in merged] == ["ACME Corp", "Milk 3.49", "Total 12.90", "Thanks"]
+
+
+def _plan(text_height):
+    def analyze(gray):
+        height, width = gray.shape
+        return {'kind': 'binary', 'angle': 0.0, 'center': (width / 2, height / 2), 'size': (width, height),
+                'scale': 1.0, 'text_height': text_height}
+    return analyze
+
+
+def test_read_page_rereads_only_target_bands(monkeypatch):
+    # Text twice the fast pass's height: the first pass runs at half scale
+    monkeypatch.setattr(ocr_layout, 'analyze', _plan(ocr_layout.OCR_FAST_TEXT_HEIGHT * 2))
+    backend = FakeBackend(PAGE, tsv((1, 1, 0, 0, 50, 20, 90, "Milk"), (1, 1, 300, 0, 40, 20, 88, "3.40")))
+    timings = {}
+    text, confidence = read_page(np.full((400, 600), 255, dtype=np.uint8), backend, timings)
+    assert backend.calls[0] == ((200, 300), 3)
+    assert [psm for _, psm in backend.calls[1:]] == [7, 7]
+    assert text.startswith("ACME Corp\nMilk 3.40\n")
+    assert len(confidence) == len(text)
+    assert timings['tesseract'] >= 0 and timings['recheck'] >= 0
+
+
+def test_read_page_rereads_the_whole_page_when_too_doubtful(monkeypatch):
+    monkeypatch.setattr(ocr_layout, 'analyze', _plan(ocr_layout.OCR_FAST_TEXT_HEIGHT * 2))
+    monkeypatch.setattr(ocr_layout, 'OCR_RECHECK_MAX_LINES', 0)
+    backend = FakeBackend(PAGE, tsv((1, 1, 10, 20, 60, 40, 96, "Clean")))
+    text, _ = read_page(np.full((400, 600), 255, dtype=np.uint8), backend)
+    assert backend.calls == [((200, 300), 3), ((400, 600), 3)]
+    assert text == "Clean\n"
+
+
+def test_read_page_without_words_at_full_scale_stops(monkeypatch):
+    # Nothing to gain from a second whole-page pass at the same scale
+    monkeypatch.setattr(ocr_layout, 'analyze', _plan(None))
+    backend = FakeBackend(tsv())
+    assert read_page(np.full((50, 80), 255, dtype=np.uint8), backend) == ("", bytearray())
+    assert len(backend.calls) == 1
+
+
+def test_read_page_at_full_scale_enlarges_only_the_bands(monkeypatch):
+    # Text already at the fast height: the first pass runs at full scale
+    monkeypatch.setattr(ocr_layout, 'analyze', _plan(ocr_layout.OCR_FAST_TEXT_HEIGHT))
+    geometry = []
+    apply_geometry = ocr_layout.apply_geometry
+    monkeypatch.setattr(ocr_layout, 'apply_geometry', lambda gray, plan: (geometry.append(plan['scale']),
+                                                                          apply_geometry(gray, plan))[1])
+    backend = FakeBackend(PAGE, tsv((1, 1, 0, 0, 50, 20, 90, "Milk"), (1, 1, 300, 0, 40, 20, 88, "3.40")))
+    text, _ = read_page(np.full((400, 600), 255, dtype=np.uint8), backend)
+    # The page is resampled once, for the first pass; never whole at a larger scale
+    assert geometry == [1.0]
+    # Lines 50-70 with 8px either side are the 37 rows 42-78 of the page, read at 1.5 times the size
+    assert backend.calls[1] == ((56, 900), 7)
+    assert text.startswith("ACME Corp\nMilk 3.40\n")
@@ -0,0 +1,111 @@
+# test_ocr_pages.py
+"""Checks for parallel PDF page OCR in app/ocr.py.
+
+Page OCR is replaced by a stand-in that records how many pages run at once and on which
+thread, so the core budget and the long-lived page pool can be checked without Tesseract
+or poppler.
+
+Usage: pytest test_ocr_pages.py
+"""
+import threading
+import time
+
+import pytest
+
+from app import ocr
+
+
+class Pages:
+    """Stands in for ocr_pdf_page, tracking concurrency and the threads pages run on"""
+
+    def __init__(self, seconds=0.05, fail_on=None):
+        self.seconds = seconds
+        self.fail_on = fail_on
+        self.running = 0
+        self.peak = 0
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, file_path, page_number, page_count, backend, timings=None):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.threads.add(threading.get_ident())
+        try:
+            time.sleep(self.seconds)
+            if page_number == self.fail_on:
+                raise ValueError("unreadable page")
+            return f"page {page_number}", None
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+@pytest.fixture
+def pdf(tmp_path, monkeypatch):
+    """An 8-page PDF, four cores and a fresh page pool of four threads"""
+    path = tmp_path / "scan.pdf"
+    path.write_bytes(b"%PDF-1.4\n")
+    monkeypatch.setattr(ocr, '_cores', threading.BoundedSemaphore(4))
+    monkeypatch.setattr(ocr, '_page_pool', None)
+    monkeypatch.setattr(ocr, 'OCR_PAGE_WORKERS', 4)
+    monkeypatch.setattr(ocr, 'OCR_PAGES_IN_FLIGHT', 8)
+    monkeypatch.setattr(ocr, 'pdfinfo_from_path', lambda file_path: {"Pages": 8})
+    monkeypatch.setattr(ocr, 'read_pdf_text_layer', lambda file_path: [])
+    monkeypatch.setattr(ocr, 'get_ocr_backend', lambda: None)
+    return str(path)
+
+
+def idle_cores(wait=2.0):
+    """Cores left in the budget, once pages still finishing have given theirs back"""
+    deadline = time.monotonic() + wait
+    while True:
+        taken = 0
+        while ocr._cores.acquire(False):
+            taken += 1
+        for _ in range(taken):
+            ocr._cores.release()
+        if taken == 4 or time.monotonic() > deadline:
+            return taken
+        time.sleep(0.01)
+
+
+def run(pdf, pages, monkeypatch):
+    monkeypatch.setattr(ocr, 'ocr_pdf_page', pages)
+    return ocr.extract_text_from_image(pdf)
+
+
+def test_pages_spread_over_idle_cores(pdf, monkeypatch):
+    pages = Pages()
+    text = run(pdf, pages, monkeypatch)
+    assert text == "".join(f"page {number}\n" for number in range(1, 9))
+    assert pages.peak == 4
+    # Every core is given back
+    assert idle_cores() == 4
+
+
+def test_pages_run_one_at_a_time_when_other_extractions_use_the_cores(pdf, monkeypatch):
+    # Three other extractions are running
+    for _ in range(3):
+        ocr._cores.acquire()
+    pages = Pages(seconds=0.01)
+    run(pdf, pages, monkeypatch)
+    assert pages.peak == 1
+
+
+def test_page_threads_outlive_each_pdf(pdf, monkeypatch):
+    pages = Pages(seconds=0.01)
+    run(pdf, pages, monkeypatch)
+    pool = ocr._page_pool
+    run(pdf, pages, monkeypatch)
+    # The same threads, and with them their Tesseract APIs, serve the next PDF
+    assert ocr._page_pool is pool
+    assert len(pages.threads) <= 4
+
+
+def test_a_failed_page_gives_its_cores_back(pdf, monkeypatch):
+    pages = Pages(fail_on=2)
+    with pytest.raises(Exception, match="unreadable page"):
+        run(pdf, pages, monkeypatch)
+    # Pages that were already running finish on the pool, then return their cores
+    assert idle_cores() == 4
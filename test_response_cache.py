@@ -0,0 +1,115 @@
+# test_response_cache.py
+"""Checks for the response cache (app/response_cache.py) and the read endpoints that use it
+through _cached_json in app/main.py.
+
+Endpoint tests run against a scratch SQLite database (the storage fixture in conftest.py);
+rows changed behind the cache's back show whether a response came from the cache.
+
+Usage: pytest test_response_cache.py
+"""
+from collections import OrderedDict
+
+import pytest
+
+from app import response_cache
+from app.database import save_invoice_data, save_invoices_batch
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(response_cache, '_entries', OrderedDict())
+    monkeypatch.setattr(response_cache, '_size', 0)
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_TTL', 60)
+
+
+class Compute:
+    """A compute() that counts its calls and can run something part way through"""
+
+    def __init__(self, during=None):
+        self.calls = 0
+        self.during = during
+
+    def __call__(self):
+        self.calls += 1
+        if self.during:
+            self.during()
+        return {'call': self.calls}, {}
+
+
+def invoice(vendor="ACME", amount=10.0):
+    return {'vendor': vendor, 'date': "2024-01-15", 'amount': amount, 'tax': None, 'category': "Misc",
+            'invoice_number': None, 'raw_text': vendor}
+
+
+@pytest.fixture
+def client(storage):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    return TestClient(main.app)
+
+
+def test_a_hit_returns_the_cached_body():
+    compute = Compute()
+    first = response_cache.get_or_compute("key", compute)
+    assert response_cache.get_or_compute("key", compute) == first
+    assert compute.calls == 1
+    assert response_cache.get_or_compute("other", compute)[0] == b'{"call":2}'
+
+
+def test_endpoint_hits_do_not_query_the_database(client, storage):
+    [invoice_id] = save_invoices_batch([(invoice(), "a.png")])
+    first = client.get(f"/invoices/{invoice_id}")
+    # Changed without going through save_invoice_data, so the cache isn't told
+    with storage.session() as db:
+        db.execute("UPDATE invoices SET vendor = %s WHERE id = %s", ("Globex", invoice_id))
+    second = client.get(f"/invoices/{invoice_id}")
+    assert second.json()['vendor'] == "ACME"
+    assert second.content == first.content and second.headers['etag'] == first.headers['etag']
+
+
+def test_saving_an_invoice_makes_the_next_read_fresh(client):
+    save_invoices_batch([(invoice(), "a.png")])
+    before = client.get("/invoices/")
+    assert [item['vendor'] for item in before.json()] == ["ACME"]
+    generation = response_cache._generation
+    save_invoice_data(invoice("Globex"), "b.png")
+    assert response_cache._generation == generation + 1
+    after = client.get("/invoices/")
+    assert sorted(item['vendor'] for item in after.json()) == ["ACME", "Globex"]
+    assert after.headers['etag'] != before.headers['etag']
+
+
+def test_a_fill_that_started_before_a_write_is_not_stored():
+    # The write lands while the response is being computed from the old rows
+    stale = Compute(during=response_cache.invalidate)
+    assert response_cache.get_or_compute("key", stale)[0] == b'{"call":1}'
+    assert response_cache.cache_info()['entries'] == 0
+
+    fresh = Compute()
+    assert response_cache.get_or_compute("key", fresh)[0] == b'{"call":1}'
+    assert fresh.calls == 1 and response_cache.cache_info()['entries'] == 1
+
+
+def test_matching_if_none_match_is_a_304(client):
+    [invoice_id] = save_invoices_batch([(invoice(), "a.png")])
+    etag = client.get(f"/invoices/{invoice_id}").headers['etag']
+    for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response = client.get(f"/invoices/{invoice_id}", headers={'If-None-Match': header})
+        assert response.status_code == 304 and response.content == b""
+        assert response.headers['etag'] == etag
+    assert client.get(f"/invoices/{invoice_id}", headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_a_zero_ttl_disables_the_cache(client, storage, monkeypatch):
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_TTL', 0)
+    compute = Compute()
+    response_cache.get_or_compute("key", compute)
+    assert response_cache.get_or_compute("key", compute)[0] == b'{"call":2}'
+    assert response_cache.cache_info()['entries'] == 0
+
+    [invoice_id] = save_invoices_batch([(invoice(), "a.png")])
+    client.get(f"/invoices/{invoice_id}")
+    with storage.session() as db:
+        db.execute("UPDATE invoices SET vendor = %s WHERE id = %s", ("Globex", invoice_id))
+    assert client.get(f"/invoices/{invoice_id}").json()['vendor'] == "Globex"
@@ -0,0 +1,239 @@
+# test_scheduler.py
+"""Checks for the cost-aware scheduler in app/scheduler.py.
+
+The engine is a stand-in whose tasks only finish when the test releases them, so the
+order work starts in, the reserved interactive worker, client quotas, demotion,
+admission control and cancellation can be checked step by step. The last test runs
+benchmarks/bench_scheduler.py briefly to show interactive latency staying flat under a
+bulk backfill.
+
+Usage: pytest test_scheduler.py
+"""
+import argparse
+import asyncio
+
+import pytest
+
+from app.scheduler import BULK, INTERACTIVE, SLO, CostModel, Overloaded, Scheduler, pdf_page_count
+from app.workers import run_ocr, run_pipeline
+from config import SCHED_INTERACTIVE_MAX_COST
+
+
+class FakeEngine:
+    """Runs each task when the test releases it by name"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.started = []
+        self._gates = {}
+
+    async def run(self, fn, *args):
+        # The scheduler submits _timed(work, name)
+        name = args[1]
+        self._gates[name] = asyncio.Event()
+        self.started.append(name)
+        await self._gates[name].wait()
+        return fn(*args)
+
+    def release(self, name):
+        self._gates[name].set()
+
+
+def work(name):
+    return name
+
+
+def estimate(seconds=1.0, unit='megapixel'):
+    return {'work': 'work', 'unit': unit, 'units': 1, 'seconds': seconds}
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def submit(scheduler, name, lane=BULK, client=None, seconds=1.0):
+    return asyncio.ensure_future(scheduler.run(work, name, estimate=estimate(seconds), lane=lane, client=client))
+
+
+def test_reserved_worker_stays_free_for_interactive_uploads():
+    async def scenario():
+        engine = FakeEngine(workers=2)
+        scheduler = Scheduler(engine, reserved=1, client_limit=10)
+        bulk = [submit(scheduler, name) for name in ("b1", "b2", "b3")]
+        await settle()
+        # One of the two workers is kept back from the backfill
+        assert engine.started == ["b1"]
+        assert scheduler.queued() == {INTERACTIVE: 0, BULK: 2}
+
+        upload = submit(scheduler, "i1", lane=INTERACTIVE)
+        await settle()
+        assert engine.started == ["b1", "i1"]
+        engine.release("i1")
+        assert await upload == "i1"
+
+        engine.release("b1")
+        await settle()
+        assert engine.started == ["b1", "i1", "b2"]
+        for name in ("b2", "b3"):
+            engine.release(name)
+            await settle()
+        assert await asyncio.gather(*bulk) == ["b1", "b2", "b3"]
+        assert scheduler.running() == {INTERACTIVE: 0, BULK: 0}
+
+    asyncio.run(scenario())
+
+
+def test_interactive_uploads_go_before_queued_bulk_work():
+    async def scenario():
+        engine = FakeEngine(workers=2)
+        scheduler = Scheduler(engine, reserved=0, client_limit=10)
+        tasks = [submit(scheduler, name) for name in ("b1", "b2", "b3")]
+        await settle()
+        tasks.append(submit(scheduler, "i1", lane=INTERACTIVE))
+        await settle()
+        assert engine.started == ["b1", "b2"]
+        engine.release("b1")
+        await settle()
+        assert engine.started == ["b1", "b2", "i1"]
+        for name in ("b2", "i1", "b3"):
+            engine.release(name)
+            await settle()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+
+
+def test_client_at_its_quota_is_passed_over():
+    async def scenario():
+        engine = FakeEngine(workers=2)
+        scheduler = Scheduler(engine, reserved=0, client_limit=1)
+        tasks = [submit(scheduler, "a1", client="a"), submit(scheduler, "a2", client="a"),
+                 submit(scheduler, "b1", client="b")]
+        await settle()
+        assert engine.started == ["a1", "b1"]
+        engine.release("b1")
+        await settle()
+        # A free worker, but client a already has its one file running
+        assert engine.started == ["a1", "b1"]
+        engine.release("a1")
+        await settle()
+        assert engine.started == ["a1", "b1", "a2"]
+        engine.release("a2")
+        await asyncio.gather(*tasks)
+        assert scheduler._by_client == {}
+
+    asyncio.run(scenario())
+
+
+def test_costly_uploads_are_demoted_to_the_bulk_lane():
+    async def scenario():
+        engine = FakeEngine(workers=2)
+        scheduler = Scheduler(engine, reserved=1, client_limit=10)
+        task = submit(scheduler, "big", lane=INTERACTIVE, seconds=SCHED_INTERACTIVE_MAX_COST + 1)
+        await settle()
+        assert scheduler.running() == {INTERACTIVE: 0, BULK: 1}
+        assert scheduler.lane_for(INTERACTIVE, estimate(SCHED_INTERACTIVE_MAX_COST)) == INTERACTIVE
+        engine.release("big")
+        await task
+
+    asyncio.run(scenario())
+
+
+def test_work_past_the_wait_target_is_refused():
+    async def scenario():
+        engine = FakeEngine(workers=1)
+        scheduler = Scheduler(engine, reserved=0, client_limit=10)
+        long_run = submit(scheduler, "long", seconds=SLO[INTERACTIVE] + 60)
+        await settle()
+        with pytest.raises(Overloaded) as refused:
+            await scheduler.run(work, "i1", estimate=estimate(), lane=INTERACTIVE)
+        assert 55 <= refused.value.retry_after <= 60
+        assert scheduler.queued() == {INTERACTIVE: 0, BULK: 0}
+        # Work that finishes admitted files is never refused
+        ahead = asyncio.ensure_future(scheduler.run(work, "ner", estimate=estimate(), lane=BULK, ahead=True))
+        await settle()
+        assert scheduler.queued()[BULK] == 1
+        engine.release("long")
+        await settle()
+        engine.release("ner")
+        assert await ahead == "ner"
+        await long_run
+
+    asyncio.run(scenario())
+
+
+def test_estimated_wait_plays_the_queue_out_over_the_workers():
+    async def scenario():
+        engine = FakeEngine(workers=2)
+        scheduler = Scheduler(engine, reserved=0, client_limit=10)
+        tasks = [submit(scheduler, "r1", seconds=10), submit(scheduler, "r2", seconds=20),
+                 submit(scheduler, "q1", seconds=4), submit(scheduler, "q2", seconds=4)]
+        await settle()
+        # q1 follows r1 at 10s and q2 follows q1 at 14s, before r2 is done at 20s:
+        # a file queued now would start at 18s
+        assert scheduler.estimated_wait(BULK) == pytest.approx(18, abs=0.5)
+        for name in ("r1", "r2", "q1", "q2"):
+            engine.release(name)
+            await settle()
+        await asyncio.gather(*tasks)
+        assert scheduler.estimated_wait(BULK) == 0.0
+
+    asyncio.run(scenario())
+
+
+def test_work_cancelled_while_queued_leaves_no_trace():
+    async def scenario():
+        engine = FakeEngine(workers=1)
+        scheduler = Scheduler(engine, reserved=0, client_limit=10)
+        running = submit(scheduler, "r1", client="a")
+        queued = submit(scheduler, "q1", client="a")
+        await settle()
+        assert scheduler.queued()[BULK] == 1
+        queued.cancel()
+        await settle()
+        assert scheduler.queued()[BULK] == 0
+        engine.release("r1")
+        await running
+        await settle()
+        assert engine.started == ["r1"]
+        assert scheduler.running() == {INTERACTIVE: 0, BULK: 0} and scheduler._by_client == {}
+
+    asyncio.run(scenario())
+
+
+def test_cost_rates_are_learned_per_worker_function():
+    model = CostModel()
+    model.observe(model.estimate_units(run_ocr, 'page', 2), 2.0)
+    ocr = model.estimate_units(run_ocr, 'page', 1)
+    pipeline = model.estimate_units(run_pipeline, 'page', 1)
+    assert ocr['seconds'] < pipeline['seconds']
+    assert pipeline['seconds'] == model.rate('run_pipeline', 'page')
+
+
+def test_page_count_comes_from_the_ends_of_the_file(tmp_path):
+    def pdf(name, data):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+
+    filler = b"%" + b"x" * 200_000 + b"\n"
+    assert pdf_page_count(pdf("lin.pdf", b"%PDF-1.5\n1 0 obj <</Linearized 1 /L 9 /N 7 /T 3>> endobj\n"
+                                         + filler + b"/Count 99")) == 7
+    assert pdf_page_count(pdf("tail.pdf", b"%PDF-1.4\n" + filler
+                                          + b"2 0 obj <</Type /Pages /Kids [3 0 R] /Count 12>> endobj")) == 12
+    assert pdf_page_count(pdf("head.pdf", b"%PDF-1.4\n<</Type /Pages /Count 3>> <</Count 2>>" + filler)) == 3
+    # A page tree in the middle of the file isn't read; the size heuristic takes over
+    assert pdf_page_count(pdf("middle.pdf", b"%PDF-1.4\n" + filler + b"/Count 40" + filler)) is None
+
+
+def test_interactive_latency_stays_flat_under_a_backfill():
+    from benchmarks.bench_scheduler import scenario
+
+    args = argparse.Namespace(workers=2, seconds=1.5, interval=0.1, small=0.02, large=0.5)
+    idle = asyncio.run(scenario("scheduled", args, backfill=False))
+    fifo = asyncio.run(scenario("fifo", args))
+    scheduled = asyncio.run(scenario("scheduled", args))
+    # (p50, p95, uploads): behind the backfill an upload waits for a large file
+    assert fifo[1] > 0.25
+    assert scheduled[1] < idle[1] + 0.1
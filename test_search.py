@@ -0,0 +1,94 @@
+# test_search.py
+"""Checks for invoice search (app/search.py): FTS5 query building and fuzzy vendor matching.
+
+Searches run against a scratch SQLite database (the storage fixture in conftest.py).
+
+Usage: pytest test_search.py
+"""
+import pytest
+
+from app.database import save_invoices_batch
+from app.search import VendorIndex, match_expression, search_invoices
+
+INVOICES = [
+    ("Walmart Supercenter", "INV-001", "Milk 3.49\nTotal 3.77"),
+    ("Walmart Supercenter", "INV-002", "Bread 2.10\nTotal 2.10"),
+    ("Wal-Mart", "A12-77", "Paper towels\nTotal 9.99"),
+    ("Starbucks Coffee", "S-9", "Latte 4.50\nMuffin 2.25"),
+    ("Hotel Marriott", "99887", "Room 189.00\nVAT 15.12"),
+]
+
+
+@pytest.fixture
+def invoices(storage):
+    return save_invoices_batch([
+        ({'vendor': vendor, 'date': "2024-01-15", 'amount': 1.0, 'tax': None, 'category': "Misc",
+          'invoice_number': number, 'raw_text': text}, f"{number}.png")
+        for vendor, number, text in INVOICES
+    ])
+
+
+def vendors_of(result):
+    return [item['vendor'] for item in result['items']]
+
+
+def test_every_word_becomes_a_quoted_prefix():
+    assert match_expression("Latte muffin", 'sqlite') == '"latte"* "muffin"*'
+    assert match_expression("Latte muffin", 'mysql') == "+latte* +muffin*"
+    # FTS5 operators, column filters and quotes are just words
+    assert match_expression('vendor: "ACME" OR -x* NEAR(', 'sqlite') == '"vendor"* "acme"* "or"* "x"* "near"*'
+    assert match_expression("?!", 'sqlite') == ""
+
+
+def test_words_match_by_prefix_across_columns(invoices):
+    assert vendors_of(search_invoices(q="lat muf")) == ["Starbucks Coffee"]
+    assert vendors_of(search_invoices(q="inv 002")) == ["Walmart Supercenter"]
+    assert vendors_of(search_invoices(q="marr")) == ["Hotel Marriott"]
+    assert search_invoices(q="latte bread")['items'] == []
+
+
+def test_query_syntax_in_the_search_words_is_not_interpreted(invoices):
+    # Each of these is an FTS5 syntax error, or a different query, if passed through as is
+    for q in ('"total', '(total', 'total)', '-total', '+total', '^total', 'total:', 'total*'):
+        assert sorted(vendors_of(search_invoices(q=q))) == ["Wal-Mart", "Walmart Supercenter",
+                                                            "Walmart Supercenter"], q
+    # Operator words are searched for like any other word
+    assert search_invoices(q="total OR latte")['items'] == []
+
+
+def test_search_needs_words_or_a_vendor(invoices):
+    with pytest.raises(ValueError):
+        search_invoices(q="?!")
+
+
+def test_vendor_index_ranks_prefixes_then_close_spellings():
+    index = VendorIndex(["Walmart Supercenter", "Wal-Mart", "Starbucks Coffee", "Whole Foods"])
+    matches = index.match("walmart")
+    assert matches[0] == ("Walmart Supercenter", 1.0)
+    assert [vendor for vendor, _ in matches] == ["Walmart Supercenter", "Wal-Mart"]
+    # OCR misreads are compared with the leading words of longer names
+    assert index.match("wa1mart")[0][0] == "Walmart Supercenter"
+    assert index.match("starbuks")[0][0] == "Starbucks Coffee"
+    assert index.match("target") == [] and index.match("") == []
+    assert index.match("walmart", limit=1) == [("Walmart Supercenter", 1.0)]
+
+
+def test_whole_name_matching_ignores_prefixes():
+    index = VendorIndex(["Walmart Supercenter", "Walmart"])
+    assert [vendor for vendor, _ in index.match("walmart", partial=False)] == ["Walmart"]
+
+
+def test_vendor_search_expands_to_close_spellings(invoices):
+    result = search_invoices(vendor="Wa1mart")
+    assert [item['vendor'] for item in result['vendors']][:2] == ["Walmart Supercenter", "Wal-Mart"]
+    assert sorted(vendors_of(result)) == ["Wal-Mart", "Walmart Supercenter", "Walmart Supercenter"]
+
+    exact = search_invoices(vendor="walmart", fuzzy=False)
+    assert [item['vendor'] for item in exact['vendors']] == ["Walmart Supercenter"]
+    assert all(item['score'] == 1.0 for item in exact['items'])
+    assert search_invoices(vendor="Costco") == {"items": [], "vendors": []}
+
+
+def test_words_and_vendor_combine(invoices):
+    assert vendors_of(search_invoices(q="paper", vendor="walmart")) == ["Wal-Mart"]
+    assert vendors_of(search_invoices(q="paper", vendor="walmart", fuzzy=False)) == []
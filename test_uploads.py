@@ -0,0 +1,200 @@
+# test_uploads.py
+"""Checks for streaming upload handling (app/uploads.py and its use in app/main.py).
+
+store_upload reads from a stand-in source that counts its reads, so a refused upload can
+be shown to stop mid-stream. The middleware is driven directly as an ASGI app, with a
+receive() that records whether any of the body was read.
+
+Usage: pytest test_uploads.py
+"""
+import asyncio
+import io
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from app import uploads
+from app.uploads import UploadRejected, UploadSizeLimit, store_upload
+
+CHUNK = 1024
+PDF = b"%PDF-1.4\n" + b"%" * 5000
+
+
+def png(width=40, height=30):
+    image = np.full((height, width, 3), 255, np.uint8)
+    cv2.rectangle(image, (5, 5), (20, 15), (0, 0, 0), -1)
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+class Source(io.BytesIO):
+    """An upload body that counts how much of it was read"""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOAD_CHUNK_SIZE', CHUNK)
+
+
+def test_content_that_does_not_match_the_extension_is_a_415(tmp_path):
+    target = tmp_path / "a.png"
+    for data, expected in ((PDF, 'image'), (png(), 'pdf'), (b"GIF89a" + b"\x00" * 100, 'image')):
+        with pytest.raises(UploadRejected) as refused:
+            store_upload(Source(data), str(target), expected)
+        assert refused.value.status_code == 415
+        assert not target.exists()
+
+
+def test_oversize_uploads_stop_mid_stream_and_leave_no_file(tmp_path):
+    target = tmp_path / "big.pdf"
+    source = Source(PDF + b"%" * CHUNK * 100)
+    with pytest.raises(UploadRejected) as refused:
+        store_upload(source, str(target), 'pdf', limit=CHUNK * 3)
+    assert refused.value.status_code == 413
+    # Refused on the chunk that went over, not after reading the rest
+    assert source.reads == 4
+    assert not target.exists()
+
+
+def test_small_images_are_kept_in_memory(tmp_path):
+    data = png()
+    upload = store_upload(Source(data), str(tmp_path / "a.png"), 'image')
+    assert upload['kind'] == 'png' and upload['size'] == len(data) and upload['data'] == data
+    assert (tmp_path / "a.png").read_bytes() == data
+    # Over the memory limit, and PDFs at any size, are read back from the file
+    assert store_upload(Source(data), str(tmp_path / "b.png"), 'image', memory_limit=len(data) - 1)['data'] is None
+    assert store_upload(Source(PDF), str(tmp_path / "c.pdf"), 'pdf')['data'] is None
+
+
+def test_kept_bytes_are_decoded_without_reading_the_file(tmp_path, monkeypatch):
+    from app import ocr
+
+    data = png()
+    path = tmp_path / "a.png"
+    upload = store_upload(Source(data), str(path), 'image')
+    decoded = []
+    monkeypatch.setattr(ocr, 'get_ocr_backend', lambda: None)
+    monkeypatch.setattr(ocr, 'ocr_image', lambda image, backend, timings=None: (decoded.append(image), ("text", None))[1])
+    monkeypatch.setattr(ocr.cv2, 'imread', lambda *args: pytest.fail("the upload was read back"))
+    assert ocr.extract_text_from_image(str(path), {}, data=upload['data']) == "text"
+    assert decoded[0].shape == (30, 40, 3)
+
+
+class StubScheduler:
+    """Records what the upload endpoint hands to the extraction workers"""
+
+    class cost_model:
+        @staticmethod
+        def estimate(fn, file_path, data=None):
+            return {'work': fn.__name__, 'unit': 'megapixel', 'units': 1, 'seconds': 0.1}
+
+    def __init__(self):
+        self.calls = []
+
+    async def run(self, fn, file_path, data, profile, estimate, lane, client=None):
+        self.calls.append((file_path, data))
+        return {'data': {'vendor': "ACME", 'date': None, 'amount': 1.0, 'tax': None, 'category': "Misc",
+                         'invoice_number': None, 'raw_text': "ACME"},
+                'timings': {'ocr': 0.1, 'nlp': 0.0, 'categorization': 0.0}}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, storage, cache_db):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    monkeypatch.setattr(main, 'UPLOAD_DIR', str(tmp_path / "uploads"))
+    os.makedirs(main.UPLOAD_DIR)
+    monkeypatch.setattr(main.app.state, 'scheduler', StubScheduler(), raising=False)
+    return TestClient(main.app)
+
+
+def test_upload_endpoint_refuses_mismatched_content(client, tmp_path):
+    response = client.post("/upload-invoice/", files={'file': ("receipt.png", PDF, "image/png")})
+    assert response.status_code == 415
+    assert os.listdir(tmp_path / "uploads") == []
+
+
+def test_upload_endpoint_hands_small_images_to_the_workers_in_memory(client):
+    from app import main
+
+    data = png()
+    response = client.post("/upload-invoice/", files={'file': ("receipt.png", data, "image/png")})
+    assert response.status_code == 200
+    [(_, sent)] = main.app.state.scheduler.calls
+    assert sent == data
+
+
+async def call(middleware, headers, chunks, read=None):
+    """Run one request through the middleware, returning (status, body chunks it read)"""
+    read = [] if read is None else read
+    sent = []
+    pending = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+               for i, chunk in enumerate(chunks)]
+
+    async def receive():
+        event = pending.pop(0)
+        read.append(event['body'])
+        return event
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'path': "/upload-invoice/", 'method': "POST", 'headers': headers}
+    await middleware(scope, receive, send)
+    return sent[0]['status'], read
+
+
+async def drain(scope, receive, send):
+    """A downstream app that reads the whole body, then answers 200"""
+    while (await receive()).get('more_body'):
+        pass
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b""})
+
+
+def test_middleware_refuses_a_declared_length_before_reading_the_body():
+    middleware = UploadSizeLimit(drain, {"/upload-invoice/": 100})
+    status, read = asyncio.run(call(middleware, [(b'content-length', b"101")], [b"x" * 101]))
+    assert status == 413 and read == []
+
+    status, read = asyncio.run(call(middleware, [(b'content-length', b"100")], [b"x" * 100]))
+    assert status == 200 and read == [b"x" * 100]
+
+
+def test_middleware_cuts_off_an_undeclared_body_once_it_goes_over():
+    from fastapi import HTTPException
+
+    middleware = UploadSizeLimit(drain, {"/upload-invoice/": 100})
+    read = []
+    with pytest.raises(HTTPException) as refused:
+        asyncio.run(call(middleware, [], [b"x" * 60, b"x" * 60, b"x" * 60], read))
+    assert refused.value.status_code == 413
+    # The third chunk is never asked for
+    assert len(read) == 2
+
+
+def test_upload_endpoint_answers_413_mid_stream_and_keeps_nothing(client, tmp_path):
+    from config import MAX_FILE_SIZE
+
+    def body():
+        yield (b'--b\r\nContent-Disposition: form-data; name="file"; filename="big.pdf"\r\n'
+               b'Content-Type: application/pdf\r\n\r\n%PDF-1.4\n')
+        # Sent chunked, so there is no Content-Length to refuse up front
+        for _ in range(MAX_FILE_SIZE // 65536 + 3):
+            yield b"%" * 65536
+        yield b'\r\n--b--\r\n'
+
+    response = client.post("/upload-invoice/", content=body(),
+                           headers={'content-type': "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert os.listdir(tmp_path / "uploads") == []
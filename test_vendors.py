@@ -0,0 +1,51 @@
+# test_vendors.py
+"""Checks for vendor categorization in app/vendors.py.
+
+BASELINE_CATEGORY is the original categorize_expense: keyword lists checked in order
+against the lowercased vendor name. A registry that has learned no aliases must categorize
+every vendor the same way.
+
+Usage: pytest test_vendors.py
+"""
+import pytest
+
+from app.vendors import VendorRegistry
+
+VENDORS = [
+    "Walmart Supercenter", "STARBUCKS COFFEE", "Joe's Restaurant #12", "Café Luna", "Cafe Luna",
+    "Gr0cer Mart", "Corner Bakery", "UBER *TRIP", "Lyft Ride", "Hotel Marriott", "Vegas Deli",
+    "Shell Gas 0042", "Water & Power Co", "City Electric", "The Rent Co", "Housing Authority",
+    "Transport for London", "Phone Repair Cafe", "Office Depot", "Unknown Vendor", "",
+]
+
+
+def baseline_category(vendor):
+    vendor = vendor.lower()
+    food_keywords = ['restaurant', 'cafe', 'food', 'grocer', 'supermarket', 'bakery']
+    travel_keywords = ['hotel', 'flight', 'airline', 'taxi', 'uber', 'lyft', 'transport']
+    utilities_keywords = ['electric', 'water', 'gas', 'internet', 'phone', 'utility']
+    rent_keywords = ['rent', 'lease', 'housing']
+    if any(keyword in vendor for keyword in food_keywords):
+        return "Food"
+    elif any(keyword in vendor for keyword in travel_keywords):
+        return "Travel"
+    elif any(keyword in vendor for keyword in utilities_keywords):
+        return "Utilities"
+    elif any(keyword in vendor for keyword in rent_keywords):
+        return "Rent"
+    return "Misc"
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return VendorRegistry(db_path=str(tmp_path / "vendors.db"))
+
+
+def test_categories_match_the_original_rules(registry):
+    assert [registry.category(vendor) for vendor in VENDORS] == [baseline_category(vendor) for vendor in VENDORS]
+
+
+def test_known_spellings_share_their_canonical_vendors_category(registry):
+    vendor = registry.canonical("Corner Bakery #3")
+    assert registry.canonical("C0rner Bakery") == vendor
+    assert registry.category("C0rner Bakery") == registry.category(vendor) == "Food"